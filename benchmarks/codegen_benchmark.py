@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试：比较代码生成后端的耗时和峰值内存
+
+对生成的大型模块先做完整混淆(重命名和平坦化)，再分别测量:
+1. astor / unparse 两种后端由AST生成完整源代码字符串的耗时
+2. 整体生成后写入文件与流式写入文件的峰值内存(tracemalloc)
+
+同时检查流式输出与整体生成的源代码完全一致。
+"""
+
+import argparse
+import ast
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+# 添加项目根目录到路径，以便能够导入mods模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.engine_benchmark import generate_module, run_fused
+from mods.codegen import generate_source, resolve_backend, write_source
+
+
+class _NullWriter:
+    """只统计写入字符数的输出流，避免把写入的内容计入峰值内存"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text)
+
+
+def measure_time(tree, backend, repeat):
+    """返回生成完整源代码的最短耗时(秒)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        generate_source(tree, backend)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_peak(tree, backend, stream):
+    """返回写出源代码过程中的峰值内存(字节)"""
+    tracemalloc.start()
+    if stream:
+        write_source(tree, _NullWriter(), backend)
+    else:
+        _NullWriter().write(generate_source(tree, backend))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='代码生成后端基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 800],
+                        help='生成模块中函数和类的组数列表 (默认: 50 200 800)')
+    parser.add_argument('--repeat', type=int, default=3, help='重复测量次数 (默认: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子 (默认: 0)')
+    args = parser.parse_args()
+
+    backends = ['astor']
+    try:
+        backends.append(resolve_backend('unparse'))
+    except ValueError as e:
+        print(f"跳过unparse: {e}")
+
+    print("生成完整源代码耗时 (毫秒)")
+    print(f"{'组数':>6} {'源代码行数':>10}" + ''.join(f" {backend:>10}" for backend in backends))
+    trees = {}
+    for size in args.sizes:
+        source = generate_module(size)
+        trees[size] = run_fused(ast.parse(source), args.seed)
+        times = [measure_time(trees[size], backend, args.repeat) for backend in backends]
+        print(f"{size:>6} {source.count(chr(10)):>14}" + ''.join(f" {t * 1000:>10.1f}" for t in times))
+
+    print()
+    print("写出源代码的峰值内存 (KB)")
+    print(f"{'组数':>6} {'后端':>8} {'整体生成':>10} {'流式输出':>10} {'输出一致':>8}")
+    for size, tree in trees.items():
+        for backend in backends:
+            whole = measure_peak(tree, backend, stream=False)
+            streamed = measure_peak(tree, backend, stream=True)
+            buffer = io.StringIO()
+            write_source(tree, buffer, backend)
+            same = buffer.getvalue() == generate_source(tree, backend)
+            print(f"{size:>6} {backend:>10} {whole / 1024:>14.0f} {streamed / 1024:>14.0f} {'是' if same else '否':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试：比较平坦化状态机中线性if链与二分比较树的分发开销
+
+1. 随机跳转：状态按预先生成的随机序列转移，模拟深层平坦化后带回边的状态机，
+   测量每次状态转移的平均耗时
+2. 顺序执行：对由大量直线语句组成的函数进行平坦化，测量每条语句的平均耗时
+"""
+
+import argparse
+import ast
+import os
+import random
+import sys
+import timeit
+
+# 添加项目根目录到路径，以便能够导入mods模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mods.confuser import CodeFlattener
+
+
+def build_random_machine(num_states, dispatch):
+    """生成按随机序列跳转的状态机函数"""
+    flattener = CodeFlattener(dispatch=dispatch)
+    cases = []
+    for state in range(num_states):
+        body = ast.parse(f"_k += 1\n{flattener.state_var} = _seq[_k]").body
+        cases.append((state, body))
+
+    func = ast.parse("def run(_seq):\n    _k = 0").body[0]
+    func.body.extend(flattener.build_dispatch(cases, has_back_edges=True))
+    module = ast.Module(body=[func], type_ignores=[])
+    ast.fix_missing_locations(module)
+
+    namespace = {}
+    exec(compile(module, '<dispatch-benchmark>', 'exec'), namespace)
+    return namespace['run']
+
+
+def build_sequential_function(num_statements, dispatch):
+    """生成由直线语句组成并经过平坦化的函数"""
+    lines = ["def run(x):"]
+    lines.extend(f"    x = x + {i}" for i in range(num_statements))
+    lines.append("    return x")
+    module = ast.parse("\n".join(lines))
+
+    flattener = CodeFlattener(dispatch=dispatch)
+    module = flattener.visit(module)
+    ast.fix_missing_locations(module)
+
+    namespace = {}
+    exec(compile(module, '<dispatch-benchmark>', 'exec'), namespace)
+    return namespace['run']
+
+
+def bench_random(sizes, transitions, repeat):
+    """随机跳转场景的测量"""
+    print("【随机跳转】每次状态转移的平均耗时 (纳秒)")
+    print(f"{'状态数':>8} {'linear':>12} {'binary':>12} {'加速比':>8}")
+    for size in sizes:
+        rng = random.Random(size)
+        seq = [rng.randrange(size) for _ in range(transitions)] + [-1]
+        # 第一个状态固定为0，序列从第二次转移开始
+        seq[0] = 0
+        results = {}
+        for dispatch in ('linear', 'binary'):
+            func = build_random_machine(size, dispatch)
+            best = min(timeit.repeat(lambda: func(seq), number=1, repeat=repeat))
+            results[dispatch] = best / transitions * 1e9
+        print(f"{size:>8} {results['linear']:>12.1f} {results['binary']:>12.1f} "
+              f"{results['linear'] / results['binary']:>7.2f}x")
+
+
+def bench_sequential(sizes, repeat):
+    """顺序执行场景的测量"""
+    print("\n【顺序执行】每条语句的平均耗时 (纳秒)")
+    print(f"{'语句数':>8} {'linear':>12} {'binary':>12} {'auto':>12}")
+    for size in sizes:
+        results = {}
+        for dispatch in ('linear', 'binary', 'auto'):
+            func = build_sequential_function(size, dispatch)
+            best = min(timeit.repeat(lambda: func(0), number=100, repeat=repeat))
+            results[dispatch] = best / 100 / (size + 1) * 1e9
+        print(f"{size:>8} {results['linear']:>12.1f} {results['binary']:>12.1f} {results['auto']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='平坦化状态分发方式基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8, 32, 128, 512],
+                        help='状态数量列表 (默认: 8 32 128 512)')
+    parser.add_argument('--transitions', type=int, default=20000, help='随机跳转次数 (默认: 20000)')
+    parser.add_argument('--repeat', type=int, default=5, help='重复测量次数 (默认: 5)')
+    args = parser.parse_args()
+
+    bench_random(args.sizes, args.transitions, args.repeat)
+    bench_sequential(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试：比较逐遍处理与单次遍历引擎的重命名和平坦化耗时
+
+对生成的大型模块(包含模块级函数、类方法和嵌套函数)分别执行:
+1. passes: 函数名混淆、变量名混淆、平坦化各遍历一次AST，每遍之后补全位置信息
+2. fused: 一次分析遍历收集所有决策，一次改写完成重命名和平坦化
+
+两种方式使用相同的随机种子，并检查生成的源代码完全一致。
+"""
+
+import argparse
+import ast
+import os
+import random
+import sys
+import time
+
+# 添加项目根目录到路径，以便能够导入mods模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import astor
+
+from mods.confuser import CodeFlattener
+from mods.fused_engine import fused_obfuscate
+from mods.name_obfuscator import obfuscate_function_names, obfuscate_variable_names
+
+
+FUNCTION_TEMPLATE = '''
+def compute_{i}(data, scale):
+    total = 0
+    count = 0
+    for item in data:
+        if item % 3 == 0:
+            total += item * scale
+        else:
+            total -= item
+        count += 1
+    result = total / max(count, 1)
+    return helper_{i}(result)
+
+
+def helper_{i}(value):
+    temp = value * 2
+    return temp + 1
+
+
+class Worker{i}:
+    def __init__(self, size):
+        self.size = size
+        self.items = list(range(size))
+
+    def run(self, factor):
+        acc = 0
+        for value in self.items:
+            acc += compute_{i}([value], factor)
+        return acc
+
+    def make_adder(self, base):
+        offset = base + self.size
+        def add(x):
+            shifted = x + offset
+            return shifted
+        return add
+'''
+
+
+def generate_module(num_units):
+    """生成包含num_units组函数和类的模块源代码"""
+    return ''.join(FUNCTION_TEMPLATE.format(i=i) for i in range(num_units))
+
+
+def run_passes(tree, seed):
+    random.seed(seed)
+    flattener = CodeFlattener()
+    tree, _ = obfuscate_function_names(tree)
+    ast.fix_missing_locations(tree)
+    tree, _ = obfuscate_variable_names(tree)
+    ast.fix_missing_locations(tree)
+    tree = flattener.visit(tree)
+    ast.fix_missing_locations(tree)
+    return tree
+
+
+def run_fused(tree, seed):
+    random.seed(seed)
+    flattener = CodeFlattener()
+    tree, _, _, _ = fused_obfuscate(tree, flattener)
+    return tree
+
+
+def measure(runner, source, repeat, seed):
+    """返回最短耗时(秒)和最后一次的结果树，解析时间不计入"""
+    best = None
+    tree = None
+    for _ in range(repeat):
+        tree = ast.parse(source)
+        start = time.perf_counter()
+        tree = runner(tree, seed)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description='逐遍处理与单次遍历引擎基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 800],
+                        help='生成模块中函数和类的组数列表 (默认: 50 200 800)')
+    parser.add_argument('--repeat', type=int, default=3, help='重复测量次数 (默认: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子 (默认: 0)')
+    args = parser.parse_args()
+
+    print("重命名和平坦化耗时 (毫秒)")
+    print(f"{'组数':>6} {'源代码行数':>10} {'passes':>10} {'fused':>10} {'加速比':>8} {'输出一致':>8}")
+    for size in args.sizes:
+        source = generate_module(size)
+        passes_time, passes_tree = measure(run_passes, source, args.repeat, args.seed)
+        fused_time, fused_tree = measure(run_fused, source, args.repeat, args.seed)
+        same = astor.to_source(passes_tree) == astor.to_source(fused_tree)
+        print(f"{size:>6} {source.count(chr(10)):>14} {passes_time * 1000:>10.1f} {fused_time * 1000:>10.1f} "
+              f"{passes_time / fused_time:>9.2f}x {'是' if same else '否':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试：比较随机名称与最短名称两种命名方式的输出大小
+
+对生成的大型模块分别以naming='random'和naming='short'完整混淆，比较:
+1. 生成的源代码大小
+2. 编译后代码对象序列化(marshal，即pyc的主体)的大小
+3. 所有代码对象的co_names/co_varnames/co_cellvars/co_freevars中不同名称的总长度
+4. 混淆耗时(含名称缩短)
+
+同时执行两种结果中的函数，检查行为一致。
+"""
+
+import argparse
+import marshal
+import os
+import random
+import sys
+import time
+import types
+
+# 添加项目根目录到路径，以便能够导入mods模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.engine_benchmark import generate_module
+from mods.complete_obfuscator import CompletePythonObfuscator
+from mods.codegen import generate_source
+
+
+def code_names(code):
+    """递归收集代码对象及其内层代码对象中使用的所有名称"""
+    names = set(code.co_names + code.co_varnames + code.co_cellvars + code.co_freevars)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= code_names(const)
+    return names
+
+
+def measure(source, naming, seed):
+    """返回(耗时, 源代码字节数, marshal字节数, 名称总长度, 行为样本)"""
+    random.seed(seed)
+    confuser = CompletePythonObfuscator(naming=naming)
+    start = time.perf_counter()
+    tree = confuser.obfuscate_tree(source, '<bench>')
+    elapsed = time.perf_counter() - start
+    code = compile(tree, '<bench>', 'exec')
+    namespace = {}
+    exec(code, namespace)
+    # 函数名已被替换，按映射表找到混淆后的入口
+    compute = namespace[confuser.get_name_mapping().get('compute_0', 'compute_0')]
+    sample = compute(list(range(50)), 3)
+    return (elapsed, len(generate_source(tree).encode()), len(marshal.dumps(code)),
+            sum(len(name) for name in code_names(code)), sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='命名方式基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 800],
+                        help='生成模块中函数和类的组数列表 (默认: 50 200 800)')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子 (默认: 0)')
+    args = parser.parse_args()
+
+    print("输出大小 (KB) 和混淆耗时 (毫秒)")
+    print(f"{'组数':>6} {'命名':>8} {'源代码':>10} {'marshal':>10} {'名称总长':>10} {'耗时':>10} {'行为一致':>8}")
+    for size in args.sizes:
+        source = generate_module(size)
+        results = {naming: measure(source, naming, args.seed) for naming in ('random', 'short')}
+        same = results['random'][4] == results['short'][4]
+        for naming, (elapsed, source_size, code_size, names_size, _) in results.items():
+            print(f"{size:>6} {naming:>8} {source_size / 1024:>12.1f} {code_size / 1024:>10.1f} "
+                  f"{names_size / 1024:>12.1f} {elapsed * 1000:>12.1f} {'是' if same else '否':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试：整包混淆的分析耗时，以及顺序处理与并行处理的总耗时
+
+生成一个包含多个模块的包，每个模块都从前一个模块导入函数(from-import、模块别名
+属性访问和相对导入各一种)，然后:
+1. 测量ProgramIndex分析整个包的耗时
+2. 分别用1个和多个工作进程混淆整个包
+3. 运行原始包和混淆后的包，检查输出一致，即跨模块的导入没有被破坏
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到路径，以便能够导入mods模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.engine_benchmark import generate_module
+from mods.complete_obfuscator import obfuscate_package
+from mods.program_index import ProgramIndex
+
+
+IMPORT_TEMPLATE = '''from .mod_{prev} import compute_0 as previous_compute
+from . import mod_{prev} as previous
+from pkg.mod_{prev} import helper_0
+
+
+def chained_{i}(value):
+    return previous_compute([value], 2) + previous.helper_1(value) + helper_0(value)
+'''
+
+
+def generate_package(path, num_modules, units):
+    """在path下生成名为pkg的包，返回入口脚本路径"""
+    package = os.path.join(path, 'pkg')
+    os.makedirs(package)
+    open(os.path.join(package, '__init__.py'), 'w').close()
+    for i in range(num_modules):
+        with open(os.path.join(package, f'mod_{i}.py'), 'w', encoding='utf-8') as f:
+            f.write(generate_module(units))
+            if i:
+                f.write(IMPORT_TEMPLATE.format(i=i, prev=i - 1))
+    entry = os.path.join(path, 'run.py')
+    with open(entry, 'w', encoding='utf-8') as f:
+        f.write('import pkg.mod_0\n')
+        for i in range(1, num_modules):
+            f.write(f'from pkg.mod_{i} import chained_{i}\nprint(chained_{i}({i}))\n')
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description='整包混淆基准测试')
+    parser.add_argument('--modules', type=int, default=16, help='包中的模块数 (默认: 16)')
+    parser.add_argument('--units', type=int, default=40, help='每个模块中函数和类的组数 (默认: 40)')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}),
+                        help='比较的工作进程数列表 (默认: 1 和 CPU核数)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'src')
+        entry = generate_package(source, args.modules, args.units)
+        expected = subprocess.run([sys.executable, entry], capture_output=True, text=True).stdout
+
+        start = time.perf_counter()
+        index = ProgramIndex(source)
+        print(f"分析 {len(index.modules)} 个文件: {(time.perf_counter() - start) * 1000:.1f} 毫秒, "
+              f"{len(index.name_mapping)} 个函数名")
+
+        print(f"{'工作进程':>8} {'耗时(秒)':>10} {'输出一致':>8}")
+        for workers in args.workers:
+            output = os.path.join(workdir, f'out_{workers}')
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull:
+                # 每个文件的混淆报告写入标准错误输出，计时时丢弃
+                stderr, sys.stderr = sys.stderr, devnull
+                try:
+                    obfuscate_package(source, output, workers=workers)
+                finally:
+                    sys.stderr = stderr
+            elapsed = time.perf_counter() - start
+            with open(os.path.join(output, 'run.py'), 'r', encoding='utf-8') as f:
+                actual = subprocess.run([sys.executable, '-c', f.read()], capture_output=True, text=True,
+                                        cwd=output).stdout
+            print(f"{workers:>8} {elapsed:>12.2f} {'是' if actual == expected else '否':>8}")
+
+
+if __name__ == "__main__":
+    main()
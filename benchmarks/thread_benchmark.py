@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试：在线程池中并发调用obfuscate_source
+
+生成多个不同的模块，然后:
+1. 指定种子，在当前线程中顺序混淆，作为参照结果
+2. 使用相同的种子在线程池中并发混淆(打乱提交顺序)，检查每个结果与参照结果逐字节相同，
+   即并发调用之间没有共享的映射表、平坦化状态或随机数状态
+3. 不指定种子并发混淆，执行每个结果，按结果自带的映射表找到入口函数，检查行为与原始模块一致
+
+在自由线程构建(python3.13t)上运行时多个线程真正并行，并报告GIL是否启用。
+"""
+
+import argparse
+import ast
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径，以便能够导入mods模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.engine_benchmark import generate_module
+from mods.complete_obfuscator import obfuscate_source
+
+
+def run_entry(tree, name_mapping):
+    """执行混淆后的模块，调用compute_0"""
+    namespace = {}
+    exec(compile(tree, '<thread>', 'exec'), namespace)
+    compute = namespace[name_mapping.get('compute_0', 'compute_0')]
+    return compute(list(range(50)), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多线程并发混淆测试')
+    parser.add_argument('--jobs', type=int, default=16, help='混淆的模块数 (默认: 16)')
+    parser.add_argument('--units', type=int, default=20, help='每个模块中函数和类的基础组数 (默认: 20)')
+    parser.add_argument('--threads', type=int, default=8, help='线程池大小 (默认: 8)')
+    parser.add_argument('--naming', choices=['random', 'short'], default='random', help='命名方式 (默认: random)')
+    parser.add_argument('--engine', choices=['fused', 'passes'], default='fused', help='处理引擎 (默认: fused)')
+    args = parser.parse_args()
+
+    gil = sys._is_gil_enabled() if hasattr(sys, '_is_gil_enabled') else True
+    print(f"Python {sys.version.split()[0]}, GIL: {'启用' if gil else '禁用'}, 线程数: {args.threads}")
+
+    sources = [generate_module(args.units + i) for i in range(args.jobs)]
+    options = dict(naming=args.naming, engine=args.engine)
+
+    start = time.perf_counter()
+    expected = [obfuscate_source(source, '<thread>', seed=i, **options).source for i, source in enumerate(sources)]
+    sequential = time.perf_counter() - start
+
+    order = list(range(args.jobs))
+    random.shuffle(order)
+    with ThreadPoolExecutor(args.threads) as executor:
+        start = time.perf_counter()
+        futures = {i: executor.submit(obfuscate_source, sources[i], '<thread>', seed=i, **options) for i in order}
+        seeded = {i: future.result().source for i, future in futures.items()}
+        concurrent = time.perf_counter() - start
+    mismatched = [i for i in range(args.jobs) if seeded[i] != expected[i]]
+
+    originals = [run_entry(ast.parse(source), {}) for source in sources]
+    with ThreadPoolExecutor(args.threads) as executor:
+        results = list(executor.map(lambda source: obfuscate_source(source, '<thread>', **options), sources))
+    broken = [i for i, result in enumerate(results) if run_entry(result.tree, result.name_mapping) != originals[i]]
+
+    print(f"顺序混淆: {sequential:.2f} 秒, 线程池混淆: {concurrent:.2f} 秒")
+    print(f"指定种子时与顺序结果一致: {args.jobs - len(mismatched)}/{args.jobs}")
+    print(f"不指定种子时行为一致: {args.jobs - len(broken)}/{args.jobs}")
+    if mismatched or broken:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import os
 import sys
-from mods.complete_obfuscator import obfuscate_file
+from mods.complete_obfuscator import obfuscate_file, obfuscate_package
+from mods.autotune import OverheadTuner
+from mods.specialization import SpecializationChecker, format_specialization_report
+from mods.estimator import OverheadEstimator, format_estimate_table
 
 
 def main():
     """命令行入口函数"""
     parser = argparse.ArgumentParser(description='Python代码混淆器 - 支持多种混淆技术')
     
-    parser.add_argument('input_file', help='输入的Python文件路径')
-    parser.add_argument('-o', '--output', help='输出的混淆后文件路径 (默认为stdout)')
+    parser.add_argument('input_file', help='输入的Python文件路径，也可以是目录 (整包混淆或--estimate)')
+    parser.add_argument('-o', '--output', help='输出的混淆后文件路径 (默认为stdout)，输入为目录时为输出目录')
     parser.add_argument('-v', '--verbose', action='store_true', help='显示详细信息')
     
     # 混淆选项
@@ -20,8 +24,97 @@ def main():
     obfuscation_group.add_argument('--no-name-obfuscation', action='store_true', help='禁用函数名混淆')
     obfuscation_group.add_argument('--pyc', action='store_true', help='编译为pyc文件并插入NOP指令')
     obfuscation_group.add_argument('--nop-ratio', type=float, default=0.2, help='NOP指令比例 (默认: 0.2)')
+    obfuscation_group.add_argument('--dispatch', choices=['linear', 'binary', 'auto'], default='auto',
+                                   help='平坦化状态分发方式: linear线性if链, binary二分比较树, auto按状态数自动选择 (默认: auto)')
+    obfuscation_group.add_argument('--granularity', choices=['statement', 'block'], default='statement',
+                                   help='平坦化粒度: statement每条语句一个状态, block合并连续的非分支语句 (默认: statement)')
+    obfuscation_group.add_argument('--block-size', type=int, default=None,
+                                   help='block粒度下每个基本块的最大语句数 (默认: 按函数长度自动确定)')
+    obfuscation_group.add_argument('--nested-flatten', action='store_true',
+                                   help='基于控制流图展开函数内嵌套的if/for/while')
+    obfuscation_group.add_argument('--max-overhead', type=float, default=0.25,
+                                   help='展开单个复合语句允许的最大分发开销比例，超过时保持原结构 (默认: 0.25)')
+    obfuscation_group.add_argument('--flatten-innermost-loops', action='store_true',
+                                   help='展开嵌套结构时也展开最内层循环 (默认保留其原结构)')
+    obfuscation_group.add_argument('--flatten-scope', choices=['top', 'all'], default='top',
+                                   help='平坦化范围: top只处理模块顶层函数, all同时按开销选择方法、嵌套函数和async函数 (默认: top)')
+    obfuscation_group.add_argument('--max-function-overhead', type=float, default=0.75,
+                                   help='平坦化方法、嵌套函数和async函数允许的最大预计开销比例 (默认: 0.75)')
+    obfuscation_group.add_argument('--profile', metavar='PROF',
+                                   help='代表性运行得到的cProfile/pstats文件，热点函数只做重命名不做平坦化')
+    obfuscation_group.add_argument('--hot-threshold', type=float, default=0.1,
+                                   help='热点函数的累计耗时占比阈值 (默认: 0.1)')
+    obfuscation_group.add_argument('--no-peephole', action='store_true',
+                                   help='禁用平坦化之后的窥孔优化')
+    obfuscation_group.add_argument('--localize-globals', action='store_true',
+                                   help='在函数入口将频繁使用的全局名称和内置名称绑定为局部变量，抵消部分平坦化开销')
+    obfuscation_group.add_argument('--inline', action='store_true',
+                                   help='在重命名和平坦化之前将小型模块级函数内联到调用处')
+    obfuscation_group.add_argument('--inline-max-statements', type=int, default=8,
+                                   help='可内联函数的最大语句数 (默认: 8)')
+    obfuscation_group.add_argument('--fold-constants', action='store_true',
+                                   help='在平坦化之前折叠常量表达式、传播模块级常量并删除条件恒定的分支')
+    obfuscation_group.add_argument('--wrap-module', action='store_true',
+                                   help='将包含循环的模块级代码移入生成的初始化函数，使用快速局部变量并参与平坦化')
+    obfuscation_group.add_argument('--engine', choices=['fused', 'passes'], default='fused',
+                                   help='处理引擎: fused在一次遍历中完成重命名和平坦化, passes逐遍处理 (默认: fused)')
+    obfuscation_group.add_argument('--codegen', choices=['auto', 'unparse', 'astor'], default='auto',
+                                   help='代码生成后端: auto在Python 3.9+上使用ast.unparse, 否则使用astor (默认: auto)')
+    obfuscation_group.add_argument('--stream-output', action='store_true',
+                                   help='每生成一条模块顶层语句就写入输出文件，不在内存中构造完整的源代码')
+    obfuscation_group.add_argument('--naming', choices=['random', 'short'], default='random',
+                                   help='新名称的生成方式: random为前缀加随机字母, short按引用次数分配最短的未使用标识符 (默认: random)')
+    obfuscation_group.add_argument('--seed', type=int, default=None,
+                                   help='构建种子，指定后相同的输入和选项得到逐字节相同的输出 (包括pyc)')
+    
+    # 整包混淆
+    package_group = parser.add_argument_group('整包混淆')
+    package_group.add_argument('--workers', type=int, default=None,
+                               help='输入为目录时并行混淆的工作进程数，1表示顺序处理 (默认: CPU核数)')
+    
+    # 开销预算自动调优
+    tuning_group = parser.add_argument_group('开销预算调优')
+    tuning_group.add_argument('--overhead-budget', type=float, default=None,
+                              help='允许的最大运行时开销比例，如0.1表示最多慢10%%；指定后自动搜索平坦化范围、粒度和NOP比例')
+    tuning_group.add_argument('--bench-entry', metavar='EXPR',
+                              help='基准入口表达式，在被混淆模块的命名空间中求值，如 "main()"；开销预算调优和特化检查共用')
+    tuning_group.add_argument('--bench-repeat', type=int, default=5, help='每个候选配置的重复计时次数 (默认: 5)')
+    
+    # 静态开销估算
+    estimate_group = parser.add_argument_group('静态开销估算')
+    estimate_group.add_argument('--estimate', action='store_true',
+                                help='不生成输出也不运行代码，比较原始AST和混淆后的AST，按预计开销输出每个函数的'
+                                     '额外指令数、每轮分发比较次数和新增局部变量排名表；输入可以是目录')
+    estimate_group.add_argument('--estimate-top', type=int, default=20,
+                                help='排名表只显示开销最高的前N个函数，0表示全部 (默认: 20)')
+    
+    # 自适应解释器特化检查
+    check_group = parser.add_argument_group('特化检查')
+    check_group.add_argument('--check-specialization', action='store_true',
+                             help='混淆后用样例入口分别运行原始代码、平坦化源代码和字节码混淆结果，'
+                                  '比较dis(adaptive=True)中的指令特化情况 (需要Python 3.11+)')
+    check_group.add_argument('--check-calls', type=int, default=100,
+                             help='特化检查时样例入口的求值次数 (默认: 100)')
+    
+    # 分发计数插桩
+    instrument_group = parser.add_argument_group('分发计数插桩')
+    instrument_group.add_argument('--instrument', nargs='?', const='auto', choices=['auto', 'counters', 'monitoring'],
+                                  help='生成插桩版本，统计每个平坦化函数的分发循环轮数和状态转移次数并在退出时写入文件；'
+                                       'auto在Python 3.12+上使用sys.monitoring，否则注入计数器 (默认: auto)')
+    instrument_group.add_argument('--instrument-output', default='dispatch_counts.json',
+                                  help='插桩版本写入的计数文件，运行时可用环境变量OBF_DISPATCH_COUNTS覆盖 '
+                                       '(默认: dispatch_counts.json)')
     
     args = parser.parse_args()
+    if args.overhead_budget is not None and not args.bench_entry:
+        parser.error('--overhead-budget 需要同时指定 --bench-entry')
+    if args.check_specialization and not args.bench_entry:
+        parser.error('--check-specialization 需要同时指定 --bench-entry')
+    package = os.path.isdir(args.input_file) and not args.estimate
+    if package and not args.output:
+        parser.error('输入为目录时需要用 -o 指定输出目录')
+    if package and (args.overhead_budget is not None or args.check_specialization):
+        parser.error('整包混淆不支持 --overhead-budget 和 --check-specialization')
     
     try:
         if args.verbose:
@@ -35,19 +128,86 @@ def main():
         
         # 如果输出到pyc文件但未指定输出文件名，则自动添加.pyc后缀
         output_file = args.output
-        if args.pyc and output_file and not output_file.endswith('.pyc'):
+        if args.pyc and output_file and not package and not output_file.endswith('.pyc'):
             output_file += '.pyc'
             if args.verbose:
                 print(f"输出文件已自动调整为: {output_file}")
             
-        result = obfuscate_file(
-            args.input_file, 
-            output_file,
+        options = dict(
             flatten_code=not args.no_flatten,
             obfuscate_names=not args.no_name_obfuscation,
             compile_to_pyc=args.pyc,
-            nop_ratio=args.nop_ratio
+            nop_ratio=args.nop_ratio,
+            dispatch=args.dispatch,
+            granularity=args.granularity,
+            block_size=args.block_size,
+            nested_flatten=args.nested_flatten,
+            max_overhead=args.max_overhead,
+            keep_innermost_loops=not args.flatten_innermost_loops,
+            profile_file=args.profile,
+            hot_threshold=args.hot_threshold,
+            peephole=not args.no_peephole,
+            localize=args.localize_globals,
+            inline=args.inline,
+            inline_max_statements=args.inline_max_statements,
+            fold=args.fold_constants,
+            wrap_module=args.wrap_module,
+            flatten_scope=args.flatten_scope,
+            max_function_overhead=args.max_function_overhead,
+            engine=args.engine,
+            codegen=args.codegen,
+            naming=args.naming,
+            seed=args.seed
         )
+        # 插桩和流式输出只作用于最终输出，调优计时和特化检查使用未插桩的代码
+        instrument_options = dict(instrument=args.instrument, instrument_output=args.instrument_output,
+                                  stream_output=args.stream_output)
+        
+        if args.estimate:
+            estimator = OverheadEstimator(options)
+            rows, errors = estimator.estimate_path(args.input_file)
+            for filename, error in errors:
+                print(f"跳过 {filename}: {error}", file=sys.stderr)
+            for line in format_estimate_table(rows, args.estimate_top or None, os.path.isdir(args.input_file)):
+                print(line)
+            return
+        
+        if package:
+            results = obfuscate_package(args.input_file, output_file, workers=args.workers,
+                                        **options, **instrument_options)
+            failed = [(filename, message) for filename, message in results if not message.startswith('混淆后的代码')]
+            for filename, message in results if args.verbose else failed:
+                print(f"{filename}: {message}", file=sys.stderr)
+            print(f"已混淆 {len(results) - len(failed)}/{len(results)} 个文件到 {output_file}")
+            return 1 if failed else 0
+        
+        tuner = None
+        if args.overhead_budget is not None:
+            base_options = {key: value for key, value in options.items()
+                            if key not in ('flatten_code', 'compile_to_pyc', 'nop_ratio', 'granularity',
+                                           'nested_flatten', 'profile_file', 'hot_threshold')}
+            tuner = OverheadTuner(args.input_file, args.bench_entry, args.overhead_budget,
+                                  compile_to_pyc=args.pyc, repeat=args.bench_repeat, base_options=base_options)
+            chosen = tuner.tune()
+            print("开销预算调优:", file=sys.stderr)
+            for line in tuner.summary(chosen):
+                print(line, file=sys.stderr)
+            if chosen is not None:
+                options.update(chosen['options'])
+                if chosen['nop_ratio'] is not None:
+                    options['nop_ratio'] = chosen['nop_ratio']
+        
+        try:
+            result = obfuscate_file(args.input_file, output_file, **options, **instrument_options)
+            
+            if args.check_specialization:
+                checker = SpecializationChecker(args.input_file, args.bench_entry, options, calls=args.check_calls)
+                print("特化检查:", file=sys.stderr)
+                for line in format_specialization_report(checker.check()):
+                    print(line, file=sys.stderr)
+        finally:
+            if tuner is not None:
+                tuner.cleanup()
         
         if args.verbose:
             print(result)
@@ -0,0 +1,215 @@
+import ast
+import itertools
+import marshal
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from .complete_obfuscator import CompletePythonObfuscator
+from .bytecode_obfuscator import BytecodeObfuscator
+
+
+# 在子进程中加载变体并计时，输出最短耗时
+TIMING_SCRIPT = r'''
+import contextlib, io, marshal, runpy, sys, timeit
+path, entry, number, repeat, source_dir = sys.argv[1:6]
+sys.path.insert(0, source_dir)
+with contextlib.redirect_stdout(io.StringIO()):
+    if path.endswith('.bin'):
+        with open(path, 'rb') as f:
+            code = marshal.load(f)
+        namespace = {'__name__': '__tune__', '__file__': path, '__builtins__': __builtins__}
+        exec(code, namespace)
+    else:
+        namespace = runpy.run_path(path, run_name='__tune__')
+    times = timeit.repeat(entry, globals=namespace, number=int(number), repeat=int(repeat))
+print(min(times))
+'''
+
+# 在子进程中剖析原始代码
+PROFILE_SCRIPT = r'''
+import cProfile, contextlib, io, runpy, sys
+path, entry, output, source_dir = sys.argv[1:5]
+sys.path.insert(0, source_dir)
+with contextlib.redirect_stdout(io.StringIO()):
+    namespace = runpy.run_path(path, run_name='__tune__')
+    profiler = cProfile.Profile()
+    profiler.runctx(entry, namespace, namespace)
+profiler.dump_stats(output)
+'''
+
+
+def rename_expression(expression, name_mapping, var_mapping):
+    """按混淆后的名称改写在模块命名空间中求值的表达式"""
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            node.id = name_mapping.get(node.id, var_mapping.get(node.id, node.id))
+    return ast.unparse(tree) if hasattr(ast, 'unparse') else expression
+
+
+class OverheadTuner:
+    """
+    在运行时开销预算内搜索最强的混淆配置
+
+    依次尝试平坦化的函数范围(按剖析结果把越来越多的热点函数降为只重命名)、
+    是否展开嵌套结构、平坦化粒度和NOP比例，每个候选配置都生成变体并在子进程中
+    对基准入口计时，返回第一个(即最强的)满足预算的配置。
+    """
+
+    # None表示所有函数都平坦化，其余值为热点函数的累计耗时占比阈值
+    HOT_THRESHOLDS = (None, 0.5, 0.25, 0.1, 0.05, 0.0)
+    NOP_RATIOS = (0.2, 0.1, 0.0)
+    MIN_MEASURE_TIME = 0.2  # 每次计时的最短总时间(秒)
+
+    def __init__(self, input_file, entry, budget=0.1, compile_to_pyc=False, repeat=5, base_options=None):
+        """
+        Args:
+            input_file: 被混淆的Python文件
+            entry: 基准入口表达式，在模块命名空间中求值，如 "main()"
+            budget: 允许的最大运行时开销比例，0.1表示最多慢10%
+            compile_to_pyc: 是否同时搜索NOP比例并按pyc方式计时
+            repeat: 每个变体的重复计时次数
+            base_options: 传给CompletePythonObfuscator的其他固定选项
+        """
+        self.input_file = os.path.abspath(input_file)
+        self.entry = entry
+        self.budget = budget
+        self.compile_to_pyc = compile_to_pyc
+        self.repeat = repeat
+        self.base_options = dict(base_options or {})
+        self.source_dir = os.path.dirname(self.input_file)
+        self.work_dir = tempfile.mkdtemp(prefix='obf_tune_')
+        self.profile_file = os.path.join(self.work_dir, 'baseline.prof')
+        self.trials = []  # (配置描述, 开销比例, 是否满足预算)
+        self.baseline = None
+        self.number = 1
+
+        with open(self.input_file, 'r', encoding='utf-8') as f:
+            self.source_code = f.read()
+        ast.parse(entry, mode='eval')
+
+    def candidates(self):
+        """按混淆强度从强到弱生成候选配置"""
+        nop_ratios = self.NOP_RATIOS if self.compile_to_pyc else (None,)
+        for threshold, nested, granularity, nop_ratio in itertools.product(
+                self.HOT_THRESHOLDS, (True, False), ('statement', 'block'), nop_ratios):
+            yield {
+                'hot_threshold': threshold,
+                'nested_flatten': nested,
+                'granularity': granularity,
+                'nop_ratio': nop_ratio,
+            }
+
+    def describe(self, candidate):
+        scope = '全部函数' if candidate['hot_threshold'] is None else f"热点阈值{candidate['hot_threshold']:.0%}"
+        parts = [scope, '嵌套展开' if candidate['nested_flatten'] else '仅顶层', candidate['granularity']]
+        if candidate['nop_ratio'] is not None:
+            parts.append(f"NOP {candidate['nop_ratio']}")
+        return ', '.join(parts)
+
+    def obfuscator_options(self, candidate):
+        """候选配置对应的CompletePythonObfuscator参数"""
+        options = dict(self.base_options)
+        options.update(flatten_code=True, granularity=candidate['granularity'],
+                       nested_flatten=candidate['nested_flatten'])
+        if candidate['hot_threshold'] is not None:
+            options.update(profile_file=self.profile_file, hot_threshold=candidate['hot_threshold'])
+        return options
+
+    def _run(self, script, *args):
+        result = subprocess.run([sys.executable, '-c', script] + [str(arg) for arg in args],
+                                capture_output=True, text=True, cwd=self.source_dir)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else '子进程执行失败')
+        return result.stdout
+
+    def measure(self, path, entry):
+        """在子进程中对变体计时，返回单次调用的最短耗时"""
+        output = self._run(TIMING_SCRIPT, path, entry, self.number, self.repeat, self.source_dir)
+        return float(output.split()[-1]) / self.number
+
+    def build(self, candidate, index):
+        """
+        生成候选配置的变体文件
+
+        Returns:
+            (变体文件路径, 改写后的入口表达式, 混淆器)
+        """
+        confuser = CompletePythonObfuscator(**self.obfuscator_options(candidate))
+        try:
+            tree = confuser.obfuscate_tree(self.source_code, self.input_file)
+        except Exception as e:
+            raise RuntimeError(f"混淆失败: {e}")
+
+        entry = rename_expression(self.entry, confuser.get_name_mapping(), confuser.get_var_mapping())
+        if candidate['nop_ratio'] is None:
+            path = os.path.join(self.work_dir, f'variant_{index}.py')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(confuser.to_source(tree))
+        else:
+            # 与--pyc相同，直接编译混淆后的AST
+            obfuscator = BytecodeObfuscator(nop_ratio=candidate['nop_ratio'],
+                                            function_levels=confuser.bytecode_levels)
+            path = os.path.join(self.work_dir, f'variant_{index}.bin')
+            with open(path, 'wb') as f:
+                marshal.dump(obfuscator.obfuscate_bytecode(tree, self.input_file), f)
+        return path, entry, confuser
+
+    def tune(self):
+        """
+        搜索满足预算的最强配置
+
+        Returns:
+            选中的候选配置(附带 'overhead' 开销比例和 'options' 混淆器参数)
+        """
+        # 确定每次计时的调用次数，使单次计时足够长
+        self.number = 1
+        once = self.measure(self.input_file, self.entry)
+        self.number = max(1, int(self.MIN_MEASURE_TIME / max(once, 1e-9)))
+        self.baseline = self.measure(self.input_file, self.entry)
+        self._run(PROFILE_SCRIPT, self.input_file, self.entry, self.profile_file, self.source_dir)
+
+        chosen = None
+        for index, candidate in enumerate(self.candidates()):
+            try:
+                path, entry, _ = self.build(candidate, index)
+                overhead = self.measure(path, entry) / self.baseline - 1
+            except RuntimeError as e:
+                self.trials.append((self.describe(candidate), None, False))
+                print(f"候选配置失败: {self.describe(candidate)}: {e}", file=sys.stderr)
+                continue
+
+            fits = overhead <= self.budget
+            self.trials.append((self.describe(candidate), overhead, fits))
+            candidate = dict(candidate, overhead=overhead, options=self.obfuscator_options(candidate))
+            chosen = candidate
+            if fits:
+                break
+        return chosen
+
+    def summary(self, chosen):
+        """
+        生成搜索过程摘要
+
+        Returns:
+            摘要文本行列表
+        """
+        lines = [f"基准入口: {self.entry}, 原始耗时 {self.baseline * 1000:.3f} ms/次, 预算 {self.budget:.0%}"]
+        for description, overhead, fits in self.trials:
+            result = '失败' if overhead is None else f"{overhead:+.1%} {'满足' if fits else '超出'}"
+            lines.append(f"  {description}: {result}")
+        if chosen is None:
+            lines.append("没有可用的配置")
+        elif chosen['overhead'] <= self.budget:
+            lines.append(f"选用: {self.describe(chosen)} (开销 {chosen['overhead']:+.1%})")
+        else:
+            lines.append(f"所有配置都超出预算，选用最弱的配置: {self.describe(chosen)} "
+                         f"(开销 {chosen['overhead']:+.1%})")
+        return lines
+
+    def cleanup(self):
+        """删除搜索过程中生成的临时文件"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
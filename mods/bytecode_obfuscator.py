@@ -14,18 +14,31 @@ import traceback
 class BytecodeObfuscator:
     """字节码级混淆器 - 编译为pyc并插入nop花指令"""
     
-    def __init__(self, nop_ratio=0.2, max_consecutive_nops=5):
+    def __init__(self, nop_ratio=0.2, max_consecutive_nops=5, function_levels=None, rng=None):
         """
         初始化字节码混淆器
         
         Args:
             nop_ratio: 插入的nop指令占原指令数量的比例
             max_consecutive_nops: 最大连续nop指令数量
+            function_levels: 函数名 -> 混淆级别，'light'减半插入NOP，'none'不插入
+            rng: 随机数生成器(random.Random实例)，None表示使用random模块的全局生成器
         """
+        self.rng = rng or random
         self.nop_ratio = nop_ratio
         self.max_consecutive_nops = max_consecutive_nops
+        self.function_levels = function_levels or {}
         self.nop_opcode = 9  # Python中NOP指令的操作码
     
+    def _nop_ratio_for(self, code_obj):
+        """按函数的混淆级别确定NOP比例"""
+        level = self.function_levels.get(code_obj.co_name, 'full')
+        if level == 'none':
+            return 0
+        if level == 'light':
+            return self.nop_ratio / 2
+        return self.nop_ratio
+    
     def _insert_nops(self, code_obj):
         """
         在代码对象中插入NOP指令
@@ -62,7 +75,7 @@ class BytecodeObfuscator:
             
             # 计算要插入的NOP指令数量
             num_instructions = len(co_code) // 2
-            num_nops = int(num_instructions * self.nop_ratio)
+            num_nops = int(num_instructions * self._nop_ratio_for(code_obj))
             
             # 逐字节检查并插入NOP指令
             i = 0
@@ -71,9 +84,9 @@ class BytecodeObfuscator:
             
             while i < len(co_code):
                 # 随机决定是否在此处插入NOP
-                if nops_inserted < num_nops and random.random() < 0.3:
+                if nops_inserted < num_nops and self.rng.random() < 0.3:
                     # 决定要插入的连续NOP数量
-                    nop_count = random.randint(1, self.max_consecutive_nops)
+                    nop_count = self.rng.randint(1, self.max_consecutive_nops)
                     nop_count = min(nop_count, num_nops - nops_inserted)
                     
                     # 插入NOP指令和参数0
@@ -151,7 +164,7 @@ class BytecodeObfuscator:
         混淆Python源代码的字节码
         
         Args:
-            source_code: Python源代码
+            source_code: Python源代码，或已经变换好的模块AST(直接编译，不经过源代码)
             filename: 源代码的文件名（用于错误报告）
             
         Returns:
@@ -165,14 +178,16 @@ class BytecodeObfuscator:
         
         return obfuscated_code
     
-    def compile_to_pyc(self, source_code, output_file, source_file="<string>"):
+    def compile_to_pyc(self, source_code, output_file, source_file="<string>", source_size=None, source_hash=None):
         """
         将源代码编译为pyc文件并插入NOP花指令
         
         Args:
-            source_code: Python源代码
+            source_code: Python源代码，或已经变换好的模块AST
             output_file: 输出的pyc文件路径
             source_file: 源文件名（用于错误报告）
+            source_size: 写入pyc文件头的源文件大小，None时取source_code的字节数(AST时为0)
+            source_hash: 原始源代码的importlib.util.source_hash，提供时写入基于哈希的文件头
             
         Returns:
             是否成功编译
@@ -181,29 +196,9 @@ class BytecodeObfuscator:
             # 获取混淆后的代码对象
             code_obj = self.obfuscate_bytecode(source_code, source_file)
             
-            # 获取Python魔术数
-            # 在较新版本的Python中使用MAGIC_NUMBER，在较旧版本中使用MAGIC
-            if hasattr(importlib.util, 'MAGIC_NUMBER'):
-                magic = importlib.util.MAGIC_NUMBER
-            else:
-                magic = importlib.util.MAGIC
-            
-
-            timestamp = int(time.time())
-            
-
-            os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
-            
-            # 写入pyc文件
-            with open(output_file, 'wb') as f:
-                f.write(magic)
-                if sys.version_info >= (3, 7):
-                    f.write(struct.pack('<I', 0))
-                f.write(struct.pack('<I', timestamp))
-                if sys.version_info >= (3, 8):
-                    source_size = len(source_code.encode())
-                    f.write(struct.pack('<I', source_size))
-                marshal.dump(code_obj, f)
+            if source_size is None:
+                source_size = len(source_code.encode()) if isinstance(source_code, str) else 0
+            write_pyc(code_obj, output_file, source_size, source_hash)
             
             print(f"编译成功: {output_file}")
             return True
@@ -213,6 +208,48 @@ class BytecodeObfuscator:
             return False
 
 
+def write_pyc(code_obj, output_file, source_size=0, source_hash=None):
+    """
+    将内存中的代码对象直接写为pyc文件
+    
+    Args:
+        code_obj: 模块代码对象
+        output_file: 输出的pyc文件路径
+        source_size: 写入文件头的源文件大小
+        source_hash: 原始源代码的importlib.util.source_hash(8字节)。提供时(Python 3.7+)写入
+                     不检查源文件的基于哈希的文件头(PEP 552)，代替当前时间戳，
+                     相同的输入得到逐字节相同的pyc
+    """
+    # 获取Python魔术数
+    # 在较新版本的Python中使用MAGIC_NUMBER，在较旧版本中使用MAGIC
+    if hasattr(importlib.util, 'MAGIC_NUMBER'):
+        magic = importlib.util.MAGIC_NUMBER
+    else:
+        magic = importlib.util.MAGIC
+    
+
+    timestamp = int(time.time())
+    hash_based = source_hash is not None and sys.version_info >= (3, 7)
+    
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    
+    # 写入pyc文件
+    with open(output_file, 'wb') as f:
+        f.write(magic)
+        if hash_based:
+            # 标志位0b01: 基于哈希且不检查源文件，随后是8字节的源代码哈希
+            f.write(struct.pack('<I', 0b01))
+            f.write(source_hash)
+        else:
+            if sys.version_info >= (3, 7):
+                f.write(struct.pack('<I', 0))
+            f.write(struct.pack('<I', timestamp))
+            if sys.version_info >= (3, 8):
+                f.write(struct.pack('<I', source_size))
+        marshal.dump(code_obj, f)
+
+
 def simple_compile_to_pyc(input_file, output_file=None):
     """
     简单地将Python文件编译为pyc文件
@@ -241,7 +278,8 @@ def simple_compile_to_pyc(input_file, output_file=None):
         return False
 
 
-def obfuscate_to_pyc(input_file, output_file=None, nop_ratio=0.2, use_original_compile=False, source_code=None):
+def obfuscate_to_pyc(input_file, output_file=None, nop_ratio=0.2, use_original_compile=False, source_code=None,
+                     function_levels=None, tree=None, source_size=None, source_hash=None, rng=None):
     """
     将Python文件混淆并编译为pyc文件
     
@@ -251,12 +289,18 @@ def obfuscate_to_pyc(input_file, output_file=None, nop_ratio=0.2, use_original_c
         nop_ratio: NOP指令的比例
         use_original_compile: 是否使用原始编译方式，不插入NOP
         source_code: 已经混淆的源代码，如果提供则直接使用，否则从input_file读取
+        function_levels: 函数名 -> 混淆级别，用于减少或跳过热点函数的NOP插入
+        tree: 已经混淆的模块AST，提供时直接编译为代码对象并从内存写出pyc，
+              不再生成和解析源代码，也不使用临时文件
+        source_size: 写入pyc文件头的源文件大小，None时取源代码的字节数
+        source_hash: 原始源代码的importlib.util.source_hash，提供时写入基于哈希的确定性文件头
+        rng: NOP插入使用的随机数生成器，None表示使用random模块的全局生成器
         
     Returns:
         是否成功混淆和编译
     """
     try:
-        if source_code is None:
+        if source_code is None and tree is None:
             with open(input_file, 'r', encoding='utf-8') as f:
                 source_code = f.read()
         
@@ -270,25 +314,21 @@ def obfuscate_to_pyc(input_file, output_file=None, nop_ratio=0.2, use_original_c
         print(f"NOP比例: {nop_ratio}")
         print(f"使用原始编译: {use_original_compile}")
         print(f"使用提供的源代码: {source_code is not None}")
+        print(f"直接编译AST: {tree is not None}")
+        
+        # 直接编译AST时不经过源代码
+        source = tree if tree is not None else source_code
+        if source_size is None:
+            source_size = len(source_code.encode()) if source_code is not None else 0
         
         if use_original_compile:
-            # 如果提供了源代码但使用原始编译方式，先写入临时文件
-            if source_code is not None:
-                import tempfile
-                with tempfile.NamedTemporaryFile(suffix='.py', delete=False) as temp:
-                    temp_file = temp.name
-                    temp.write(source_code.encode('utf-8'))
-                
-                try:
-                    result = simple_compile_to_pyc(temp_file, output_file)
-                finally:
-                    os.unlink(temp_file)
-                return result
-            else:
-                return simple_compile_to_pyc(input_file, output_file)
+            # 在内存中编译并直接写出pyc，不经过临时文件
+            write_pyc(compile(source, input_file, 'exec'), output_file, source_size, source_hash)
+            print(f"编译成功: {output_file}")
+            return True
         else:
-            obfuscator = BytecodeObfuscator(nop_ratio=nop_ratio)
-            return obfuscator.compile_to_pyc(source_code, output_file, input_file)
+            obfuscator = BytecodeObfuscator(nop_ratio=nop_ratio, function_levels=function_levels, rng=rng)
+            return obfuscator.compile_to_pyc(source, output_file, input_file, source_size, source_hash)
         
     except Exception as e:
         print(f"混淆失败: {str(e)}")
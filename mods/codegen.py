@@ -0,0 +1,116 @@
+import ast
+
+import astor
+from astor.code_gen import SourceGenerator
+from astor.source_repr import pretty_source
+
+
+BACKENDS = ('auto', 'unparse', 'astor')
+
+
+def resolve_backend(backend='auto'):
+    """auto模式下，有ast.unparse(3.9+)时使用unparse，否则使用astor"""
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的代码生成后端: {backend}")
+    if backend == 'auto':
+        return 'unparse' if hasattr(ast, 'unparse') else 'astor'
+    if backend == 'unparse' and not hasattr(ast, 'unparse'):
+        raise ValueError("unparse后端需要Python 3.9及以上版本")
+    return backend
+
+
+def generate_source(tree, backend='auto'):
+    """
+    由AST生成源代码
+
+    Args:
+        tree: 模块或任意语句/表达式节点
+        backend: 'auto'、'unparse' 或 'astor'
+
+    Returns:
+        源代码，模块以换行结尾
+    """
+    if resolve_backend(backend) == 'astor':
+        return astor.to_source(tree)
+    source = ast.unparse(tree)
+    return source + '\n' if isinstance(tree, ast.Module) else source
+
+
+class _AstorStreamingGenerator(SourceGenerator):
+    """每生成一条模块顶层语句就交给write输出的astor代码生成器"""
+
+    def __init__(self, write, indent_with=' ' * 4):
+        super().__init__(indent_with)
+        self._emit = write
+        self._first = True
+
+    def flush(self):
+        result = self.result
+        if self._first and result and set(result[0]) == set('\n'):
+            # 与astor.to_source相同，去掉开头的空行
+            result[0] = ''
+        self._first = False
+        # 语句之间以换行开头的片段分隔，逐条美化与整体美化的结果相同；
+        # pretty_source只在遇到换行片段时输出前一行，末尾补一个换行片段再去掉
+        self._emit(pretty_source(result + ['\n'])[:-1])
+        # write闭包持有同一个列表，只能原地清空
+        del result[:]
+
+    def visit_Module(self, node):
+        for stmt in node.body:
+            self.write(stmt)
+            self.flush()
+
+
+if hasattr(ast, '_Unparser'):
+    class _UnparseStreamingGenerator(ast._Unparser):
+        """每生成一条模块顶层语句就交给write输出的ast.unparse代码生成器"""
+
+        def __init__(self, write=None, **kwargs):
+            # 生成f-string时ast.unparse会以关键字参数创建同类型的内部实例
+            super().__init__(**kwargs)
+            self._emit = write
+
+        def flush(self):
+            self._emit(''.join(self._source))
+            # 保留一个空片段，使下一条语句仍然以换行开头
+            self._source[:] = ['']
+            # 已输出语句中各节点的运算符优先级不再需要
+            self._precedences.clear()
+
+        def visit_Module(self, node):
+            self._type_ignores = {ignore.lineno: f"ignore{ignore.tag}" for ignore in node.type_ignores}
+            body = node.body
+            docstring = self.get_raw_docstring(node)
+            if docstring:
+                self._write_docstring(docstring)
+                self.flush()
+                body = body[1:]
+            for stmt in body:
+                self.traverse(stmt)
+                self.flush()
+            self._type_ignores.clear()
+else:
+    _UnparseStreamingGenerator = None
+
+
+def write_source(tree, stream, backend='auto'):
+    """
+    流式生成模块源代码，每生成一条顶层语句就写入stream
+
+    输出与generate_source(tree, backend)完全相同，但不在内存中构造完整的源代码字符串。
+
+    Args:
+        tree: 模块AST
+        stream: 有write方法的文本文件对象
+        backend: 'auto'、'unparse' 或 'astor'
+    """
+    if resolve_backend(backend) == 'astor':
+        generator = _AstorStreamingGenerator(stream.write)
+        generator.visit(tree)
+        if not generator._first:
+            stream.write('\n')
+    else:
+        generator = _UnparseStreamingGenerator(stream.write)
+        generator.visit(tree)
+        stream.write('\n')
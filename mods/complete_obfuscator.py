@@ -1,9 +1,27 @@
 import os
+import sys
 import ast
-import astor
-from .confuser import PythonConfuser, obfuscate_file as flatten_file
+import random
+import threading
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from .confuser import (PythonConfuser, obfuscate_file as flatten_file, format_flatten_report,
+                       format_structured_report, format_selection_report)
 from .name_obfuscator import obfuscate_function_names, obfuscate_variable_names
 from .bytecode_obfuscator import obfuscate_to_pyc, BytecodeObfuscator
+from .profile_guided import ProfileGuidedPolicy
+from .pragmas import extract_function_levels
+from .flatten_optimizer import optimize_flattened, format_peephole_report
+from .localizer import localize_globals, format_localization_report
+from .inliner import inline_functions, format_inline_report
+from .constant_folder import fold_constants, format_folding_report
+from .module_wrapper import wrap_module_code, format_wrap_report
+from .instrumentation import instrument_dispatch, format_instrument_report
+from .fused_engine import ENGINES, fused_obfuscate
+from .scope_index import ScopeIndex
+from .program_index import ProgramIndex, find_python_files
+from .name_allocator import NAMING_STRATEGIES, shorten_names, format_naming_report
+from .codegen import generate_source, write_source, resolve_backend
 
 
 class CompletePythonObfuscator:
@@ -16,7 +34,13 @@ class CompletePythonObfuscator:
     """
     
     def __init__(self, flatten_code=True, obfuscate_names=True, obfuscate_vars=True,
-                compile_to_pyc=False, nop_ratio=0.2):
+                compile_to_pyc=False, nop_ratio=0.2, dispatch='auto',
+                granularity='statement', block_size=None, nested_flatten=False, max_overhead=0.25,
+                keep_innermost_loops=True, profile_file=None, hot_threshold=0.1, peephole=True,
+                localize=False, inline=False, inline_max_statements=8, fold=False,
+                wrap_module=False, flatten_scope='top', max_function_overhead=0.75,
+                instrument=None, instrument_output='dispatch_counts.json', engine='fused', codegen='auto',
+                program_index=None, naming='random', seed=None, rng=None):
         """
         初始化混淆器
         
@@ -26,18 +50,93 @@ class CompletePythonObfuscator:
             obfuscate_vars: 是否启用变量名混淆
             compile_to_pyc: 是否编译为pyc文件
             nop_ratio: NOP指令占比
+            dispatch: 平坦化状态分发方式 ('linear', 'binary', 'auto')
+            granularity: 平坦化粒度 ('statement', 'block')
+            block_size: block粒度下每个基本块的最大语句数，None表示自动确定
+            nested_flatten: 是否展开函数内嵌套的if/for/while
+            max_overhead: 展开单个复合语句允许的最大分发开销比例，超过时保持原结构
+            keep_innermost_loops: 展开嵌套结构时是否保留最内层循环的原结构
+            profile_file: 代表性运行得到的cProfile/pstats文件，提供时热点函数只做重命名
+            hot_threshold: 热点函数的累计耗时占比阈值
+            peephole: 是否在平坦化之后执行窥孔优化，删除冗余的状态赋值和状态测试
+            localize: 是否在函数入口将频繁使用的全局名称和内置名称绑定为局部变量
+            inline: 是否将小型模块级函数内联到调用处
+            inline_max_statements: 可内联函数的最大语句数
+            fold: 是否在平坦化之前进行常量折叠和常量传播
+            wrap_module: 是否将包含循环的模块级代码移入生成的初始化函数
+            flatten_scope: 平坦化范围，'top'只处理模块顶层函数，'all'同时按开销选择方法、
+                           嵌套函数和async函数
+            max_function_overhead: 平坦化方法、嵌套函数和async函数允许的最大开销比例
+            instrument: 分发计数插桩方式 ('auto', 'counters', 'monitoring')，None表示不插桩；
+                        插桩版本只用于预发布环境测量，不应发布
+            instrument_output: 插桩版本在进程退出时写入的计数文件
+            engine: 'fused'在一次遍历中完成重命名和平坦化，'passes'逐遍处理；
+                    启用全局名称本地化时总是逐遍处理
+            codegen: 代码生成后端 ('auto', 'unparse', 'astor')，auto在3.9+上使用ast.unparse
+            program_index: 整个源代码树的ProgramIndex，提供时索引中的文件按整包一致的映射改名函数，
+                           并改写引用树内函数的导入；混淆过程中只读取索引
+            naming: 新名称的生成方式，'random'为前缀加8个随机字母，'short'在混淆完成后按引用
+                    次数把最短的未使用标识符分配给函数名、变量名和平坦化生成的状态变量
+            seed: 构建种子。提供时所有随机选择(函数名、变量名、状态变量名和NOP插入)都来自
+                  以它为种子的独立随机数生成器，每次混淆前重新设置种子，相同的输入和配置
+                  得到逐字节相同的输出；None表示使用rng
+            rng: 没有提供seed时使用的随机数生成器，None表示random模块的全局生成器
         """
+        if engine not in ENGINES:
+            raise ValueError(f"不支持的处理引擎: {engine}")
+        if naming not in NAMING_STRATEGIES:
+            raise ValueError(f"不支持的命名方式: {naming}")
         self.flatten_code = flatten_code
         self.obfuscate_names = obfuscate_names
         self.obfuscate_vars = obfuscate_vars
         self.compile_to_pyc = compile_to_pyc
         self.nop_ratio = nop_ratio
+        self.dispatch = dispatch
+        self.granularity = granularity
+        self.block_size = block_size
+        self.nested_flatten = nested_flatten
+        self.max_overhead = max_overhead
+        self.keep_innermost_loops = keep_innermost_loops
+        self.peephole = peephole
+        self.localize = localize
+        self.inline = inline
+        self.inline_max_statements = inline_max_statements
+        self.fold = fold
+        self.wrap_module = wrap_module
+        self.flatten_scope = flatten_scope
+        self.max_function_overhead = max_function_overhead
+        self.instrument = instrument
+        self.instrument_output = instrument_output
+        self.engine = engine
+        self.codegen = resolve_backend(codegen)
+        self.program_index = program_index
+        self.naming = naming
+        self.seed = seed
+        self.rng = random.Random(seed) if seed is not None else (rng or random)
+        self.profile_policy = ProfileGuidedPolicy(profile_file, hot_threshold) if profile_file else None
         
-        self.original_confuser = PythonConfuser() if flatten_code else None
-        self.bytecode_obfuscator = BytecodeObfuscator(nop_ratio=nop_ratio) if compile_to_pyc else None
+        self.original_confuser = PythonConfuser(
+            dispatch=dispatch, granularity=granularity, block_size=block_size,
+            nested=nested_flatten, max_overhead=max_overhead,
+            keep_innermost_loops=keep_innermost_loops, scope=flatten_scope,
+            max_function_overhead=max_function_overhead, rng=self.rng
+        ) if flatten_code else None
+        self.bytecode_obfuscator = BytecodeObfuscator(nop_ratio=nop_ratio, rng=self.rng) if compile_to_pyc else None
         
         self.name_mapping = {}  # 保存函数名映射关系
         self.var_mapping = {}   # 保存变量名映射关系
+        self.flatten_stats = {}  # 保存平坦化统计信息
+        self.flatten_skipped = {}  # 保存按开销未平坦化的函数
+        self.peephole_report = {}  # 保存窥孔优化统计信息
+        self.localization_report = {}  # 保存全局名称本地化统计信息
+        self.inline_report = {}  # 保存函数内联统计信息
+        self.folding_report = []  # 保存常量折叠记录
+        self.wrap_report = []  # 保存模块级代码移动记录
+        self.profile_summary = []  # 保存剖析引导策略的摘要
+        self.instrument_report = None  # 保存分发计数插桩信息
+        self.naming_report = None  # 保存名称缩短统计信息
+        self.function_levels = {}  # 函数定义行号 -> 混淆级别
+        self.bytecode_levels = {}  # 混淆后的函数名 -> 混淆级别，供字节码混淆使用
     
     def obfuscate(self, source_code, filename="<string>"):
         """
@@ -48,55 +147,199 @@ class CompletePythonObfuscator:
             filename: 源代码的文件名（用于错误报告）
             
         Returns:
-            混淆后的代码或代码对象（如果编译为pyc）
+            混淆后的代码
         """
         try:
-            # 解析源代码为AST
-            tree = ast.parse(source_code)
+            return self.to_source(self.obfuscate_tree(source_code, filename))
+        except Exception as e:
+            return f"混淆失败: {str(e)}"
+    
+    def obfuscate_tree(self, source_code, filename="<string>"):
+        """
+        对Python源代码执行所有AST级混淆，返回混淆后的模块AST
+        
+        结果可以直接交给compile()编译，只有需要源代码时才调用to_source。
+        
+        Args:
+            source_code: Python源代码
+            filename: 源代码的文件名（用于错误报告）
             
+        Returns:
+            混淆后的模块AST，出错时抛出异常
+        """
+        # 每次混淆都从同一个种子开始，使输出只取决于输入和配置
+        if self.seed is not None:
+            self.rng.seed(self.seed)
+        
+        # 解析源代码为AST
+        tree = ast.parse(source_code)
+        
+        # 按剖析数据为每个函数选择混淆级别（需在重命名之前匹配函数名）
+        levels = {}
+        if self.profile_policy:
+            flattener = self.original_confuser.flattener if self.flatten_code else None
+            levels.update(self.profile_policy.function_levels(tree, filename, flattener))
+            self.profile_summary = self.profile_policy.summary()
+        
+        # 源代码中的混淆级别标记优先于剖析数据，标记本身从输出中删除
+        tree, pragma_levels = extract_function_levels(tree, source_code)
+        levels.update(pragma_levels)
+        self.function_levels = levels
+        skip_functions = {line for line, level in levels.items() if level == 'none'}
+        
+        # 常量折叠和常量传播，减少进入平坦化的语句
+        if self.fold:
+            tree, self.folding_report = fold_constants(tree, skip_functions)
+        
+        # 模块级代码移入初始化函数，使其使用快速局部变量并参与后续的内联和平坦化
+        if self.wrap_module:
+            tree, self.wrap_report = wrap_module_code(tree)
+        
+        # 内联小函数，需在重命名和平坦化之前进行
+        if self.inline:
+            tree, self.inline_report = inline_functions(tree, self.inline_max_statements, skip_functions)
+        
+        # 作用域索引在函数名混淆之前构建；之前的步骤没有改动AST时直接使用原始源代码
+        index = None
+        if self.obfuscate_vars:
+            unchanged = not (self.fold or self.wrap_module or self.inline)
+            index = ScopeIndex(tree, source_code if unchanged else None, filename, skip_functions)
+        
+        # 整包混淆时函数名使用全局一致的映射，并同步改写从树内其他模块导入的函数名
+        function_mapping = None
+        module = self.program_index.module_for(filename) if self.program_index and self.obfuscate_names else None
+        if module is not None:
+            self.program_index.rewrite_imports(tree, module)
+            function_mapping = self.program_index.file_mappings[module]
+        
+        if self.engine == 'fused' and not self.localize:
+            # 步骤1-3在一次分析遍历和一次改写中完成，结果与逐遍处理一致
+            flattener = self.original_confuser.flattener if self.flatten_code else None
+            tree, name_mapping, var_mapping, self.bytecode_levels = fused_obfuscate(
+                tree, flattener, self.obfuscate_names, self.obfuscate_vars, skip_functions, levels, index,
+                function_mapping, self.rng)
+            if self.obfuscate_names:
+                self.name_mapping = name_mapping
+            if self.obfuscate_vars:
+                self.var_mapping = var_mapping
+        else:
             # 步骤1: 函数名混淆
             if self.obfuscate_names:
-                tree, self.name_mapping = obfuscate_function_names(tree)
+                tree, self.name_mapping = obfuscate_function_names(tree, function_mapping, self.rng)
                 ast.fix_missing_locations(tree)
             
+            # 全局名称本地化，生成的局部别名随后参与变量名混淆
+            if self.localize:
+                tree, self.localization_report = localize_globals(tree, filename, skip_functions)
+            
             # 步骤2: 变量名混淆
             if self.obfuscate_vars:
-                tree, self.var_mapping = obfuscate_variable_names(tree)
-                ast.fix_missing_locations(tree)
+                tree, self.var_mapping = obfuscate_variable_names(tree, skip_functions, index, self.rng)
+            
+            # 字节码阶段只能通过(混淆后的)函数名识别代码对象
+            self.bytecode_levels = {
+                node.name: levels[node.lineno]
+                for node in ast.walk(tree)
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.lineno in levels
+            }
             
             # 步骤3: 代码平坦化
             if self.flatten_code:
+                self.original_confuser.flattener.function_levels = levels
                 tree = self.original_confuser.flattener.visit(tree)
                 ast.fix_missing_locations(tree)
+        
+        if self.flatten_code:
+            self.flatten_stats = self.original_confuser.flattener.stats
+            self.flatten_skipped = self.original_confuser.flattener.skipped
+        
+            # 步骤4: 窥孔优化，删除平坦化引入的冗余状态赋值和状态测试
+            if self.peephole:
+                tree, self.peephole_report = optimize_flattened(
+                    tree, self.original_confuser.flattener.state_vars)
+        
+        # 步骤5: 按引用次数把生成的随机名称替换为最短的未使用标识符
+        if self.naming == 'short':
+            tree = self._shorten_names(tree, fixed_functions=function_mapping is not None)
+        
+        if self.flatten_code:
+            # 分发计数插桩，计数文件中记录原始函数名
+            if self.instrument:
+                rename = {new: old for old, new in self.var_mapping.items()}
+                rename.update({new: old for old, new in self.name_mapping.items()})
+                tree, self.instrument_report = instrument_dispatch(
+                    tree, self.original_confuser.flattener.state_vars, self.instrument, self.instrument_output, rename)
+        
+        return tree
+    
+    def _shorten_names(self, tree, fixed_functions):
+        """
+        缩短生成的名称并同步更新映射表和字节码阶段使用的函数名
+
+        Args:
+            fixed_functions: 函数名是否来自整包索引，此时函数名需要在模块之间保持一致，不在这里改动
+        """
+        generated = list(self.var_mapping.values())
+        if not fixed_functions:
+            generated += self.name_mapping.values()
+        if self.flatten_code:
+            generated += self.original_confuser.flattener.generated_names
+        tree, mapping, self.naming_report = shorten_names(tree, generated)
+        self.var_mapping = {old: mapping.get(new, new) for old, new in self.var_mapping.items()}
+        self.name_mapping = {old: mapping.get(new, new) for old, new in self.name_mapping.items()}
+        self.bytecode_levels = {mapping.get(name, name): level for name, level in self.bytecode_levels.items()}
+        if self.flatten_code:
+            flattener = self.original_confuser.flattener
+            flattener.state_vars = {mapping.get(name, name) for name in flattener.state_vars}
+
+        def rename(qualname):
+            """报告中的(限定)函数名与输出保持一致"""
+            return '.'.join(mapping.get(part, part) for part in qualname.split('.'))
+
+        self.flatten_stats = {rename(name): info for name, info in self.flatten_stats.items()}
+        self.flatten_skipped = {rename(name): info for name, info in self.flatten_skipped.items()}
+        self.peephole_report = {rename(name): info for name, info in self.peephole_report.items()}
+        return tree
+    
+    def to_source(self, tree):
+        """
+        由混淆后的AST生成源代码，并在开头添加映射表注释
+        
+        Args:
+            tree: obfuscate_tree返回的模块AST
             
-            # 生成混淆后的源代码
-            obfuscated_code = astor.to_source(tree)
-            
-            # 添加映射表注释
-            mapping_comment = ""
-            if self.obfuscate_names and self.name_mapping:
-                mapping_comment += "# 函数名映射表:\n"
-                for original, obfuscated in self.name_mapping.items():
-                    mapping_comment += f"# {original} -> {obfuscated}\n"
-                mapping_comment += "\n"
-            
-            if self.obfuscate_vars and self.var_mapping:
-                mapping_comment += "# 变量名映射表:\n"
-                for original, obfuscated in self.var_mapping.items():
-                    mapping_comment += f"# {original} -> {obfuscated}\n"
-                mapping_comment += "\n"
-            
-            if mapping_comment:
-                obfuscated_code = mapping_comment + obfuscated_code
-            
-            # 步骤4: 如果需要编译为pyc，进行字节码混淆
-            if self.compile_to_pyc:
-                return obfuscated_code
-            
-            return obfuscated_code
-            
-        except Exception as e:
-            return f"混淆失败: {str(e)}"
+        Returns:
+            混淆后的源代码
+        """
+        return self._mapping_comment() + generate_source(tree, self.codegen)
+    
+    def write_source(self, tree, stream):
+        """
+        流式输出源代码: 先写入映射表注释，再每生成一条模块顶层语句就写入stream
+        
+        Args:
+            tree: obfuscate_tree返回的模块AST
+            stream: 输出的文本文件对象
+        """
+        stream.write(self._mapping_comment())
+        write_source(tree, stream, self.codegen)
+    
+    def _mapping_comment(self):
+        """生成函数名和变量名映射表注释"""
+        mapping_comment = ""
+        if self.obfuscate_names and self.name_mapping:
+            mapping_comment += "# 函数名映射表:\n"
+            for original, obfuscated in self.name_mapping.items():
+                mapping_comment += f"# {original} -> {obfuscated}\n"
+            mapping_comment += "\n"
+        
+        if self.obfuscate_vars and self.var_mapping:
+            mapping_comment += "# 变量名映射表:\n"
+            for original, obfuscated in self.var_mapping.items():
+                mapping_comment += f"# {original} -> {obfuscated}\n"
+            mapping_comment += "\n"
+        
+        return mapping_comment
     
     def get_name_mapping(self):
         """获取函数名映射表"""
@@ -105,11 +348,121 @@ class CompletePythonObfuscator:
     def get_var_mapping(self):
         """获取变量名映射表"""
         return self.var_mapping
+    
+    def get_flatten_stats(self):
+        """获取平坦化统计信息"""
+        return self.flatten_stats
+    
+    def get_flatten_skipped(self):
+        """获取按开销未平坦化的方法、嵌套函数和async函数"""
+        return self.flatten_skipped
+    
+    def get_peephole_report(self):
+        """获取窥孔优化统计信息"""
+        return self.peephole_report
+    
+    def get_localization_report(self):
+        """获取全局名称本地化统计信息"""
+        return self.localization_report
+    
+    def get_inline_report(self):
+        """获取函数内联统计信息"""
+        return self.inline_report
+    
+    def get_folding_report(self):
+        """获取常量折叠记录"""
+        return self.folding_report
+    
+    def get_wrap_report(self):
+        """获取模块级代码移动记录"""
+        return self.wrap_report
+    
+    def get_profile_summary(self):
+        """获取剖析引导策略的摘要"""
+        return self.profile_summary
+    
+    def get_instrument_report(self):
+        """获取分发计数插桩信息: (实际插桩方式, [(函数名, 分发循环数)])"""
+        return self.instrument_report
+    
+    def get_naming_report(self):
+        """获取名称缩短统计信息"""
+        return self.naming_report
+
+
+class ObfuscationResult:
+    """
+    一次obfuscate_source调用的结果
+
+    属性与CompletePythonObfuscator对应的get_*方法返回值相同，但只属于这一次调用。
+    """
+
+    def __init__(self, confuser, tree):
+        self.tree = tree  # 混淆后的模块AST，可以直接交给compile()
+        self.source = confuser.to_source(tree)  # 混淆后的源代码，开头是映射表注释
+        self.name_mapping = confuser.name_mapping
+        self.var_mapping = confuser.var_mapping
+        self.flatten_stats = confuser.flatten_stats
+        self.flatten_skipped = confuser.flatten_skipped
+        self.peephole_report = confuser.peephole_report
+        self.localization_report = confuser.localization_report
+        self.inline_report = confuser.inline_report
+        self.folding_report = confuser.folding_report
+        self.wrap_report = confuser.wrap_report
+        self.profile_summary = confuser.profile_summary
+        self.instrument_report = confuser.instrument_report
+        self.naming_report = confuser.naming_report
+        self.bytecode_levels = confuser.bytecode_levels
+
+
+# 每个线程独享的随机数生成器，没有提供seed时由obfuscate_source使用
+_thread_state = threading.local()
+
+
+def _thread_rng():
+    """当前线程的随机数生成器，首次使用时由操作系统的随机源初始化"""
+    rng = getattr(_thread_state, 'rng', None)
+    if rng is None:
+        rng = _thread_state.rng = random.Random()
+    return rng
+
+
+def obfuscate_source(source_code, filename="<string>", **options):
+    """
+    混淆一段源代码，返回ObfuscationResult
+
+    CompletePythonObfuscator把映射表和统计信息保存在实例上，平坦化器在处理过程中修改
+    自身的状态，同一个实例不能同时处理多个请求。这里每次调用创建独立的混淆器，
+    结果全部通过返回值传出，随机名称来自当前线程独享的随机数生成器(提供seed时
+    来自本次调用的生成器)，不读写random模块的全局状态，因此可以在多个线程中
+    并发调用，包括没有GIL的自由线程构建。options中的program_index在调用之间只读共享。
+
+    Args:
+        source_code: Python源代码
+        filename: 源代码的文件名（用于错误报告和剖析数据匹配）
+        **options: CompletePythonObfuscator的混淆选项，不包括compile_to_pyc和rng
+
+    Returns:
+        ObfuscationResult，出错时抛出异常
+    """
+    if options.get('compile_to_pyc'):
+        raise ValueError("obfuscate_source不编译pyc，请对结果的tree调用compile()")
+    if 'rng' in options:
+        raise TypeError("obfuscate_source不接受rng参数，请使用seed")
+    rng = _thread_rng() if options.get('seed') is None else None
+    confuser = CompletePythonObfuscator(rng=rng, **options)
+    return ObfuscationResult(confuser, confuser.obfuscate_tree(source_code, filename))
 
 
 def obfuscate_file(input_file, output_file=None, flatten_code=True, 
                   obfuscate_names=True, obfuscate_vars=True,
-                  compile_to_pyc=False, nop_ratio=0.2):
+                  compile_to_pyc=False, nop_ratio=0.2, dispatch='auto',
+                  granularity='statement', block_size=None, nested_flatten=False, max_overhead=0.25,
+                  keep_innermost_loops=True, profile_file=None, hot_threshold=0.1, peephole=True,
+                  localize=False, inline=False, inline_max_statements=8, fold=False,
+                  wrap_module=False, flatten_scope='top', max_function_overhead=0.75,
+                  instrument=None, instrument_output='dispatch_counts.json', engine='fused',
+                  codegen='auto', stream_output=False, program_index=None, naming='random', seed=None):
     """
     混淆指定的Python文件
     
@@ -121,6 +474,30 @@ def obfuscate_file(input_file, output_file=None, flatten_code=True,
         obfuscate_vars: 是否启用变量名混淆
         compile_to_pyc: 是否编译为pyc文件
         nop_ratio: NOP指令比例
+        dispatch: 平坦化状态分发方式 ('linear', 'binary', 'auto')
+        granularity: 平坦化粒度 ('statement', 'block')
+        block_size: block粒度下每个基本块的最大语句数，None表示自动确定
+        nested_flatten: 是否展开函数内嵌套的if/for/while
+        max_overhead: 展开单个复合语句允许的最大分发开销比例
+        keep_innermost_loops: 展开嵌套结构时是否保留最内层循环的原结构
+        profile_file: cProfile/pstats文件，提供时热点函数只做重命名
+        hot_threshold: 热点函数的累计耗时占比阈值
+        peephole: 是否在平坦化之后执行窥孔优化
+        localize: 是否将频繁使用的全局名称和内置名称绑定为局部变量
+        inline: 是否将小型模块级函数内联到调用处
+        inline_max_statements: 可内联函数的最大语句数
+        fold: 是否在平坦化之前进行常量折叠和常量传播
+        wrap_module: 是否将包含循环的模块级代码移入生成的初始化函数
+        flatten_scope: 平坦化范围 ('top', 'all')
+        max_function_overhead: 平坦化方法、嵌套函数和async函数允许的最大开销比例
+        instrument: 分发计数插桩方式 ('auto', 'counters', 'monitoring')，None表示不插桩
+        instrument_output: 插桩版本写入的计数文件
+        engine: 处理引擎 ('fused', 'passes')
+        codegen: 代码生成后端 ('auto', 'unparse', 'astor')
+        stream_output: 输出到文件时是否每生成一条顶层语句就写入文件，不在内存中构造完整的源代码
+        program_index: 整个源代码树的ProgramIndex，由obfuscate_package提供
+        naming: 新名称的生成方式 ('random', 'short')
+        seed: 构建种子，提供时输出逐字节可重现，pyc使用基于源代码哈希的文件头代替时间戳
         
     Returns:
         混淆结果消息
@@ -134,10 +511,92 @@ def obfuscate_file(input_file, output_file=None, flatten_code=True,
             obfuscate_names=obfuscate_names,
             obfuscate_vars=obfuscate_vars,
             compile_to_pyc=compile_to_pyc,
-            nop_ratio=nop_ratio
+            nop_ratio=nop_ratio,
+            dispatch=dispatch,
+            granularity=granularity,
+            block_size=block_size,
+            nested_flatten=nested_flatten,
+            max_overhead=max_overhead,
+            keep_innermost_loops=keep_innermost_loops,
+            profile_file=profile_file,
+            hot_threshold=hot_threshold,
+            peephole=peephole,
+            localize=localize,
+            inline=inline,
+            inline_max_statements=inline_max_statements,
+            fold=fold,
+            wrap_module=wrap_module,
+            flatten_scope=flatten_scope,
+            max_function_overhead=max_function_overhead,
+            instrument=instrument,
+            instrument_output=instrument_output,
+            engine=engine,
+            codegen=codegen,
+            program_index=program_index,
+            naming=naming,
+            seed=seed
         )
 
-        obfuscated_code = confuser.obfuscate(source_code, input_file)
+        if compile_to_pyc or (stream_output and output_file):
+            # pyc模式直接编译混淆后的AST，不生成源代码；流式输出在写文件时才生成源代码
+            tree = confuser.obfuscate_tree(source_code, input_file)
+        else:
+            obfuscated_code = confuser.obfuscate(source_code, input_file)
+
+        if confuser.get_profile_summary():
+            print("剖析引导混淆摘要:", file=sys.stderr)
+            for line in confuser.get_profile_summary():
+                print(line, file=sys.stderr)
+
+        if flatten_code and granularity == 'block':
+            print("基本块合并统计:", file=sys.stderr)
+            for line in format_flatten_report(confuser.get_flatten_stats()):
+                print(line, file=sys.stderr)
+
+        if confuser.get_flatten_skipped():
+            print("按开销未平坦化的函数:", file=sys.stderr)
+            for line in format_selection_report(confuser.get_flatten_skipped()):
+                print(line, file=sys.stderr)
+
+        if flatten_code and nested_flatten:
+            print("出于性能考虑保持原结构的区域:", file=sys.stderr)
+            for line in format_structured_report(confuser.get_flatten_stats()):
+                print(line, file=sys.stderr)
+
+        if fold:
+            print("常量折叠记录:", file=sys.stderr)
+            for line in format_folding_report(confuser.get_folding_report()):
+                print(line, file=sys.stderr)
+
+        if wrap_module:
+            print("移入初始化函数的模块级代码:", file=sys.stderr)
+            for line in format_wrap_report(confuser.get_wrap_report()):
+                print(line, file=sys.stderr)
+
+        if inline:
+            print("内联的函数调用:", file=sys.stderr)
+            for line in format_inline_report(confuser.get_inline_report()):
+                print(line, file=sys.stderr)
+
+        if localize:
+            print("本地化的全局名称和内置名称:", file=sys.stderr)
+            for line in format_localization_report(confuser.get_localization_report()):
+                print(line, file=sys.stderr)
+
+        if confuser.get_peephole_report():
+            print("窥孔优化统计:", file=sys.stderr)
+            for line in format_peephole_report(confuser.get_peephole_report()):
+                print(line, file=sys.stderr)
+
+        if confuser.get_naming_report():
+            print(f"名称缩短统计 ({input_file}):", file=sys.stderr)
+            for line in format_naming_report(confuser.get_naming_report()):
+                print(line, file=sys.stderr)
+
+        if confuser.get_instrument_report():
+            print("分发计数插桩:", file=sys.stderr)
+            for line in format_instrument_report(confuser.get_instrument_report()):
+                print(line, file=sys.stderr)
 
         if compile_to_pyc:
             if output_file is None:
@@ -147,7 +606,11 @@ def obfuscate_file(input_file, output_file=None, flatten_code=True,
                 input_file=input_file,
                 output_file=output_file,
                 nop_ratio=nop_ratio,
-                source_code=obfuscated_code
+                tree=tree,
+                source_size=len(source_code.encode()),
+                function_levels=confuser.bytecode_levels,
+                source_hash=importlib.util.source_hash(source_code.encode()) if seed is not None else None,
+                rng=confuser.rng
             )
             
             if success:
@@ -157,7 +620,10 @@ def obfuscate_file(input_file, output_file=None, flatten_code=True,
         else:
             if output_file:
                 with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(obfuscated_code)
+                    if stream_output:
+                        confuser.write_source(tree, f)
+                    else:
+                        f.write(obfuscated_code)
                 return f"混淆后的代码已保存到 {output_file}"
             else:
                 return obfuscated_code
@@ -165,4 +631,58 @@ def obfuscate_file(input_file, output_file=None, flatten_code=True,
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return f"混淆失败: {str(e)}" 
\ No newline at end of file
+        return f"混淆失败: {str(e)}" 
+
+
+# 工作进程中只读共享的整包索引，由进程池的initializer设置
+_worker_index = None
+
+
+def _init_package_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _obfuscate_package_file(input_file, output_file, options):
+    return obfuscate_file(input_file, output_file, program_index=_worker_index, **options)
+
+
+def obfuscate_package(input_dir, output_dir, workers=None, **options):
+    """
+    混淆整个源代码树，保持模块之间的导入关系
+
+    先用ProgramIndex对整个目录做一次分析，为所有函数分配全局一致的新名称；再把每个
+    .py文件交给工作进程，按目录结构写入output_dir。索引在每个工作进程启动时传入一次，
+    之后只读共享。提供seed时每个文件使用由seed和文件相对路径派生的种子，输出与
+    处理顺序和工作进程数无关。
+
+    Args:
+        input_dir: 输入目录
+        output_dir: 输出目录
+        workers: 工作进程数，None表示CPU核数，1表示在当前进程中顺序处理
+        **options: 传给obfuscate_file的混淆选项
+
+    Returns:
+        [(输入文件, 混淆结果消息)]
+    """
+    seed = options.pop('seed', None)
+    rng = random.Random(seed) if seed is not None else None
+    index = ProgramIndex(input_dir, naming=options.get('naming', 'random'), rng=rng)
+    jobs = []
+    for input_file in find_python_files(input_dir):
+        relative = os.path.relpath(input_file, input_dir)
+        output_file = os.path.join(output_dir, relative)
+        if options.get('compile_to_pyc'):
+            output_file += 'c'
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        file_seed = None if seed is None else f"{seed}:{relative.replace(os.sep, '/')}"
+        jobs.append((input_file, output_file, dict(options, seed=file_seed)))
+
+    if workers == 1:
+        return [(input_file, obfuscate_file(input_file, output_file, program_index=index, **file_options))
+                for input_file, output_file, file_options in jobs]
+
+    with ProcessPoolExecutor(workers, initializer=_init_package_worker, initargs=(index,)) as executor:
+        futures = [executor.submit(_obfuscate_package_file, input_file, output_file, file_options)
+                   for input_file, output_file, file_options in jobs]
+        return [(input_file, future.result()) for (input_file, _, _), future in zip(jobs, futures)]
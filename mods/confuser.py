@@ -1,16 +1,126 @@
 import ast
-import astor
+import math
 import random
 import string
+from .pragmas import extract_function_levels
+from .codegen import generate_source, resolve_backend
+from .control_flow import (ControlFlowBuilder, DispatchCostModel, binds_name,
+                           contains_loop_escape, loop_escapes_are_flattenable, function_kind,
+                           function_flatten_overhead, max_loop_depth)
+
+
+LOOP_NODES = (ast.For, ast.While, ast.AsyncFor)
+COMPREHENSION_NODES = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+class LoopNestingAnalyzer(ast.NodeVisitor):
+    """静态分析函数体内循环的嵌套关系"""
+
+    def __init__(self):
+        self.depth = {}        # id(循环节点) -> 嵌套深度，最外层为1
+        self.has_inner = {}    # id(循环节点) -> 是否包含内层循环
+        self._stack = []
+
+    def analyze(self, body):
+        """分析语句列表中的所有循环"""
+        for stmt in body:
+            self.visit(stmt)
+        return self
+
+    def is_innermost(self, node):
+        """循环内是否不再包含其他循环（推导式也视为循环）"""
+        return id(node) in self.depth and not self.has_inner[id(node)]
+
+    def _visit_loop(self, node):
+        if self._stack:
+            self.has_inner[id(self._stack[-1])] = True
+        if isinstance(node, COMPREHENSION_NODES):
+            # 推导式本身不会被展开，只作为外层循环的内层循环
+            self.generic_visit(node)
+            return
+
+        self.depth[id(node)] = len(self._stack) + 1
+        self.has_inner[id(node)] = False
+        self._stack.append(node)
+        self.generic_visit(node)
+        self._stack.pop()
+
+    visit_For = visit_While = visit_AsyncFor = _visit_loop
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _visit_loop
+
+    def _skip_scope(self, node):
+        """嵌套函数、类和lambda中的循环属于其他作用域"""
+        return
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = visit_Lambda = _skip_scope
 
 
 class CodeFlattener(ast.NodeVisitor):
     """用于执行代码平坦化的AST访问器类"""
 
-    def __init__(self):
-        self.state_var = '_' + ''.join(random.choice(string.ascii_lowercase) for _ in range(5))
+    DISPATCH_MODES = ('linear', 'binary', 'auto')
+    GRANULARITIES = ('statement', 'block')
+    SCOPES = ('top', 'all')
+
+    def __init__(self, dispatch='auto', binary_threshold=16, granularity='statement', block_size=None,
+                 nested=False, max_overhead=0.25, keep_innermost_loops=True, scope='top',
+                 max_function_overhead=0.75, min_function_statements=2, rng=None):
+        """
+        初始化平坦化器
+
+        Args:
+            dispatch: 状态分发方式，'linear'为逐个比较的if链，'binary'为二分比较树，
+                      'auto'按每个函数的状态数自动选择
+            binary_threshold: auto模式下启用二分比较树的最小状态数
+            granularity: 平坦化粒度，'statement'为每条语句一个状态，
+                         'block'将连续的非分支语句合并为一个基本块
+            block_size: block粒度下每个基本块的最大语句数，None表示按函数长度自动确定
+            nested: 是否基于控制流图展开函数内嵌套的if/for/while
+            max_overhead: 展开单个复合语句允许引入的最大分发开销(占函数原始工作量的比例)，
+                          超过时该语句保持原结构
+            keep_innermost_loops: 展开嵌套结构时是否始终保留最内层循环的原结构，
+                                  避免在热点循环中引入分发开销
+            scope: 平坦化范围，'top'只处理模块顶层函数，'all'同时按开销选择方法、
+                   嵌套函数和async函数
+            max_function_overhead: 'all'范围下平坦化方法、嵌套函数和async函数允许的
+                                   最大开销比例(见function_flatten_overhead)
+            min_function_statements: 'all'范围下方法、嵌套函数和async函数的最少语句数，
+                                     更小的函数(如属性访问器)不做平坦化
+            rng: 随机数生成器(random.Random实例)，None表示使用random模块的全局生成器
+        """
+        if dispatch not in self.DISPATCH_MODES:
+            raise ValueError(f"不支持的分发方式: {dispatch}")
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"不支持的平坦化粒度: {granularity}")
+        if block_size is not None and block_size < 1:
+            raise ValueError("基本块大小必须大于0")
+        if scope not in self.SCOPES:
+            raise ValueError(f"不支持的平坦化范围: {scope}")
+
+        self.dispatch = dispatch
+        self.binary_threshold = binary_threshold
+        self.granularity = granularity
+        self.block_size = block_size
+        self.nested = nested
+        self.max_overhead = max_overhead
+        self.keep_innermost_loops = keep_innermost_loops
+        self.scope = scope
+        self.max_function_overhead = max_function_overhead
+        self.min_function_statements = min_function_statements
+        self.rng = rng or random
+        self.iter_shadowed = False  # 模块是否重新绑定了内置函数iter
+        self.function_levels = {}   # 函数定义行号 -> 混淆级别，非'full'的函数不做平坦化
+        self.state_var = self.new_state_var()
         self.next_state = 0
         self.states = {}
+        self.stats = {}  # 函数名 -> 平坦化统计信息
+        self.skipped = {}  # 按开销未平坦化的函数名 -> 选择信息
+        self.generated_names = []  # 平坦化生成的状态变量名和临时变量名
+        self.state_vars = set()  # 分发循环的状态变量名，窥孔优化只改写这些变量的赋值
+
+    def new_state_var(self):
+        """生成状态变量名: 下划线加5个随机小写字母，一次调用取完所有随机字母"""
+        return '_' + ''.join(self.rng.choices(string.ascii_lowercase, k=5))
 
     def get_next_state(self):
         """获取下一个状态值"""
@@ -18,120 +128,454 @@ class CodeFlattener(ast.NodeVisitor):
         self.next_state += 1
         return state
 
-    def visit_FunctionDef(self, node):
-        """访问函数定义节点，对函数体进行平坦化"""
-        original_body = node.body
+    def choose_dispatch(self, num_states, has_back_edges):
+        """
+        为单个函数选择分发方式
+
+        线性if链在状态顺序前进时可以在一次循环内依次落入后续状态，
+        只有出现回跳时才需要重新从头比较，因此auto模式仅在存在回跳
+        且状态数达到阈值时才改用二分比较树。
+        """
+        if self.dispatch != 'auto':
+            return self.dispatch
+        if has_back_edges and num_states >= self.binary_threshold:
+            return 'binary'
+        return 'linear'
+
+    def _state_test(self, op, state):
+        """生成状态变量与常量的比较表达式"""
+        return ast.Compare(
+            left=ast.Name(id=self.state_var, ctx=ast.Load()),
+            ops=[op],
+            comparators=[ast.Constant(value=state)]
+        )
 
-        self.state_var = '_' + ''.join(random.choice(string.ascii_lowercase) for _ in range(5))
-        self.next_state = 0
-        self.states = {}
+    def _build_linear(self, cases):
+        """生成逐个比较状态值的if链"""
+        return [
+            ast.If(test=self._state_test(ast.Eq(), state), body=body, orelse=[])
+            for state, body in cases
+        ]
+
+    def _build_binary(self, cases):
+        """生成二分比较树，每次分发只需要log2(n)次比较"""
+        if len(cases) == 1:
+            # 状态变量的取值在循环内总是合法的，叶子节点无需再比较
+            return list(cases[0][1])
+
+        mid = len(cases) // 2
+        return [
+            ast.If(
+                test=self._state_test(ast.Lt(), cases[mid][0]),
+                body=self._build_binary(cases[:mid]),
+                orelse=self._build_binary(cases[mid:])
+            )
+        ]
+
+    def build_dispatch(self, cases, has_back_edges=False, name=None, entry=None):
+        """
+        根据状态分支生成完整的状态机
+
+        Args:
+            cases: (状态值, 分支体) 列表，分支体末尾需自行设置下一个状态
+            has_back_edges: 状态转移中是否存在跳回更小状态的回边
+            name: 函数名，用于记录实际采用的分发方式
+            entry: 初始状态值，默认为最小的状态值
+
+        Returns:
+            状态变量初始化语句和分发循环组成的语句列表
+        """
+        cases = sorted(cases, key=lambda case: case[0])
+        mode = self.choose_dispatch(len(cases), has_back_edges)
+        if name is not None:
+            self.stats.setdefault(name, {})['dispatch'] = mode
 
-        state_mapping = {}
-        for i, stmt in enumerate(original_body):
-            state = self.get_next_state()
-            state_mapping[i] = state
+        state_assign = ast.Assign(
+            targets=[ast.Name(id=self.state_var, ctx=ast.Store())],
+            value=ast.Constant(value=entry if entry is not None else (cases[0][0] if cases else -1))
+        )
 
-        end_state = -1
+        while_test = self._state_test(ast.NotEq(), -1)
 
-        flattened_body = []
+        if mode == 'binary':
+            switch_body = self._build_binary(cases)
+        else:
+            switch_body = self._build_linear(cases)
 
-        state_assign = ast.Assign(
-            targets=[ast.Name(id=self.state_var, ctx=ast.Store())],
-            value=ast.Constant(value=0)
+        while_loop = ast.While(
+            test=while_test,
+            body=switch_body or [ast.Pass()],
+            orelse=[]
         )
-        flattened_body.append(state_assign)
 
-        while_test = ast.Compare(
-            left=ast.Name(id=self.state_var, ctx=ast.Load()),
-            ops=[ast.NotEq()],
-            comparators=[ast.Constant(value=end_state)]
+        return [state_assign, while_loop]
+
+    def resolve_block_size(self, num_statements):
+        """
+        确定基本块的最大语句数
+
+        未指定时取函数语句数的平方根，使长函数仍保留足够多的状态。
+        """
+        if self.block_size is not None:
+            return self.block_size
+        return max(2, math.ceil(math.sqrt(num_statements)))
+
+    def _new_temp(self):
+        """生成平坦化使用的临时变量名"""
+        name = f"{self.state_var}{self.get_next_state()}"
+        self.generated_names.append(name)
+        return name
+
+    def _should_flatten(self, stmt, loop_depth):
+        """决定是否展开一条if/for/while语句"""
+        if not self.nested:
+            return False
+
+        if isinstance(stmt, ast.If) and loop_depth and contains_loop_escape(stmt.body + stmt.orelse):
+            # 外层循环已展开，其中的break/continue只能通过展开if改写为状态跳转
+            return True
+
+        if (self.keep_innermost_loops and isinstance(stmt, (ast.For, ast.While))
+                and self._loops.is_innermost(stmt)):
+            self._keep_structured(stmt, 'innermost_loop')
+            return False
+
+        if isinstance(stmt, ast.For) and self.iter_shadowed:
+            self._keep_structured(stmt, 'iter_shadowed')
+            return False
+
+        if isinstance(stmt, (ast.For, ast.While)) and not loop_escapes_are_flattenable(stmt):
+            self._keep_structured(stmt, 'loop_control')
+            return False
+
+        overhead = self._cost_model.overhead(stmt, loop_depth)
+        if overhead > self.max_overhead:
+            self._keep_structured(stmt, 'cost', overhead)
+            return False
+        return True
+
+    def _keep_structured(self, stmt, reason, overhead=None):
+        """记录保持原结构的复合语句"""
+        region = {
+            'lineno': getattr(stmt, 'lineno', None),
+            'kind': type(stmt).__name__.lower(),
+            'reason': reason,
+            'loop_depth': self._loops.depth.get(id(stmt)),
+        }
+        if overhead is not None:
+            region['overhead'] = round(overhead, 3)
+        self._structured.append(region)
+
+    def _state_store(self, block):
+        """生成跳转到指定基本块的状态赋值"""
+        return ast.Assign(
+            targets=[ast.Name(id=self.state_var, ctx=ast.Store())],
+            value=ast.Constant(value=-1 if block is None else block.state)
         )
 
-        switch_body = []
+    def _render_block(self, block):
+        """生成基本块对应的分支体"""
+        body = list(block.stmts)
+        if block.kind == 'branch':
+            body.append(ast.If(
+                test=block.test,
+                body=[self._state_store(block.targets[0])],
+                orelse=[self._state_store(block.targets[1])]
+            ))
+        elif block.kind == 'iterate':
+            # 对同一个迭代器执行只取一个元素的for循环，由解释器完成取值和解包
+            body.append(ast.For(
+                target=block.loop_target,
+                iter=ast.Name(id=block.iterator, ctx=ast.Load()),
+                body=[self._state_store(block.targets[0]), ast.Break()],
+                orelse=[self._state_store(block.targets[1])],
+                type_comment=None
+            ))
+        else:
+            body.append(self._state_store(block.targets[0]))
+        return body
+
+    def _estimate_states(self, body):
+        """估算函数完全展开时的状态数和分发方式"""
+        num_states = 0
+        has_loops = False
+        for stmt in body:
+            for node in ast.walk(stmt):
+                if isinstance(node, ast.stmt):
+                    num_states += 1
+                if isinstance(node, (ast.For, ast.While)):
+                    has_loops = True
+        return num_states, self.choose_dispatch(num_states, has_loops)
 
-        for i, stmt in enumerate(original_body):
-            state = state_mapping[i]
-            next_state = state_mapping.get(i + 1, end_state)
+    def visit_FunctionDef(self, node):
+        """访问函数定义节点，对函数体进行平坦化"""
+        return self.flatten_function(node, node.name)
 
-            condition = ast.Compare(
-                left=ast.Name(id=self.state_var, ctx=ast.Load()),
-                ops=[ast.Eq()],
-                comparators=[ast.Constant(value=state)]
-            )
+    visit_AsyncFunctionDef = visit_FunctionDef
 
-            # 创建分支体
-            if isinstance(stmt, ast.Return):
-                branch_body = [
-                    stmt,
-                    ast.Assign(
-                        targets=[ast.Name(id=self.state_var, ctx=ast.Store())],
-                        value=ast.Constant(value=end_state)
-                    )
-                ]
-            else:
-                branch_body = [
-                    stmt,
-                    ast.Assign(
-                        targets=[ast.Name(id=self.state_var, ctx=ast.Store())],
-                        value=ast.Constant(value=next_state)
-                    )
-                ]
-
-            if_stmt = ast.If(
-                test=condition,
-                body=branch_body,
-                orelse=[]
-            )
+    def flatten_function(self, node, name):
+        """
+        对函数体进行平坦化
 
-            switch_body.append(if_stmt)
+        Args:
+            node: 函数定义节点
+            name: 记录统计信息使用的(限定)函数名
+        """
+        # global/nonlocal声明作用于整个函数，保留在分发循环之前
+        declarations = [stmt for stmt in node.body if isinstance(stmt, (ast.Global, ast.Nonlocal))]
+        original_body = [stmt for stmt in node.body if not isinstance(stmt, (ast.Global, ast.Nonlocal))]
 
-        while_loop = ast.While(
-            test=while_test,
-            body=switch_body,
-            orelse=[]
+        self.state_var = self.new_state_var()
+        self.generated_names.append(self.state_var)
+        self.state_vars.add(self.state_var)
+        self.next_state = 0
+        self.states = {}
+        self._structured = []
+
+        if self.nested:
+            self._loops = LoopNestingAnalyzer().analyze(original_body)
+            num_states, mode = self._estimate_states(original_body)
+            self._cost_model = DispatchCostModel(original_body, num_states, mode)
+
+        block_size = self.resolve_block_size(len(original_body)) if self.granularity == 'block' else None
+        builder = ControlFlowBuilder(self._should_flatten, self._new_temp,
+                                     granularity=self.granularity, block_size=block_size)
+        entry, blocks = builder.build(original_body)
+
+        cases = [(block.state, self._render_block(block)) for block in blocks]
+        has_back_edges = any(
+            target is not None and target.state <= block.state
+            for block in blocks for target in block.targets
         )
 
-        flattened_body.append(while_loop)
+        statements = sum(block.source_count for block in blocks)
+        self.stats[name] = {
+            'statements': statements,
+            'states': len(blocks),
+            'dispatches_removed': sum(max(0, block.source_count - 1) for block in blocks),
+            'structured': self._structured,
+        }
 
-        node.body = flattened_body
+        node.body = declarations + self.build_dispatch(cases, has_back_edges=has_back_edges, name=name,
+                                                       entry=-1 if entry is None else entry.state)
 
         return node
 
-    def visit_Module(self, node):
-        """访问模块节点，处理全局层次的代码"""
-        new_body = []
-        for item in node.body:
-            if isinstance(item, ast.FunctionDef):
-                new_body.append(self.visit_FunctionDef(item))
+    def _functions(self, node, prefix='', level='full', owner=None):
+        """
+        按后序遍历模块中的所有函数，内层函数先于外层函数
+
+        Yields:
+            (函数定义节点, 限定名, 混淆级别, 所属作用域节点)
+        """
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                # 没有单独指定级别的内层函数沿用外层函数的级别
+                child_level = self.function_levels.get(child.lineno, level)
+                yield from self._functions(child, f"{prefix}{child.name}.", child_level, child)
+                yield child, prefix + child.name, child_level, owner
+            elif isinstance(child, ast.ClassDef):
+                yield from self._functions(child, f"{prefix}{child.name}.", level, child)
             else:
-                new_body.append(item)
+                yield from self._functions(child, prefix, level, owner)
+
+    def select_function(self, node, owner):
+        """
+        按开销决定是否平坦化方法、嵌套函数或async函数
+
+        综合函数体大小、循环嵌套深度以及是否为生成器/协程估算平坦化开销，
+        函数体过小(如属性访问器)或开销超过max_function_overhead时不做平坦化。
+
+        Returns:
+            (是否平坦化, 选择信息)
+        """
+        body = [stmt for stmt in node.body if not isinstance(stmt, (ast.Global, ast.Nonlocal))]
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+                and isinstance(body[0].value.value, str):
+            # 文档字符串不计入函数体大小
+            body = body[1:]
+        kind = function_kind(node)
+        if kind == 'function':
+            kind = 'method' if isinstance(owner, ast.ClassDef) else ('nested' if owner is not None else 'function')
+        info = {
+            'lineno': node.lineno,
+            'kind': kind,
+            'statements': sum(isinstance(child, ast.stmt) for stmt in body for child in ast.walk(stmt)),
+            'loop_depth': max_loop_depth(body),
+            'overhead': round(function_flatten_overhead(node), 3),
+        }
+        if info['statements'] < self.min_function_statements:
+            info['reason'] = 'small'
+        elif info['overhead'] > self.max_function_overhead:
+            info['reason'] = 'cost'
+        return 'reason' not in info, info
+
+    def would_flatten(self, func, owner, top_level):
+        """
+        不考虑混淆级别，判断函数按所在位置和开销是否会被平坦化
+
+        Args:
+            func: 函数定义节点
+            owner: 所属作用域节点(类或外层函数)，模块级为None
+            top_level: 是否为模块顶层语句
+        """
+        if top_level and isinstance(func, ast.FunctionDef):
+            return True
+        return self.scope == 'all' and self.select_function(func, owner)[0]
 
-        node.body = new_body
+    def visit_Module(self, node):
+        """访问模块节点，处理全局层次的代码"""
+        self.stats = {}
+        self.skipped = {}
+        self.generated_names = []
+        self.state_vars = set()
+        self.iter_shadowed = binds_name(node, 'iter')
+        top_level = {id(stmt) for stmt in node.body}
+        for func, name, level, owner in list(self._functions(node)):
+            self.process_function(func, name, level, owner, id(func) in top_level)
         return node
 
+    def process_function(self, func, name, level, owner, top_level):
+        """
+        按混淆级别、所在位置和开销处理单个函数
+
+        Args:
+            func: 函数定义节点
+            name: 限定名
+            level: 混淆级别，非'full'时不做平坦化
+            owner: 所属作用域节点(类或外层函数)，模块级为None
+            top_level: 是否为模块顶层语句
+        """
+        if level != 'full':
+            return
+        if top_level and isinstance(func, ast.FunctionDef):
+            # 模块顶层的普通函数总是平坦化
+            self.flatten_function(func, name)
+            return
+        if self.scope != 'all':
+            return
+        selected, info = self.select_function(func, owner)
+        if selected:
+            self.flatten_function(func, name)
+        else:
+            self.skipped[name] = info
+
 
 class PythonConfuser:
     """Python代码混淆器主类"""
 
-    def __init__(self):
-        self.flattener = CodeFlattener()
+    def __init__(self, dispatch='auto', granularity='statement', block_size=None, nested=False, max_overhead=0.25,
+                 keep_innermost_loops=True, scope='top', max_function_overhead=0.75, codegen='auto', rng=None):
+        self.codegen = resolve_backend(codegen)
+        self.flattener = CodeFlattener(dispatch=dispatch, granularity=granularity, block_size=block_size,
+                                       nested=nested, max_overhead=max_overhead,
+                                       keep_innermost_loops=keep_innermost_loops, scope=scope,
+                                       max_function_overhead=max_function_overhead, rng=rng)
 
     def obfuscate(self, source_code):
         """混淆输入的源代码"""
         try:
             tree = ast.parse(source_code)
+            tree, self.flattener.function_levels = extract_function_levels(tree, source_code)
 
             flattened_tree = self.flattener.visit(tree)
 
             ast.fix_missing_locations(flattened_tree)
 
-            obfuscated_code = astor.to_source(flattened_tree)
+            obfuscated_code = generate_source(flattened_tree, self.codegen)
 
             return obfuscated_code
         except Exception as e:
             return f"混淆失败: {str(e)}"
 
 
+def format_flatten_report(stats):
+    """
+    生成平坦化统计报告
+
+    Args:
+        stats: CodeFlattener.stats
+
+    Returns:
+        报告文本行列表
+    """
+    lines = []
+    total_removed = 0
+    for name, info in stats.items():
+        removed = info.get('dispatches_removed', 0)
+        total_removed += removed
+        lines.append(f"  {name}: {info.get('statements', 0)} 条语句 -> {info.get('states', 0)} 个状态, "
+                     f"减少 {removed} 次分发 ({info.get('dispatch', 'linear')})")
+    lines.append(f"共减少 {total_removed} 次状态分发")
+    return lines
+
+
+STRUCTURED_REASONS = {
+    'innermost_loop': '最内层循环',
+    'cost': '分发开销超出阈值',
+    'loop_control': 'break/continue位于保持原结构的语句中',
+    'iter_shadowed': '模块重新绑定了iter',
+}
+
+
+def format_structured_report(stats):
+    """
+    生成保持原结构(未展开)区域的报告
+
+    Args:
+        stats: CodeFlattener.stats
+
+    Returns:
+        报告文本行列表
+    """
+    lines = []
+    for name, info in stats.items():
+        for region in info.get('structured', []):
+            detail = STRUCTURED_REASONS.get(region['reason'], region['reason'])
+            if region.get('loop_depth'):
+                detail += f", 循环深度 {region['loop_depth']}"
+            if 'overhead' in region:
+                detail += f", 预计开销 {region['overhead']:.0%}"
+            lines.append(f"  {name} 第{region['lineno']}行 {region['kind']}: {detail}")
+    if not lines:
+        lines.append("  无")
+    return lines
+
+
+SELECTION_KINDS = {
+    'method': '方法',
+    'nested': '嵌套函数',
+    'coroutine': '协程',
+    'generator': '生成器',
+    'function': '函数',
+}
+
+SELECTION_REASONS = {
+    'small': '函数体过小',
+    'cost': '平坦化开销超出阈值',
+}
+
+
+def format_selection_report(skipped):
+    """
+    生成按开销未平坦化的函数报告
+
+    Args:
+        skipped: CodeFlattener.skipped
+
+    Returns:
+        报告文本行列表
+    """
+    lines = []
+    for name, info in skipped.items():
+        lines.append(f"  {name} (第{info['lineno']}行, {SELECTION_KINDS[info['kind']]}): "
+                     f"{info['statements']} 条语句, 循环深度 {info['loop_depth']}, "
+                     f"预计开销 {info['overhead']:.0%} -> {SELECTION_REASONS[info['reason']]}")
+    if not lines:
+        lines.append("  无")
+    return lines
+
+
 def obfuscate_file(input_file, output_file=None):
     """混淆指定的Python文件"""
     with open(input_file, 'r', encoding='utf-8') as f:
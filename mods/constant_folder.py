@@ -0,0 +1,364 @@
+import ast
+import math
+import operator
+
+from .codegen import generate_source
+from .localizer import DYNAMIC_NAMES, module_bindings
+
+
+BINARY_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+    ast.Pow: operator.pow, ast.LShift: operator.lshift, ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_, ast.BitXor: operator.xor, ast.BitAnd: operator.and_,
+}
+UNARY_OPS = {
+    ast.UAdd: operator.pos, ast.USub: operator.neg, ast.Invert: operator.invert, ast.Not: operator.not_,
+}
+COMPARE_OPS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+# 折叠结果的大小上限，避免生成巨大的常量
+MAX_INT_BITS = 128
+MAX_SEQUENCE_LENGTH = 4096
+
+# 拥有独立作用域的节点
+COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef) + COMPREHENSIONS
+
+
+def is_foldable_value(value):
+    """判断值能否作为折叠结果或传播的常量"""
+    if isinstance(value, bool) or value is None:
+        return True
+    if isinstance(value, int):
+        return value.bit_length() <= MAX_INT_BITS
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, (str, bytes)):
+        return len(value) <= MAX_SEQUENCE_LENGTH
+    return False
+
+
+def scope_bindings(stmts):
+    """
+    统计语句在当前作用域中绑定每个名称的次数，不进入嵌套作用域
+
+    推导式中海象运算符的目标绑定在外层作用域，也计入其中。
+
+    Returns:
+        名称 -> 绑定次数
+    """
+    counts = {}
+    stack = [(stmt, False) for stmt in stmts]
+    while stack:
+        node, in_comprehension = stack.pop()
+        name = None
+        if in_comprehension:
+            if isinstance(node, ast.NamedExpr):
+                name = node.target.id
+        elif isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            name = node.id
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            name = node.name
+        elif isinstance(node, ast.alias):
+            name = (node.asname or node.name).split('.')[0]
+        elif isinstance(node, ast.ExceptHandler):
+            name = node.name
+        if name:
+            counts[name] = counts.get(name, 0) + 1
+        if isinstance(node, COMPREHENSIONS):
+            in_comprehension = True
+        elif isinstance(node, SCOPE_NODES):
+            continue
+        stack.extend((child, in_comprehension) for child in ast.iter_child_nodes(node))
+    return counts
+
+
+def changes_scope(stmts):
+    """判断语句是否包含会改变所在函数性质或作用域的yield/await/global/nonlocal"""
+    stack = list(stmts)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.Yield, ast.YieldFrom, ast.Await, ast.Global, ast.Nonlocal)):
+            return True
+        if not isinstance(node, SCOPE_NODES):
+            stack.extend(ast.iter_child_nodes(node))
+    return False
+
+
+class ConstantFolder(ast.NodeTransformer):
+    """
+    常量折叠与常量传播
+
+    1. 折叠操作数都是常量的算术、位运算、比较和逻辑运算
+    2. 将只在顶层赋值过一次的模块级常量传播到其后定义的函数和顶层语句中
+    3. 删除条件为常量的if/while/条件表达式中不会执行的分支
+
+    所有改动都记录在report中，便于审查。
+    """
+
+    def __init__(self, skip_functions=None):
+        """
+        Args:
+            skip_functions: 不做处理的函数定义行号
+        """
+        self.skip_functions = skip_functions or set()
+        self.report = []  # (作用域, 行号, 类型, 原代码, 新代码)
+        self.constants = {}  # 当前可见的模块级常量
+        self.shadowed = []  # 外层作用域中绑定的名称集合栈
+        self.scopes = []  # (函数名, 当前函数作用域的绑定计数) 栈
+        self.depth = 0  # 正在折叠的表达式嵌套深度
+        self.protected = set()  # 不做传播的Name节点(is/is not的操作数)
+
+    def fold(self, tree):
+        """处理整个模块，返回处理后的AST"""
+        self.report = []
+        self.constants = {}
+        dynamic = any(isinstance(node, ast.Name) and node.id in DYNAMIC_NAMES for node in ast.walk(tree))
+        bindings = {} if dynamic else module_bindings(tree)
+
+        body = []
+        for index, stmt in enumerate(tree.body):
+            result = self.visit(stmt)
+            body.extend(result if isinstance(result, list) else [result] if result else [])
+
+            # 顶层只赋值一次的常量在其后的语句中可见
+            if (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1
+                    and isinstance(stmt.targets[0], ast.Name)
+                    and bindings.get(stmt.targets[0].id) == [index]
+                    and isinstance(stmt.value, ast.Constant) and is_foldable_value(stmt.value.value)
+                    and not stmt.targets[0].id.startswith('__')):
+                self.constants[stmt.targets[0].id] = stmt.value.value
+        tree.body = body
+        return tree
+
+    def _record(self, node, kind, before, after):
+        scope = self.scopes[-1][0] if self.scopes else '<module>'
+        self.report.append((scope, getattr(node, 'lineno', 0), kind, before, after))
+
+    def _source(self, node):
+        if isinstance(node, ast.Constant):
+            return repr(node.value)
+        if isinstance(node, ast.expr):
+            node = ast.Expr(value=node)
+        return generate_source(node).strip()
+
+    def generic_visit(self, node):
+        node = super().generic_visit(node)
+        if isinstance(node, ast.stmt) and isinstance(getattr(node, 'body', None), list) and not node.body:
+            node.body = [ast.Pass()]
+        if isinstance(node, ast.ExceptHandler) and not node.body:
+            node.body = [ast.Pass()]
+        return node
+
+    def _visit_function(self, node):
+        if node.lineno in self.skip_functions:
+            return node
+        # 装饰器、默认值和注解在外层作用域中求值
+        node.decorator_list = [self.visit(d) for d in node.decorator_list]
+        node.args.defaults = [self.visit(d) for d in node.args.defaults]
+        node.args.kw_defaults = [self.visit(d) if d else d for d in node.args.kw_defaults]
+
+        bindings = scope_bindings(node.body)
+        for arg in ast.walk(node.args):
+            if isinstance(arg, ast.arg):
+                bindings[arg.arg] = bindings.get(arg.arg, 0) + 1
+        self.shadowed.append(bindings)
+        self.scopes.append((node.name, bindings))
+        node.body = [stmt for item in node.body for stmt in self._as_list(self.visit(item))] or [ast.Pass()]
+        self.scopes.pop()
+        self.shadowed.pop()
+        return node
+
+    visit_FunctionDef = visit_AsyncFunctionDef = _visit_function
+
+    def visit_ClassDef(self, node):
+        node.decorator_list = [self.visit(d) for d in node.decorator_list]
+        node.bases = [self.visit(b) for b in node.bases]
+        # 类体中绑定的名称对方法不可见，这里保守地同时视为遮蔽
+        self.shadowed.append(set(scope_bindings(node.body)))
+        node.body = [stmt for item in node.body
+                     for stmt in self._as_list(self.visit(item))] or [ast.Pass()]
+        self.shadowed.pop()
+        return node
+
+    def visit_Lambda(self, node):
+        node.args.defaults = [self.visit(d) for d in node.args.defaults]
+        self.shadowed.append({arg.arg for arg in ast.walk(node.args) if isinstance(arg, ast.arg)})
+        node.body = self.visit(node.body)
+        self.shadowed.pop()
+        return node
+
+    def _visit_comprehension(self, node):
+        targets = {child.id for gen in node.generators for child in ast.walk(gen.target)
+                   if isinstance(child, ast.Name)}
+        self.shadowed.append(targets)
+        node = super().generic_visit(node)
+        self.shadowed.pop()
+        return node
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _visit_comprehension
+
+    def _as_list(self, result):
+        return result if isinstance(result, list) else [result] if result else []
+
+    def visit_Name(self, node):
+        if (isinstance(node.ctx, ast.Load) and node.id in self.constants
+                and id(node) not in self.protected
+                and not any(node.id in names for names in self.shadowed)):
+            new_node = ast.copy_location(ast.Constant(value=self.constants[node.id]), node)
+            if self.depth == 0:
+                # 表达式内部的传播合并到折叠记录中
+                self._record(node, '传播', node.id, self._source(new_node))
+            return new_node
+        return node
+
+    def _fold(self, node, evaluate):
+        """访问子节点后尝试用evaluate计算常量值"""
+        before = self._source(node) if self.depth == 0 else None
+        self.depth += 1
+        node = super().generic_visit(node)
+        self.depth -= 1
+
+        new_node = node
+        try:
+            value = evaluate(node)
+        except Exception:
+            value = None
+        else:
+            if is_foldable_value(value):
+                new_node = ast.copy_location(ast.Constant(value=value), node)
+
+        if before is not None:
+            after = self._source(new_node)
+            if after != before:
+                self._record(node, '折叠', before, after)
+        return new_node
+
+    def _check_size(self, op, left, right):
+        """在计算前拒绝可能产生巨大结果的运算"""
+        if isinstance(op, ast.Pow) and isinstance(right, int) and abs(right) > MAX_INT_BITS:
+            raise ValueError
+        if isinstance(op, ast.LShift) and isinstance(right, int) and right > MAX_INT_BITS:
+            raise ValueError
+        if isinstance(op, ast.Mult):
+            for sequence, count in ((left, right), (right, left)):
+                if isinstance(sequence, (str, bytes)) and isinstance(count, int) \
+                        and len(sequence) * count > MAX_SEQUENCE_LENGTH:
+                    raise ValueError
+
+    def _evaluate_binop(self, node):
+        if not (isinstance(node.left, ast.Constant) and isinstance(node.right, ast.Constant)):
+            raise ValueError
+        left, right = node.left.value, node.right.value
+        self._check_size(node.op, left, right)
+        return BINARY_OPS[type(node.op)](left, right)
+
+    def _evaluate_unaryop(self, node):
+        if not isinstance(node.operand, ast.Constant):
+            raise ValueError
+        return UNARY_OPS[type(node.op)](node.operand.value)
+
+    def _evaluate_compare(self, node):
+        operands = [node.left] + node.comparators
+        if not all(isinstance(operand, ast.Constant) for operand in operands):
+            raise ValueError
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if not COMPARE_OPS[type(op)](left.value, right.value):
+                return False
+        return True
+
+    def _evaluate_boolop(self, node):
+        if not all(isinstance(value, ast.Constant) for value in node.values):
+            raise ValueError
+        result = node.values[0].value
+        for value in node.values[1:]:
+            if isinstance(node.op, ast.And) and not result:
+                break
+            if isinstance(node.op, ast.Or) and result:
+                break
+            result = value.value
+        return result
+
+    def visit_BinOp(self, node):
+        return self._fold(node, self._evaluate_binop)
+
+    def visit_UnaryOp(self, node):
+        return self._fold(node, self._evaluate_unaryop)
+
+    def visit_Compare(self, node):
+        if any(isinstance(op, (ast.Is, ast.IsNot)) for op in node.ops):
+            # 对数字和字符串字面量使用is会产生SyntaxWarning，且结果依赖对象缓存
+            for operand in [node.left] + node.comparators:
+                if isinstance(operand, ast.Name) and not isinstance(
+                        self.constants.get(operand.id), (bool, type(None))):
+                    self.protected.add(id(operand))
+        return self._fold(node, self._evaluate_compare)
+
+    def visit_BoolOp(self, node):
+        return self._fold(node, self._evaluate_boolop)
+
+    def _can_remove(self, stmts):
+        """判断删除不会执行的语句是否会改变函数的作用域或性质"""
+        if not self.scopes:
+            return True
+        if changes_scope(stmts):
+            return False
+        counts = self.scopes[-1][1]
+        # 被删除的语句是某个名称在函数中的唯一绑定时，删除会把局部变量变成全局变量
+        return all(counts.get(name, 0) > count for name, count in scope_bindings(stmts).items())
+
+    def visit_If(self, node):
+        node.test = self.visit(node.test)
+        if isinstance(node.test, ast.Constant):
+            kept, removed = (node.body, node.orelse) if node.test.value else (node.orelse, node.body)
+            if self._can_remove(removed):
+                self._record(node, '删除分支', f"if {self._source(node.test)}",
+                             '保留if分支' if node.test.value else '保留else分支')
+                return [stmt for item in kept for stmt in self._as_list(self.visit(item))]
+        return self.generic_visit(node)
+
+    def visit_While(self, node):
+        node.test = self.visit(node.test)
+        if isinstance(node.test, ast.Constant) and not node.test.value and self._can_remove(node.body):
+            self._record(node, '删除分支', f"while {self._source(node.test)}", '删除循环')
+            return [stmt for item in node.orelse for stmt in self._as_list(self.visit(item))]
+        return self.generic_visit(node)
+
+    def visit_IfExp(self, node):
+        node.test = self.visit(node.test)
+        if isinstance(node.test, ast.Constant) and not any(
+                isinstance(child, ast.NamedExpr) for child in ast.walk(node)):
+            kept = node.body if node.test.value else node.orelse
+            self._record(node, '删除分支', self._source(node), self._source(kept))
+            return self.visit(kept)
+        return self.generic_visit(node)
+
+
+def fold_constants(tree, skip_functions=None):
+    """
+    对AST进行常量折叠和常量传播
+
+    Returns:
+        (处理后的AST, 改动记录列表)
+    """
+    folder = ConstantFolder(skip_functions=skip_functions)
+    tree = folder.fold(tree)
+    ast.fix_missing_locations(tree)
+    return tree, folder.report
+
+
+def format_folding_report(report):
+    """
+    生成常量折叠报告
+
+    Returns:
+        报告文本行列表
+    """
+    if not report:
+        return ["  无"]
+    return [f"  {scope} 第{lineno}行 [{kind}] {before} -> {after}"
+            for scope, lineno, kind, before, after in report]
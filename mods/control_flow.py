@@ -0,0 +1,425 @@
+import ast
+import math
+
+
+# 循环体的假定执行次数，用于估算循环内语句的相对权重
+LOOP_ITERATIONS = 10
+
+# 生成器每次yield、协程每次await挂起和恢复帧的假定工作量(与estimate_work同单位)
+SUSPEND_WORK = 20
+
+# 会改变控制流的复合语句，不展开时单独占用一个基本块
+BRANCHING_STMTS = (ast.If, ast.For, ast.While, ast.Try, ast.With, ast.AsyncFor, ast.AsyncWith)
+if hasattr(ast, 'Match'):
+    BRANCHING_STMTS += (ast.Match,)
+if hasattr(ast, 'TryStar'):
+    BRANCHING_STMTS += (ast.TryStar,)
+
+
+class BasicBlock:
+    """控制流图中的基本块"""
+
+    def __init__(self):
+        self.stmts = []
+        self.kind = None        # 'jump', 'branch', 'iterate', 'exit'
+        self.targets = []       # 后继基本块，None表示函数结束
+        self.test = None        # branch: 分支条件
+        self.loop_target = None  # iterate: 循环变量
+        self.iterator = None    # iterate: 保存迭代器的变量名
+        self.source_count = 0   # 块内原始语句数
+        self.state = None
+
+    @property
+    def closed(self):
+        """基本块是否已经设置了出口"""
+        return self.kind is not None
+
+    def jump(self, target):
+        """无条件跳转到target"""
+        self.kind = 'jump'
+        self.targets = [target]
+
+    def branch(self, test, if_true, if_false):
+        """按test跳转到if_true或if_false"""
+        self.kind = 'branch'
+        self.test = test
+        self.targets = [if_true, if_false]
+
+    def iterate(self, loop_target, iterator, body, done):
+        """从迭代器取下一个元素赋给loop_target并进入body，耗尽时跳转到done"""
+        self.kind = 'iterate'
+        self.loop_target = loop_target
+        self.iterator = iterator
+        self.targets = [body, done]
+
+    def exit(self):
+        """以return/raise结束的基本块"""
+        self.kind = 'exit'
+        self.targets = [None]
+
+
+def binds_name(tree, name):
+    """判断模块中是否有任何位置绑定了给定的名称"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == name and not isinstance(node.ctx, ast.Load):
+            return True
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name == name:
+            return True
+        if isinstance(node, ast.arg) and node.arg == name:
+            return True
+        if isinstance(node, ast.alias) and (node.asname or node.name) == name:
+            return True
+    return False
+
+
+def contains_loop_escape(stmts):
+    """判断语句中是否存在跳出到外层循环的break/continue"""
+    for stmt in stmts:
+        for node in _walk_same_loop(stmt):
+            if isinstance(node, (ast.Break, ast.Continue)):
+                return True
+    return False
+
+
+def _walk_same_loop(node):
+    """遍历节点，不进入内层循环体和嵌套作用域"""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        if isinstance(current, (ast.For, ast.While, ast.AsyncFor)):
+            # 内层循环的else子句中的break/continue属于外层循环
+            stack.extend(current.orelse)
+            continue
+        if isinstance(current, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        stack.extend(ast.iter_child_nodes(current))
+
+
+def loop_escapes_are_flattenable(loop):
+    """
+    判断循环内的break/continue能否全部改写为状态跳转
+
+    只有直接位于循环体或位于(会被强制展开的)if分支中的break/continue可以改写，
+    出现在try/with等保持原结构的语句中时，整个循环必须保持原结构。
+    """
+    pending = list(loop.body)
+    while pending:
+        stmt = pending.pop()
+        if isinstance(stmt, (ast.Break, ast.Continue)):
+            continue
+        if isinstance(stmt, ast.If):
+            pending.extend(stmt.body)
+            pending.extend(stmt.orelse)
+            continue
+        if isinstance(stmt, (ast.For, ast.While)):
+            if contains_loop_escape(stmt.orelse):
+                return False
+            continue
+        if contains_loop_escape([stmt]):
+            return False
+    return True
+
+
+def estimate_work(node):
+    """
+    估算执行一次节点的工作量
+
+    以AST节点数近似字节码指令数，循环体和推导式按LOOP_ITERATIONS次计算，
+    嵌套函数、类和lambda只计算定义本身。
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+        return 1
+    if isinstance(node, (ast.For, ast.AsyncFor)):
+        return (1 + estimate_work(node.target) + estimate_work(node.iter)
+                + LOOP_ITERATIONS * sum(estimate_work(stmt) for stmt in node.body)
+                + sum(estimate_work(stmt) for stmt in node.orelse))
+    if isinstance(node, ast.While):
+        return (1 + LOOP_ITERATIONS * (estimate_work(node.test)
+                                       + sum(estimate_work(stmt) for stmt in node.body))
+                + sum(estimate_work(stmt) for stmt in node.orelse))
+    if isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+        return 1 + LOOP_ITERATIONS * sum(estimate_work(child) for child in ast.iter_child_nodes(node))
+    return 1 + sum(estimate_work(child) for child in ast.iter_child_nodes(node))
+
+
+def _walk_scope(stmts):
+    """遍历语句中属于当前函数作用域的节点，不进入嵌套的函数、类和lambda"""
+    stack = list(stmts)
+    while stack:
+        node = stack.pop()
+        yield node
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            stack.extend(ast.iter_child_nodes(node))
+
+
+def function_kind(node):
+    """函数类型: 'coroutine'(async def)、'generator'(含yield) 或 'function'"""
+    if isinstance(node, ast.AsyncFunctionDef):
+        return 'coroutine'
+    if any(isinstance(child, (ast.Yield, ast.YieldFrom)) for child in _walk_scope(node.body)):
+        return 'generator'
+    return 'function'
+
+
+def function_qualnames(tree):
+    """
+    按代码对象的co_qualname规则遍历模块中的所有函数
+
+    Yields:
+        (限定名, 函数定义节点)
+    """
+    def walk(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = prefix + child.name
+                yield qualname, child
+                yield from walk(child, qualname + '.<locals>.')
+            elif isinstance(child, ast.ClassDef):
+                yield from walk(child, prefix + child.name + '.')
+            else:
+                yield from walk(child, prefix)
+
+    yield from walk(tree, '')
+
+
+def suspension_work(node):
+    """
+    估算执行一次节点时挂起和恢复帧的工作量
+
+    每个yield/yield from/await计SUSPEND_WORK，循环中的按LOOP_ITERATIONS次计算。
+    """
+    if isinstance(node, list):
+        return sum(suspension_work(stmt) for stmt in node)
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+        return 0
+    own = SUSPEND_WORK if isinstance(node, (ast.Yield, ast.YieldFrom, ast.Await)) else 0
+    if isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+        header = suspension_work(node.iter) if isinstance(node, (ast.For, ast.AsyncFor)) else 0
+        if isinstance(node, ast.AsyncFor):
+            # 每次取元素都会await __anext__
+            header += SUSPEND_WORK * LOOP_ITERATIONS
+        looped = suspension_work(node.body) + (suspension_work(node.test) if isinstance(node, ast.While) else 0)
+        return own + header + LOOP_ITERATIONS * looped + suspension_work(node.orelse)
+    return own + sum(suspension_work(child) for child in ast.iter_child_nodes(node))
+
+
+def max_loop_depth(stmts):
+    """函数自身作用域中循环的最大嵌套深度"""
+    depth = 0
+    for stmt in stmts:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        inner = max_loop_depth(list(ast.iter_child_nodes(stmt)))
+        if isinstance(stmt, (ast.For, ast.AsyncFor, ast.While)):
+            inner += 1
+        depth = max(depth, inner)
+    return depth
+
+
+def function_flatten_overhead(node):
+    """
+    静态估算平坦化函数顶层语句给每次调用带来的开销比例
+
+    每条顶层语句对应一次状态赋值和一次状态比较。函数体的工作量中循环按嵌套深度加权，
+    生成器和协程另计每次挂起和恢复帧的工作量: 恢复执行时直接回到分发循环内的挂起点，
+    不需要重新分发，因此挂起越频繁，分发开销所占的比例越低。
+    """
+    # global/nonlocal声明保留在分发循环之前，不产生状态
+    body = [stmt for stmt in node.body if not isinstance(stmt, (ast.Global, ast.Nonlocal))]
+    work = sum(estimate_work(stmt) for stmt in body) + suspension_work(body)
+    per_statement = DispatchCostModel.STORE_COST + DispatchCostModel.COMPARE_COST
+    return len(body) * per_statement / max(1, work)
+
+
+class DispatchCostModel:
+    """估算平坦化为每个基本块引入的分发开销"""
+
+    COMPARE_COST = 3   # 一次状态比较: 加载状态变量、加载常量、比较跳转
+    STORE_COST = 2     # 一次状态赋值
+    LOOP_COST = 3      # 分发循环的一次条件判断
+    ITERATE_COST = 6   # 展开for循环时每次取元素的额外开销
+
+    def __init__(self, body, num_states, dispatch_mode):
+        """
+        Args:
+            body: 原始函数体
+            num_states: 预计的状态数
+            dispatch_mode: 预计的分发方式 ('linear' 或 'binary')
+        """
+        self.function_work = max(1, sum(estimate_work(stmt) for stmt in body))
+        self.num_states = max(1, num_states)
+        self.dispatch_mode = dispatch_mode
+
+    def transition_cost(self):
+        """一次状态转移的开销"""
+        if self.dispatch_mode == 'binary':
+            compares = math.ceil(math.log2(self.num_states)) if self.num_states > 1 else 0
+            return self.STORE_COST + self.LOOP_COST + compares * self.COMPARE_COST
+        # 线性if链平均需要比较一半的状态
+        return self.STORE_COST + (self.num_states / 2) * self.COMPARE_COST
+
+    def added_work(self, stmt, loop_depth):
+        """
+        展开一条复合语句后每次函数调用增加的工作量
+
+        Args:
+            stmt: 复合语句
+            loop_depth: 语句外层被展开的循环层数
+        """
+        frequency = LOOP_ITERATIONS ** loop_depth
+        transition = self.transition_cost()
+        if isinstance(stmt, ast.If):
+            # 进入分支和回到汇合点各一次转移
+            return 2 * transition * frequency
+        if isinstance(stmt, ast.While):
+            return (transition + 2 * transition * LOOP_ITERATIONS) * frequency
+        if isinstance(stmt, ast.For):
+            return (transition + (2 * transition + self.ITERATE_COST) * LOOP_ITERATIONS) * frequency
+        return 0
+
+    def overhead(self, stmt, loop_depth):
+        """展开语句带来的开销占函数原始工作量的比例"""
+        return self.added_work(stmt, loop_depth) / self.function_work
+
+
+class ControlFlowBuilder:
+    """
+    将函数体降低为基本块组成的控制流图
+
+    if/while/for是否展开由should_flatten回调决定，不展开的复合语句作为
+    一个整体放入基本块。
+    """
+
+    def __init__(self, should_flatten, new_temp, granularity='statement', block_size=None):
+        """
+        Args:
+            should_flatten: 回调 (语句, 外层展开的循环层数) -> 是否展开该复合语句
+            new_temp: 回调，返回一个新的临时变量名
+            granularity: 'statement'每条语句一个基本块，'block'合并连续语句
+            block_size: block粒度下基本块的最大语句数
+        """
+        self.should_flatten = should_flatten
+        self.new_temp = new_temp
+        self.granularity = granularity
+        self.block_size = block_size
+        self.blocks = []
+
+    def emit(self, block):
+        """按生成顺序登记基本块，状态值按此顺序分配"""
+        self.blocks.append(block)
+        return block
+
+    def build(self, body):
+        """
+        构建函数体的控制流图
+
+        Returns:
+            (入口基本块, 基本块列表)
+        """
+        self.blocks = []
+        entry = self.lower(body, None, ())
+        entry = self._thread_jumps(entry)
+        for state, block in enumerate(self.blocks):
+            block.state = state
+        return entry, self.blocks
+
+    def lower(self, stmts, follow, loops):
+        """
+        降低一个语句序列
+
+        Args:
+            stmts: 语句列表
+            follow: 语句序列执行完后的后继基本块，None表示函数结束
+            loops: 外层已展开循环的 (break目标, continue目标) 栈
+
+        Returns:
+            入口基本块
+        """
+        entry = self.emit(BasicBlock())
+        current = entry
+        sealed = False  # 当前块已放入不展开的复合语句，后续语句需要新块
+
+        for stmt in stmts:
+            if current.closed:
+                # return/raise/break/continue之后的语句不可达，仍保留在单独的块中
+                current = self.emit(BasicBlock())
+                sealed = False
+
+            if isinstance(stmt, (ast.Break, ast.Continue)) and loops:
+                break_target, continue_target = loops[-1]
+                current.jump(break_target if isinstance(stmt, ast.Break) else continue_target)
+                continue
+
+            if isinstance(stmt, (ast.If, ast.While, ast.For)) and self.should_flatten(stmt, len(loops)):
+                current = self._lower_compound(stmt, current, loops)
+                sealed = False
+                continue
+
+            is_compound = isinstance(stmt, BRANCHING_STMTS)
+            if current.stmts and (sealed or is_compound or self._is_full(current)):
+                following = self.emit(BasicBlock())
+                current.jump(following)
+                current = following
+
+            current.stmts.append(stmt)
+            current.source_count += 1
+            sealed = is_compound
+            if isinstance(stmt, (ast.Return, ast.Raise)):
+                current.exit()
+
+        if not current.closed:
+            current.jump(follow)
+        return entry
+
+    def _is_full(self, block):
+        """基本块是否已达到最大语句数"""
+        if self.granularity == 'statement':
+            return True
+        return self.block_size is not None and block.source_count >= self.block_size
+
+    def _lower_compound(self, stmt, current, loops):
+        """展开if/while/for，返回其后继语句所在的基本块"""
+        after = BasicBlock()
+
+        if isinstance(stmt, ast.If):
+            then_entry = self.lower(stmt.body, after, loops)
+            else_entry = self.lower(stmt.orelse, after, loops) if stmt.orelse else after
+            current.branch(stmt.test, then_entry, else_entry)
+            return self.emit(after)
+
+        if isinstance(stmt, ast.For):
+            iterator = self.new_temp()
+            current.stmts.append(ast.Assign(
+                targets=[ast.Name(id=iterator, ctx=ast.Store())],
+                value=ast.Call(func=ast.Name(id='iter', ctx=ast.Load()), args=[stmt.iter], keywords=[])
+            ))
+
+        header = self.emit(BasicBlock())
+        current.jump(header)
+        body_entry = self.lower(stmt.body, header, loops + ((after, header),))
+        else_entry = self.lower(stmt.orelse, after, loops) if stmt.orelse else after
+
+        if isinstance(stmt, ast.For):
+            header.iterate(stmt.target, iterator, body_entry, else_entry)
+        else:
+            header.branch(stmt.test, body_entry, else_entry)
+        return self.emit(after)
+
+    def _thread_jumps(self, entry):
+        """去掉只包含无条件跳转的空基本块，让前驱直接跳到其目标"""
+        def resolve(block):
+            seen = set()
+            while (block is not None and not block.stmts and block.kind == 'jump'
+                   and id(block) not in seen):
+                seen.add(id(block))
+                block = block.targets[0]
+            return block
+
+        for block in self.blocks:
+            block.targets = [resolve(target) for target in block.targets]
+        entry = resolve(entry)
+
+        self.blocks = [block for block in self.blocks
+                       if block is entry or block.stmts or block.kind != 'jump']
+        return entry
@@ -0,0 +1,307 @@
+import ast
+import dis
+import os
+import types
+import unicodedata
+
+from .complete_obfuscator import CompletePythonObfuscator
+from .control_flow import LOOP_ITERATIONS, DispatchCostModel, estimate_work, function_qualnames
+from .flatten_optimizer import find_dispatchers, is_state_test
+
+
+def code_qualnames(code):
+    """收集模块代码对象中的所有函数代码对象: 限定名 -> 代码对象"""
+    codes = {}
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            qualname = getattr(const, 'co_qualname', const.co_name)
+            codes.setdefault(qualname, const)
+            codes.update((name, inner) for name, inner in code_qualnames(const).items() if name not in codes)
+    return codes
+
+
+def _own_nodes(stmts):
+    """遍历语句中属于当前函数作用域的节点"""
+    stack = list(stmts)
+    while stack:
+        node = stack.pop()
+        yield node
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            stack.extend(ast.iter_child_nodes(node))
+
+
+class _NegativeConstants(ast.NodeTransformer):
+    """把源代码中的 `-1` (一元负号和常量) 还原为平坦化器生成的负数常量"""
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if (isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant)
+                and type(node.operand.value) is int):
+            return ast.copy_location(ast.Constant(value=-node.operand.value), node)
+        return node
+
+
+def _dispatch_cases(loop, state_var):
+    """
+    拆分分发循环中的状态分支
+
+    Returns:
+        (是否为线性if链, [(状态值下界, 状态值上界, 分支体, 比较次数)])
+        线性if链中上下界相同，为该分支的状态值
+    """
+    if loop.body and all(isinstance(stmt, ast.If) and is_state_test(stmt.test, state_var, ast.Eq)
+                         for stmt in loop.body):
+        cases = []
+        for stmt in loop.body:
+            state = stmt.test.comparators[0].value
+            cases.append((state, state, stmt.body, len(loop.body)))
+        return True, cases
+
+    def split(stmts, low, high, depth):
+        if len(stmts) == 1 and isinstance(stmts[0], ast.If) and is_state_test(stmts[0].test, state_var, ast.Lt):
+            middle = stmts[0].test.comparators[0].value
+            return split(stmts[0].body, low, middle, depth + 1) + split(stmts[0].orelse, middle, high, depth + 1)
+        return [(low, high, stmts, depth)]
+
+    return False, split(loop.body, None, None, 0)
+
+
+def _state_stores(stmts, state_var):
+    """分支体中赋给状态变量的常量"""
+    return {node.value.value for node in _own_nodes(stmts)
+            if isinstance(node, ast.Assign) and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name) and node.targets[0].id == state_var
+            and isinstance(node.value, ast.Constant)}
+
+
+def analyze_dispatch(entry, loop, state_var):
+    """
+    静态估算一个分发循环每次函数调用的开销
+
+    由状态赋值构造状态转移图，位于环上的状态按LOOP_ITERATIONS次执行。线性if链
+    顺序前进时一次循环可依次落入多个状态，只有回跳才需要新的一轮比较；二分比较树
+    每次状态转移都是一轮完整的比较。
+
+    Returns:
+        {'states', 'compares', 'iterations', 'transitions', 'work'}
+    """
+    linear, cases = _dispatch_cases(loop, state_var)
+    known = {entry} | {value for _, _, body, _ in cases for value in _state_stores(body, state_var)}
+    known.discard(-1)
+
+    successors = {}
+    depths = []
+    for low, high, body, depth in cases:
+        if linear:
+            state = low
+        else:
+            # 二分比较树的叶子按区间对应到唯一的已知状态
+            matches = [s for s in known if isinstance(s, int)
+                       and (low is None or s >= low) and (high is None or s < high)]
+            if len(matches) != 1:
+                continue
+            state = matches[0]
+        successors[state] = _state_stores(body, state_var) - {-1}
+        depths.append(depth)
+
+    def reachable(start):
+        seen = set()
+        pending = list(successors.get(start, ()))
+        while pending:
+            state = pending.pop()
+            if state in seen:
+                continue
+            seen.add(state)
+            pending.extend(successors.get(state, ()))
+        return seen
+
+    in_cycle = {state for state in successors if state in reachable(state)}
+    transitions = sum(LOOP_ITERATIONS if state in in_cycle else 1 for state in successors)
+
+    if linear:
+        back_edges = sum(1 for state, targets in successors.items() for target in targets if target <= state)
+        iterations = 1 + LOOP_ITERATIONS * back_edges
+        compares = len(cases) + 1
+    else:
+        iterations = transitions
+        compares = (sum(depths) / len(depths) if depths else 0) + 1
+
+    work = (iterations * (compares * DispatchCostModel.COMPARE_COST + DispatchCostModel.LOOP_COST)
+            + transitions * DispatchCostModel.STORE_COST)
+    return {
+        'states': len(cases),
+        'compares': compares,
+        'iterations': iterations,
+        'transitions': transitions,
+        'work': work,
+    }
+
+
+def _instruction_count(code):
+    return sum(1 for instruction in dis.get_instructions(code) if instruction.opname != 'CACHE')
+
+
+class OverheadEstimator:
+    """
+    不运行代码，静态估算混淆给每个函数带来的运行时开销
+
+    对同一文件分别解析原始代码和混淆后的代码，按限定名对应函数，统计:
+    1. 编译后每个函数代码对象的额外字节码指令数
+    2. 分发循环每轮的状态比较次数和每次调用的预计分发轮数
+    3. 新增的局部变量(状态变量、迭代器临时变量、本地化别名等)
+    4. 分发开销占函数原始工作量(estimate_work)的比例，作为排名依据
+    """
+
+    def __init__(self, options=None):
+        """
+        Args:
+            options: 传给CompletePythonObfuscator的混淆选项
+        """
+        self.options = dict(options or {})
+        self.options['compile_to_pyc'] = False
+
+    def estimate_source(self, source_code, filename='<string>'):
+        """
+        估算单个源文件中每个函数的开销
+
+        Returns:
+            每个函数一行的估算结果列表
+        """
+        original_tree = ast.parse(source_code)
+        original_code = compile(original_tree, filename, 'exec')
+
+        confuser = CompletePythonObfuscator(**self.options)
+        obfuscated = confuser.obfuscate(source_code, filename)
+        if obfuscated.startswith("混淆失败"):
+            raise ValueError(obfuscated)
+        obfuscated_tree = ast.parse(obfuscated)
+        state_vars = confuser.original_confuser.flattener.state_vars if confuser.original_confuser else set()
+        obfuscated_code = compile(obfuscated_tree, filename, 'exec')
+        obfuscated_tree = _NegativeConstants().visit(obfuscated_tree)
+
+        rename = {new: old for old, new in confuser.get_var_mapping().items()}
+        rename.update({new: old for old, new in confuser.get_name_mapping().items()})
+
+        def original_name(qualname):
+            return '.'.join(rename.get(part, part) for part in qualname.split('.'))
+
+        original_functions = dict(function_qualnames(original_tree))
+        original_codes = code_qualnames(original_code)
+        obfuscated_functions = {original_name(q): node for q, node in function_qualnames(obfuscated_tree)}
+        obfuscated_codes = {original_name(q): code for q, code in code_qualnames(obfuscated_code).items()}
+
+        rows = []
+        for qualname, node in original_functions.items():
+            new_node = obfuscated_functions.get(qualname)
+            before, after = original_codes.get(qualname), obfuscated_codes.get(qualname)
+            if new_node is None or before is None or after is None:
+                continue
+
+            dispatch = {'states': 0, 'compares': 0, 'iterations': 0, 'work': 0}
+            for state_var, loop in find_dispatchers(new_node.body, state_vars):
+                entry = new_node.body[new_node.body.index(loop) - 1].value.value
+                info = analyze_dispatch(entry, loop, state_var)
+                dispatch['states'] += info['states']
+                dispatch['compares'] = max(dispatch['compares'], info['compares'])
+                dispatch['iterations'] += info['iterations']
+                dispatch['work'] += info['work']
+
+            work = max(1, sum(estimate_work(stmt) for stmt in node.body))
+            rows.append({
+                'file': filename,
+                'name': qualname,
+                'lineno': node.lineno,
+                'instructions': _instruction_count(after) - _instruction_count(before),
+                'states': dispatch['states'],
+                'compares': dispatch['compares'],
+                'iterations': dispatch['iterations'],
+                'locals': after.co_nlocals - before.co_nlocals,
+                'overhead': dispatch['work'] / work,
+            })
+        return rows
+
+    def estimate_path(self, path):
+        """
+        估算单个文件或目录下所有Python文件
+
+        Returns:
+            (估算结果列表, [(文件, 错误信息)])
+        """
+        if os.path.isdir(path):
+            files = []
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith('.py'))
+        else:
+            files = [path]
+
+        rows, errors = [], []
+        for filename in files:
+            try:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    source_code = f.read()
+                file_rows = self.estimate_source(source_code, filename)
+            except (SyntaxError, ValueError, UnicodeDecodeError) as e:
+                errors.append((filename, str(e)))
+                continue
+            if os.path.isdir(path):
+                for row in file_rows:
+                    row['file'] = os.path.relpath(filename, path)
+            rows.extend(file_rows)
+        return rows, errors
+
+
+def _display_width(text):
+    """文本在终端中占用的列数，全角字符(如中文)占两列"""
+    return sum(2 if unicodedata.east_asian_width(char) in 'WF' else 1 for char in text)
+
+
+def _pad(text, width, align):
+    """按显示宽度把文本补齐到width列，align为'<'左对齐或'>'右对齐"""
+    padding = ' ' * max(0, width - _display_width(text))
+    return text + padding if align == '<' else padding + text
+
+
+# (表头, 对齐方式)，表头和数据行使用同一份列定义
+ESTIMATE_COLUMNS = (
+    ('排名', '>'), ('函数', '<'), ('额外指令', '>'), ('状态数', '>'),
+    ('每轮比较', '>'), ('分发轮数', '>'), ('新增局部变量', '>'), ('预计开销', '>'),
+)
+
+
+def _estimate_cells(rank, name, row):
+    """一个函数在开销表中的各列文本，顺序与ESTIMATE_COLUMNS一致"""
+    return [str(rank), name, f"{row['instructions']:+d}", str(row['states']), f"{row['compares']:.1f}",
+            str(row['iterations']), f"{row['locals']:+d}", f"{row['overhead']:.1%}"]
+
+
+def format_estimate_table(rows, top=None, show_file=False):
+    """
+    生成按预计开销排序的函数开销表
+
+    Args:
+        rows: OverheadEstimator的估算结果
+        top: 只显示开销最高的前top个函数，None表示全部
+        show_file: 函数名前是否带文件名
+
+    Returns:
+        表格文本行列表
+    """
+    ranked = sorted(rows, key=lambda row: (row['overhead'], row['instructions']), reverse=True)
+    if top:
+        ranked = ranked[:top]
+
+    names = [f"{row['file']}:{row['name']}" if show_file else row['name'] for row in ranked]
+    cells = [_estimate_cells(rank, name, row) for rank, (name, row) in enumerate(zip(names, ranked), 1)]
+    widths = [max([_display_width(title)] + [_display_width(line[i]) for line in cells])
+              for i, (title, _) in enumerate(ESTIMATE_COLUMNS)]
+
+    def format_line(values):
+        return '  '.join(_pad(value, width, align)
+                         for value, width, (_, align) in zip(values, widths, ESTIMATE_COLUMNS)).rstrip()
+
+    lines = [format_line([title for title, _ in ESTIMATE_COLUMNS])]
+    lines.extend(format_line(line) for line in cells)
+    total = sum(row['instructions'] for row in rows)
+    lines.append(f"共 {len(rows)} 个函数, 额外指令合计 {total:+d}")
+    return lines
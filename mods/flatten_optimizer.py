@@ -0,0 +1,164 @@
+import ast
+
+from .codegen import generate_source
+
+
+def find_dispatchers(body, state_vars):
+    """
+    查找 `state = N` 紧跟 `while state != -1` 的分发循环，返回 (状态变量名, 循环)
+
+    只识别平坦化器生成的状态变量，用户代码中形式相同的循环不会被改写。
+    """
+    for first, second in zip(body, body[1:]):
+        if (isinstance(first, ast.Assign) and len(first.targets) == 1
+                and isinstance(first.targets[0], ast.Name) and first.targets[0].id in state_vars
+                and isinstance(second, ast.While)
+                and is_state_test(second.test, first.targets[0].id, ast.NotEq, -1)):
+            yield first.targets[0].id, second
+
+
+def is_state_test(test, state_var, op_type, value=None):
+    """判断表达式是否为 `state <op> 常量`"""
+    return (isinstance(test, ast.Compare)
+            and isinstance(test.left, ast.Name) and test.left.id == state_var
+            and len(test.ops) == 1 and isinstance(test.ops[0], op_type)
+            and isinstance(test.comparators[0], ast.Constant)
+            and (value is None or test.comparators[0].value == value))
+
+
+class FlattenPeepholeOptimizer:
+    """
+    平坦化结果的窥孔优化
+
+    只改写平坦化器生成的状态变量赋值，分发结构保持不变:
+    1. 删除return/raise/break/continue之后不可达的状态赋值
+    2. 删除在被读取之前就被覆盖的状态赋值
+    3. 跳转到结束状态(-1)时直接break，不再测试后续状态
+    4. 线性if链中跳回之前的状态时立即continue，不再测试后续状态
+    """
+
+    def __init__(self, state_vars):
+        """
+        Args:
+            state_vars: 平坦化器生成的状态变量名(CodeFlattener.state_vars)
+        """
+        self.state_vars = state_vars
+        self.report = {}  # 函数名 -> 优化统计
+
+    def optimize(self, tree):
+        """优化模块中所有平坦化后的函数"""
+        self.report = {}
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self._optimize_function(node)
+        return tree
+
+    def _is_state_store(self, stmt, state_var):
+        return (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1
+                and isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id == state_var
+                and isinstance(stmt.value, ast.Constant))
+
+    def _optimize_function(self, node):
+        dispatchers = list(find_dispatchers(node.body, self.state_vars))
+        if not dispatchers:
+            return
+
+        before_bytes = len(generate_source(node).encode('utf-8'))
+        self._removed = 0
+        self._breaks = 0
+        self._continues = 0
+
+        for state_var, loop in dispatchers:
+            linear = all(isinstance(stmt, ast.If) and is_state_test(stmt.test, state_var, ast.Eq)
+                         for stmt in loop.body)
+            if linear:
+                for case in loop.body:
+                    case.body = self._rewrite(case.body, state_var, case.test.comparators[0].value)
+            else:
+                loop.body = self._rewrite(loop.body, state_var, None)
+
+        self.report[node.name] = {
+            'statements_removed': self._removed,
+            'breaks': self._breaks,
+            'continues': self._continues,
+            # 插入的continue可能使源代码变长，此时为负数
+            'bytes_removed': before_bytes - len(generate_source(node).encode('utf-8')),
+        }
+
+    def _rewrite(self, stmts, state_var, current_state):
+        """
+        改写一个分支体中的状态赋值
+
+        只处理位于分发循环这一层的语句(if分支和循环的else子句)，
+        不进入循环体，保证生成的break/continue作用于分发循环。
+        """
+        result = []
+        for stmt in stmts:
+            if self._is_state_store(stmt, state_var):
+                if result and isinstance(result[-1], (ast.Return, ast.Raise, ast.Break, ast.Continue)):
+                    # 不可达的状态赋值
+                    self._removed += 1
+                    continue
+                if result and self._is_state_store(result[-1], state_var):
+                    # 上一个状态赋值尚未被读取就被覆盖
+                    result.pop()
+                    self._removed += 1
+
+                target = stmt.value.value
+                if target == -1:
+                    # 结束状态不会再被读取，直接退出分发循环
+                    result.append(ast.Break())
+                    self._breaks += 1
+                    continue
+
+                result.append(stmt)
+                if current_state is not None and target <= current_state:
+                    # 跳回之前的状态，后续的状态测试必然不成立
+                    result.append(ast.Continue())
+                    self._continues += 1
+                continue
+
+            if isinstance(stmt, ast.If):
+                stmt.body = self._rewrite(stmt.body, state_var, current_state)
+                stmt.orelse = self._rewrite(stmt.orelse, state_var, current_state)
+            elif isinstance(stmt, (ast.For, ast.While)):
+                stmt.orelse = self._rewrite(stmt.orelse, state_var, current_state)
+            result.append(stmt)
+        return result
+
+
+def optimize_flattened(tree, state_vars):
+    """
+    对平坦化后的AST进行窥孔优化
+
+    Args:
+        tree: 平坦化后的模块AST
+        state_vars: 平坦化器生成的状态变量名
+    """
+    optimizer = FlattenPeepholeOptimizer(state_vars)
+    tree = optimizer.optimize(tree)
+    ast.fix_missing_locations(tree)
+    return tree, optimizer.report
+
+
+def format_peephole_report(report):
+    """
+    生成窥孔优化报告
+
+    Returns:
+        报告文本行列表
+    """
+    lines = []
+    for name, info in report.items():
+        lines.append(f"  {name}: 删除 {info['statements_removed']} 条状态赋值, "
+                     f"{info['breaks']} 条结束状态赋值改为break, 插入 {info['continues']} 处continue, "
+                     f"源代码{_format_bytes(info['bytes_removed'])}")
+    total_statements = sum(info['statements_removed'] for info in report.values())
+    total_bytes = sum(info['bytes_removed'] for info in report.values())
+    lines.append(f"共删除 {total_statements} 条状态赋值, 源代码{_format_bytes(total_bytes)}")
+    return lines
+
+
+def _format_bytes(removed):
+    """源代码大小的变化，removed为负数时表示增加"""
+    return f"减少 {removed} 字节" if removed >= 0 else f"增加 {-removed} 字节"
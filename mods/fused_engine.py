@@ -0,0 +1,280 @@
+import ast
+
+from .name_obfuscator import FunctionNameObfuscator, VariableNameObfuscator, renamable_function, renamable_functions
+from .scope_index import ScopeIndex, scoped_children
+
+
+ENGINES = ('fused', 'passes')
+
+
+class SymbolCollector(ast.NodeVisitor):
+    """
+    一次遍历收集函数名混淆、变量名混淆和平坦化所需的全部信息
+
+    函数名混淆在遍历之前就确定了要改名的全部函数，变量名混淆按前序遍历做决策，
+    决策只依赖于之前访问过的节点，因此可以在同一次遍历中依次模拟两者: 先按函数名
+    混淆的规则得到节点在第一遍之后的名称，再在ScopeIndex给出的当前作用域集合中查找
+    这个名称。新名称在遍历中只记录
+    为槽位，遍历结束后按原流程的顺序统一生成，使随机名称与逐遍处理完全一致。
+
+    被重命名的函数名在生成之前用 ('function', 槽位) 表示，与源代码中的任何名称都不相等。
+    """
+
+    def __init__(self, rename_functions=True, rename_variables=True, skip_functions=None, function_levels=None,
+                 index=None, function_mapping=None):
+        """
+        Args:
+            rename_functions: 是否模拟函数名混淆
+            rename_variables: 是否模拟变量名混淆
+            skip_functions: 不做变量名混淆的函数定义行号
+            function_levels: 函数定义行号 -> 混淆级别
+            index: 函数名混淆之前构建的ScopeIndex，模拟变量名混淆时必需
+            function_mapping: 预先确定的函数名映射，提供时只改名其中的函数
+        """
+        self.rename_functions = rename_functions
+        self.rename_variables = rename_variables
+        self.skip_functions = skip_functions or set()
+        self.function_levels = function_levels or {}
+        self.index = index
+
+        self.function_mapping = function_mapping
+        self.function_slots = {}  # 原函数名 -> 函数名槽位
+        self.variable_slots = {}  # 原变量名 -> 变量名槽位
+        self.renames = []         # (节点, 字段名或nonlocal名称下标, ('function'|'variable', 槽位))
+        self.functions = []       # 后序: (函数定义节点, 外层类和函数节点, 混淆级别, 所属作用域节点, 是否为顶层语句)
+        self.iter_bound = False   # 重命名之后模块中是否仍绑定了iter
+
+        self._variables_active = True
+        self._names = frozenset()  # 当前作用域中可以改名的变量名
+        self._scopes = []
+        self._levels = ['full']
+        self._top_level = set()
+
+    def collect(self, tree):
+        """遍历模块，返回自身"""
+        self._top_level = {id(stmt) for stmt in tree.body}
+        if self.rename_functions:
+            # 与逐遍处理相同，所有函数名从一开始就全部生效
+            names = self.function_mapping if self.function_mapping is not None else renamable_functions(tree)
+            self.function_slots = {name: slot for slot, name in enumerate(names)}
+        self.visit(tree)
+        return self
+
+    def _bind(self, name):
+        if name == 'iter':
+            self.iter_bound = True
+
+    def _variable(self, name):
+        """变量名混淆会改名时返回变量名槽位"""
+        if self.rename_variables and self._variables_active and name in self._names:
+            return ('variable', self.variable_slots.setdefault(name, len(self.variable_slots)))
+        return None
+
+    def _visit_children(self, node):
+        """按变量名混淆的作用域规则访问子节点"""
+        if not (self.rename_variables and self._variables_active):
+            self.generic_visit(node)
+            return
+        outer = self._names
+        for child, names in scoped_children(node, self.index.names(node, outer), outer):
+            self._names = names
+            self.visit(child)
+        self._names = outer
+
+    def _visit_scope(self, node):
+        """进入类或函数作用域，函数在子节点之后记录(内层函数先于外层函数)"""
+        is_function = not isinstance(node, ast.ClassDef)
+        owner = self._scopes[-1] if self._scopes else None
+        level = self.function_levels.get(node.lineno, self._levels[-1]) if is_function else self._levels[-1]
+        chain = tuple(self._scopes)
+
+        self._scopes.append(node)
+        self._levels.append(level)
+        self._visit_children(node)
+        self._levels.pop()
+        self._scopes.pop()
+
+        if is_function:
+            self.functions.append((node, chain, level, owner, id(node) in self._top_level))
+
+    def _visit_skippable(self, node):
+        """跳过变量名混淆的函数整体保持原变量名"""
+        if self._variables_active and node.lineno in self.skip_functions:
+            self._variables_active = False
+            self._visit_scope(node)
+            self._variables_active = True
+        else:
+            self._visit_scope(node)
+
+    def visit_FunctionDef(self, node):
+        name = node.name
+        is_method = bool(self._scopes) and isinstance(self._scopes[-1], ast.ClassDef)
+        if self.rename_functions and renamable_function(name, is_method) and name in self.function_slots:
+            name = ('function', self.function_slots[name])
+            self.renames.append((node, 'name', name))
+        self._bind(name)
+        self._visit_skippable(node)
+
+    def visit_AsyncFunctionDef(self, node):
+        self._bind(node.name)
+        self._visit_skippable(node)
+
+    def visit_ClassDef(self, node):
+        self._bind(node.name)
+        self._visit_scope(node)
+
+    visit_Lambda = visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _visit_children
+
+    def visit_arg(self, node):
+        self._bind(node.arg)
+        self.generic_visit(node)
+
+    def visit_alias(self, node):
+        self._bind(node.asname or node.name)
+
+    def visit_Name(self, node):
+        name = node.id
+        rename = None
+        if isinstance(node.ctx, ast.Load) and self.rename_functions and name in self.function_slots:
+            name = rename = ('function', self.function_slots[name])
+        variable = self._variable(name)
+        if variable is not None:
+            rename = variable
+        elif not isinstance(node.ctx, ast.Load):
+            self._bind(name)
+
+        if rename is not None:
+            self.renames.append((node, 'id', rename))
+
+    def _visit_binding(self, node, field):
+        """except/match等以字符串字段绑定的名称"""
+        variable = self._variable(getattr(node, field))
+        if variable is not None:
+            self.renames.append((node, field, variable))
+        self.generic_visit(node)
+
+    def visit_ExceptHandler(self, node):
+        self._visit_binding(node, 'name')
+
+    visit_MatchAs = visit_MatchStar = visit_ExceptHandler
+
+    def visit_MatchMapping(self, node):
+        self._visit_binding(node, 'rest')
+
+    def visit_Nonlocal(self, node):
+        for position, name in enumerate(node.names):
+            variable = self._variable(name)
+            if variable is not None:
+                self.renames.append((node, position, variable))
+
+
+class FusedEngine:
+    """
+    单次遍历的混淆引擎
+
+    逐遍处理时函数名混淆、变量名混淆和平坦化各自完整遍历一次AST，每遍之后还要
+    调用一次ast.fix_missing_locations。本引擎用SymbolCollector在一次分析遍历中收集
+    所有决策，然后按记录的节点直接改名，并按后序逐个平坦化函数，只对平坦化后的
+    函数补全位置信息。随机名称的生成顺序与逐遍处理相同，给定随机种子时输出完全一致。
+    """
+
+    def __init__(self, flattener=None, rename_functions=True, rename_variables=True,
+                 skip_functions=None, function_levels=None, index=None, function_mapping=None, rng=None):
+        """
+        Args:
+            flattener: CodeFlattener实例，None表示不做平坦化
+            rename_functions: 是否进行函数名混淆
+            rename_variables: 是否进行变量名混淆
+            skip_functions: 不做变量名混淆的函数定义行号
+            function_levels: 函数定义行号 -> 混淆级别
+            index: 由未改动的AST构建的ScopeIndex，None表示在运行时构建
+            function_mapping: 预先确定的函数名映射(如ProgramIndex给出的整包映射)
+            rng: 随机数生成器(random.Random实例)，None表示使用random模块的全局生成器
+        """
+        self.flattener = flattener
+        self.rename_functions = rename_functions
+        self.rename_variables = rename_variables
+        self.skip_functions = skip_functions or set()
+        self.function_levels = function_levels or {}
+        self.index = index
+        self.function_mapping = function_mapping
+        self.rng = rng
+        self.name_mapping = {}
+        self.var_mapping = {}
+        self.bytecode_levels = {}
+
+    def _allocate(self, collector):
+        """按逐遍处理的顺序生成新名称，返回槽位 -> 新名称的解析函数"""
+        functions = FunctionNameObfuscator(rng=self.rng)
+        function_names = []
+        for original in collector.function_slots:
+            if self.function_mapping is not None:
+                function_names.append(self.function_mapping[original])
+            else:
+                function_names.append(functions._generate_random_name())
+            functions.name_mapping[original] = function_names[-1]
+        self.name_mapping = functions.name_mapping
+
+        variables = VariableNameObfuscator(index=collector.index, rng=self.rng) if collector.index else None
+        variable_names = []
+        for name in collector.variable_slots:
+            variable_names.append(variables._generate_random_name())
+            self.var_mapping[name] = variable_names[-1]
+
+        return lambda kind, slot: function_names[slot] if kind == 'function' else variable_names[slot]
+
+    def run(self, tree):
+        """
+        对模块AST进行重命名和平坦化
+
+        Returns:
+            处理后的AST
+        """
+        index = self.index
+        if self.rename_variables and index is None:
+            index = ScopeIndex(tree, skip_functions=self.skip_functions)
+        collector = SymbolCollector(self.rename_functions, self.rename_variables,
+                                    self.skip_functions, self.function_levels, index,
+                                    self.function_mapping).collect(tree)
+        new_name = self._allocate(collector)
+
+        for node, field, (kind, slot) in collector.renames:
+            if isinstance(field, int):
+                node.names[field] = new_name(kind, slot)
+            else:
+                setattr(node, field, new_name(kind, slot))
+
+        self.bytecode_levels = {
+            func.name: self.function_levels[func.lineno]
+            for func, _, _, _, _ in collector.functions if func.lineno in self.function_levels
+        }
+
+        if self.flattener is not None:
+            flattener = self.flattener
+            flattener.function_levels = self.function_levels
+            flattener.stats = {}
+            flattener.skipped = {}
+            flattener.generated_names = []
+            flattener.state_vars = set()
+            flattener.iter_shadowed = collector.iter_bound
+            for func, chain, level, owner, top_level in collector.functions:
+                name = '.'.join([scope.name for scope in chain] + [func.name])
+                flattener.process_function(func, name, level, owner, top_level)
+                if name in flattener.stats:
+                    # 重命名不产生新节点，只有平坦化后的函数需要补全位置信息
+                    ast.fix_missing_locations(func)
+        return tree
+
+
+def fused_obfuscate(tree, flattener=None, rename_functions=True, rename_variables=True,
+                    skip_functions=None, function_levels=None, index=None, function_mapping=None, rng=None):
+    """
+    单次遍历完成函数名混淆、变量名混淆和平坦化
+
+    Returns:
+        (处理后的AST, 函数名映射, 变量名映射, 字节码阶段使用的函数级别)
+    """
+    engine = FusedEngine(flattener, rename_functions, rename_variables, skip_functions, function_levels, index,
+                         function_mapping, rng)
+    tree = engine.run(tree)
+    return tree, engine.name_mapping, engine.var_mapping, engine.bytecode_levels
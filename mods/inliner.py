@@ -0,0 +1,319 @@
+import ast
+import copy
+
+from .localizer import DYNAMIC_NAMES, module_bindings
+
+
+# 出现这些节点的函数不会被内联
+UNSAFE_NODES = (ast.Yield, ast.YieldFrom, ast.Await, ast.Global, ast.Nonlocal,
+                ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+
+
+def bound_names(node):
+    """收集节点中绑定的所有名称(包括参数)"""
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and not isinstance(child.ctx, ast.Load):
+            names.add(child.id)
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(child.name)
+        elif isinstance(child, ast.arg):
+            names.add(child.arg)
+        elif isinstance(child, ast.alias):
+            names.add((child.asname or child.name).split('.')[0])
+        elif isinstance(child, ast.ExceptHandler) and child.name:
+            names.add(child.name)
+        elif isinstance(child, (ast.Global, ast.Nonlocal)):
+            names.update(child.names)
+    return names
+
+
+def uses_private_names(node):
+    """判断节点中是否有__x形式(不以__结尾)的标识符，这类名称在类体内会被改写为_Class__x"""
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            names = [child.id]
+        elif isinstance(child, ast.Attribute):
+            names = [child.attr]
+        elif isinstance(child, ast.arg):
+            names = [child.arg]
+        elif isinstance(child, ast.alias):
+            names = child.name.split('.') + ([child.asname] if child.asname else [])
+        else:
+            continue
+        if any(name.startswith('__') and not name.endswith('__') for name in names):
+            return True
+    return False
+
+
+class FunctionInliner:
+    """
+    将小型模块级函数内联到调用处
+
+    只内联满足以下条件的函数:
+    1. 模块顶层定义、没有装饰器、只有普通位置参数(无默认值、*args、**kwargs)
+    2. 语句数不超过max_statements，return只出现在最后一条语句
+    3. 不是递归函数(调用图中不能回到自身)，不包含yield/await/global/nonlocal、
+       嵌套函数、类和lambda，也不使用globals()/locals()等
+    4. 函数名在模块中只绑定一次
+    5. 调用方是方法时，函数中没有会被类体改写(名称改编)的__x形式的标识符
+
+    调用处必须是 `f(...)`、`x = f(...)` 或 `return f(...)` 形式的语句。被内联的函数体中
+    的局部变量重命名为新名称，参数通过一次元组赋值绑定，保证实参先于函数体求值。
+    原函数定义保留，以免影响模块外部的使用。
+    """
+
+    def __init__(self, max_statements=8, skip_functions=None):
+        """
+        Args:
+            max_statements: 可内联函数的最大语句数
+            skip_functions: 不接受内联的调用方函数定义行号
+        """
+        self.max_statements = max_statements
+        self.skip_functions = skip_functions or set()
+        self.report = {}  # 调用方函数名 -> 被内联的函数名列表
+        self.counter = 0
+
+    def inline(self, tree):
+        """内联模块中的小函数，返回处理后的AST"""
+        self.report = {}
+        if any(isinstance(node, ast.Name) and node.id in DYNAMIC_NAMES for node in ast.walk(tree)):
+            return tree
+
+        self.taken = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+        self.candidates = self._find_candidates(tree)
+        if not self.candidates:
+            return tree
+        self.private = {name for name, func in self.candidates.items() if uses_private_names(func)}
+
+        for caller, in_class in self._callers(tree):
+            if caller.lineno in self.skip_functions:
+                continue
+            self.caller = caller
+            self.caller_in_class = in_class
+            self.caller_names = bound_names(caller)
+            caller.body = self._inline_body(caller.body)
+        return tree
+
+    def _callers(self, tree):
+        """可以接受内联的函数: 模块级函数和模块级类的方法，返回 (函数, 是否为方法)"""
+        for stmt in tree.body:
+            if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                yield stmt, False
+            elif isinstance(stmt, ast.ClassDef):
+                for item in stmt.body:
+                    if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        yield item, True
+
+    def _find_candidates(self, tree):
+        """
+        找出可以内联的函数
+
+        Returns:
+            函数名 -> 函数定义的副本
+        """
+        functions = {stmt.name: stmt for stmt in tree.body if isinstance(stmt, ast.FunctionDef)}
+        bindings = module_bindings(tree)
+        calls = {
+            name: {node.func.id for node in ast.walk(func)
+                   if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)}
+            for name, func in functions.items()
+        }
+
+        candidates = {}
+        for name, func in functions.items():
+            if len(bindings.get(name, [])) != 1 or self._is_recursive(name, calls):
+                continue
+            if self._is_inlinable(func):
+                candidates[name] = copy.deepcopy(func)
+        return candidates
+
+    def _is_recursive(self, name, calls):
+        """判断函数能否经由调用图回到自身"""
+        pending = list(calls[name])
+        seen = set()
+        while pending:
+            current = pending.pop()
+            if current == name:
+                return True
+            if current in seen or current not in calls:
+                continue
+            seen.add(current)
+            pending.extend(calls[current])
+        return False
+
+    def _is_inlinable(self, func):
+        args = func.args
+        if (func.decorator_list or args.vararg or args.kwarg or args.kwonlyargs
+                or args.defaults or args.kw_defaults):
+            return False
+
+        body = self._strip_docstring(func.body)
+        if not body or sum(isinstance(node, ast.stmt) for stmt in body for node in ast.walk(stmt)) > self.max_statements:
+            return False
+
+        for stmt in body:
+            for node in ast.walk(stmt):
+                if isinstance(node, UNSAFE_NODES):
+                    return False
+                if isinstance(node, ast.Name) and node.id == 'super':
+                    return False
+                if isinstance(node, ast.Return) and node is not body[-1]:
+                    return False
+        return True
+
+    def _strip_docstring(self, body):
+        if (body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant)
+                and isinstance(body[0].value.value, str)):
+            return body[1:]
+        return body
+
+    def _inline_body(self, stmts):
+        """处理语句列表中的调用语句，不进入嵌套的函数和类"""
+        result = []
+        for stmt in stmts:
+            replacement = self._inline_stmt(stmt)
+            if replacement is not None:
+                result.extend(replacement)
+                continue
+
+            for field in ('body', 'orelse', 'finalbody'):
+                if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) \
+                        and isinstance(getattr(stmt, field, None), list):
+                    setattr(stmt, field, self._inline_body(getattr(stmt, field)))
+            for handler in getattr(stmt, 'handlers', []):
+                handler.body = self._inline_body(handler.body)
+            result.append(stmt)
+        return result
+
+    def _inline_stmt(self, stmt):
+        """
+        内联单条语句中的调用
+
+        Returns:
+            替换后的语句列表，不能内联时返回None
+        """
+        if isinstance(stmt, (ast.Expr, ast.Assign, ast.Return)):
+            call = stmt.value
+        else:
+            return None
+        if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+            return None
+        callee = self.candidates.get(call.func.id)
+        if callee is None or callee.name == self.caller.name:
+            return None
+        if self.caller_in_class and callee.name in self.private:
+            # 内联到类体中后__x会被改编为_Class__x，含义改变
+            return None
+
+        arguments = self._bind_arguments(callee, call)
+        if arguments is None:
+            return None
+
+        # 被内联函数引用的全局名称不能被调用方的局部变量遮蔽
+        body = self._strip_docstring(callee.body)
+        local_names = bound_names(callee.args) | set().union(*(bound_names(s) for s in body))
+        free_names = {node.id for s in body for node in ast.walk(s)
+                      if isinstance(node, ast.Name) and node.id not in local_names}
+        if free_names & self.caller_names or call.func.id in self.caller_names:
+            return None
+
+        self.counter += 1
+        renames = {name: self._new_name(name) for name in local_names}
+        body = [self._rename(copy.deepcopy(s), renames) for s in body]
+
+        result = []
+        params = [renames[arg.arg] for arg in callee.args.posonlyargs + callee.args.args]
+        if params:
+            if len(params) == 1:
+                target = ast.Name(id=params[0], ctx=ast.Store())
+                value = arguments[0]
+            else:
+                target = ast.Tuple(elts=[ast.Name(id=p, ctx=ast.Store()) for p in params], ctx=ast.Store())
+                value = ast.Tuple(elts=arguments, ctx=ast.Load())
+            result.append(ast.Assign(targets=[target], value=value))
+
+        return_value = ast.Constant(value=None)
+        if body and isinstance(body[-1], ast.Return):
+            if body[-1].value is not None:
+                return_value = body[-1].value
+            body = body[:-1]
+        result.extend(body)
+
+        if isinstance(stmt, ast.Assign):
+            result.append(ast.Assign(targets=stmt.targets, value=return_value))
+        elif isinstance(stmt, ast.Return):
+            result.append(ast.Return(value=return_value))
+        elif not isinstance(return_value, (ast.Constant, ast.Name)):
+            result.append(ast.Expr(value=return_value))
+        if not result:
+            result.append(ast.Pass())
+
+        self.report.setdefault(self.caller.name, []).append(callee.name)
+        return [ast.copy_location(new, stmt) for new in result]
+
+    def _bind_arguments(self, callee, call):
+        """按参数顺序排列实参，无法静态匹配时返回None"""
+        params = [arg.arg for arg in callee.args.posonlyargs + callee.args.args]
+        positional_only = {arg.arg for arg in callee.args.posonlyargs}
+        if any(isinstance(arg, ast.Starred) for arg in call.args) or len(call.args) > len(params):
+            return None
+
+        values = dict(zip(params, call.args))
+        keywords = []
+        for keyword in call.keywords:
+            if keyword.arg is None or keyword.arg not in params or keyword.arg in values \
+                    or keyword.arg in positional_only:
+                return None
+            values[keyword.arg] = keyword.value
+            keywords.append(keyword.arg)
+        if len(values) != len(params):
+            return None
+        if keywords != [p for p in params if p in keywords]:
+            # 关键字实参的书写顺序与形参顺序不同时无法保持求值顺序
+            return None
+        return [values[p] for p in params]
+
+    def _new_name(self, name):
+        new_name = f"_in{self.counter}_{name}"
+        while new_name in self.taken:
+            new_name = '_' + new_name
+        self.taken.add(new_name)
+        return new_name
+
+    def _rename(self, node, renames):
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and child.id in renames:
+                child.id = renames[child.id]
+        return node
+
+
+def inline_functions(tree, max_statements=8, skip_functions=None):
+    """
+    将小型模块级函数内联到调用处
+
+    Returns:
+        (处理后的AST, 调用方函数名 -> 被内联的函数名列表)
+    """
+    inliner = FunctionInliner(max_statements=max_statements, skip_functions=skip_functions)
+    tree = inliner.inline(tree)
+    ast.fix_missing_locations(tree)
+    return tree, inliner.report
+
+
+def format_inline_report(report):
+    """
+    生成内联报告
+
+    Returns:
+        报告文本行列表
+    """
+    if not report:
+        return ["  无"]
+    lines = []
+    for caller, callees in report.items():
+        counts = {}
+        for callee in callees:
+            counts[callee] = counts.get(callee, 0) + 1
+        lines.append(f"  {caller}: " + ', '.join(f"{callee} ({count}处)" for callee, count in counts.items()))
+    return lines
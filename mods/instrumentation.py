@@ -0,0 +1,253 @@
+import ast
+import sys
+
+from .control_flow import function_qualnames
+from .flatten_optimizer import find_dispatchers
+
+
+MODES = ('auto', 'counters', 'monitoring')
+
+# 运行时支持代码: 计数数组和退出时的转储钩子
+# 计数数组中第2k项为第k个分发循环的循环轮数，第2k+1项为状态转移次数
+RUNTIME_TEMPLATE = '''
+import atexit as {prefix}atexit
+{prefix}names = {names!r}
+{prefix}counts = [0] * {size}
+
+
+def {prefix}dump(path={output!r}):
+    import json, os
+    path = os.environ.get('OBF_DISPATCH_COUNTS', path)
+    data = {{}}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError:
+            data = {{}}
+    for index, name in enumerate({prefix}names):
+        old = data.get(name, [0, 0])
+        data[name] = [old[0] + {prefix}counts[2 * index], old[1] + {prefix}counts[2 * index + 1]]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'), sort_keys=True)
+
+
+{prefix}atexit.register({prefix}dump)
+'''
+
+# sys.monitoring (3.12+) 方式: 只对平坦化函数的代码对象开启INSTRUCTION事件，按指令偏移计数，
+# 与行号无关(直接由AST编译的pyc中生成的节点沿用所在语句的行号)。分发循环体的第一条指令
+# 计为一轮循环，循环内的状态变量赋值计为一次状态转移，与counters方式统计的位置相同
+MONITORING_TEMPLATE = '''
+
+def {prefix}monitor(targets):
+    import dis, sys
+    monitoring = getattr(sys, 'monitoring', None)
+    if monitoring is None:
+        print('dispatch counting needs sys.monitoring (Python 3.12+)', file=sys.stderr)
+        return
+    for tool in range(6):
+        try:
+            monitoring.use_tool_id(tool, 'obf-dispatch')
+            break
+        except ValueError:
+            continue
+    else:
+        return
+    codes = {{}}
+    pending = [sys._getframe(1).f_code]
+    while pending:
+        code = pending.pop()
+        codes.setdefault(code.co_qualname, code)
+        pending.extend(const for const in code.co_consts if hasattr(const, 'co_qualname'))
+    table = {{}}
+    for index, qualname, state_var in targets:
+        code = codes.get(qualname)
+        if code is None:
+            continue
+        slots = table.setdefault(code, {{}})
+        instructions = [instruction for instruction in dis.get_instructions(code)
+                        if instruction.opname not in ('CACHE', 'NOP', 'NOT_TAKEN')]
+        stores = []
+        entry = None
+        for position, instruction in enumerate(instructions):
+            # 3.13起STORE_FAST/LOAD_FAST可能合并为超级指令，argval为名称元组
+            names = instruction.argval if isinstance(instruction.argval, tuple) else (instruction.argval,)
+            if state_var not in names:
+                continue
+            if instruction.opname.startswith('STORE_FAST'):
+                stores.append(instruction.offset)
+            if (entry is None and 'LOAD_FAST' in instruction.opname and position + 1 < len(instructions)
+                    and instructions[position + 1].argval == -1):
+                # 第一次出现的循环条件之后的条件跳转，其后一条指令就是循环体的开头
+                for later in range(position + 2, len(instructions) - 1):
+                    if 'JUMP_IF' in instructions[later].opname:
+                        entry = instructions[later + 1].offset
+                        break
+        if entry is not None:
+            slots[entry] = 2 * index
+        # 第一个状态赋值是进入分发循环之前的初始状态，不计为状态转移
+        for offset in stores[1:]:
+            slots[offset] = 2 * index + 1
+
+    def on_instruction(code, offset):
+        slot = table.get(code, {{}}).get(offset)
+        if slot is None:
+            return monitoring.DISABLE
+        {prefix}counts[slot] += 1
+
+    monitoring.register_callback(tool, monitoring.events.INSTRUCTION, on_instruction)
+    for code in table:
+        monitoring.set_local_events(tool, code, monitoring.events.INSTRUCTION)
+
+
+{prefix}monitor({targets!r})
+'''
+
+
+def resolve_mode(mode):
+    """auto模式下，有sys.monitoring(3.12+)时使用monitoring，否则注入计数器"""
+    if mode not in MODES:
+        raise ValueError(f"不支持的插桩方式: {mode}")
+    if mode == 'auto':
+        return 'monitoring' if hasattr(sys, 'monitoring') else 'counters'
+    return mode
+
+
+class DispatchInstrumenter:
+    """
+    为平坦化后的函数插入运行时分发计数
+
+    统计每个分发循环的循环轮数和状态转移次数，进程退出时把计数累加写入一个紧凑的
+    JSON文件 ({函数名: [循环轮数, 状态转移次数]})，用于在预发布环境中衡量哪些混淆
+    后的函数真正带来了开销。计数方式:
+
+    1. counters: 在分发循环体开头和每个状态赋值之后注入 `counts[i] += 1`
+    2. monitoring: 不修改函数体，由sys.monitoring的INSTRUCTION事件按指令偏移计数
+       (Python 3.12+)，只对平坦化函数的代码对象开启事件，其余指令在第一次触发后即被禁用；
+       两种方式统计的位置相同，计数一致
+
+    插桩版本会在输出中保留原始函数名，只应用于内部测量，不应发布。
+    """
+
+    def __init__(self, mode='auto', output='dispatch_counts.json', prefix='_dc_'):
+        """
+        Args:
+            mode: 'auto'、'counters' 或 'monitoring'
+            output: 计数文件路径，运行时可用环境变量OBF_DISPATCH_COUNTS覆盖
+            prefix: 生成的模块级名称前缀
+        """
+        self.mode = resolve_mode(mode)
+        self.output = output
+        self.prefix = prefix
+        self.report = []  # (函数名, 分发循环数)
+
+    def instrument(self, tree, state_vars, rename=None):
+        """
+        插入分发计数，返回处理后的AST
+
+        Args:
+            tree: 平坦化(及窥孔优化)之后的模块AST
+            state_vars: 平坦化器生成的状态变量名
+            rename: 混淆后名称 -> 原始名称，用于在计数文件中记录原始函数名
+        """
+        self.report = []
+        rename = rename or {}
+        names = []
+        targets = []
+        for qualname, func in function_qualnames(tree):
+            dispatchers = list(find_dispatchers(func.body, state_vars))
+            if not dispatchers:
+                continue
+            original = '.'.join(rename.get(part, part) for part in qualname.split('.'))
+            for number, (state_var, loop) in enumerate(dispatchers):
+                index = len(names)
+                names.append(original if len(dispatchers) == 1 else f"{original}#{number + 1}")
+                targets.append((index, qualname, state_var))
+                if self.mode == 'counters':
+                    self._inject(loop, state_var, index)
+            self.report.append((original, len(dispatchers)))
+
+        if not names:
+            return tree
+
+        source = RUNTIME_TEMPLATE.format(prefix=self.prefix, names=names, size=2 * len(names), output=self.output)
+        if self.mode == 'monitoring':
+            source += MONITORING_TEMPLATE.format(prefix=self.prefix, targets=targets)
+        runtime = ast.parse(source).body
+
+        position = 0
+        for stmt in tree.body:
+            is_docstring = (position == 0 and isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant)
+                            and isinstance(stmt.value.value, str))
+            is_future = isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__'
+            if not (is_docstring or is_future):
+                break
+            position += 1
+        tree.body[position:position] = runtime
+        return tree
+
+    def _counter(self, slot):
+        """生成 `counts[slot] += 1`"""
+        return ast.AugAssign(
+            target=ast.Subscript(value=ast.Name(id=f"{self.prefix}counts", ctx=ast.Load()),
+                                 slice=ast.Constant(value=slot), ctx=ast.Store()),
+            op=ast.Add(),
+            value=ast.Constant(value=1)
+        )
+
+    def _is_state_store(self, stmt, state_var):
+        return (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1
+                and isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id == state_var)
+
+    def _inject(self, loop, state_var, index):
+        """在分发循环体开头计一轮循环，在每个状态赋值之后计一次状态转移"""
+        loop.body = [self._counter(2 * index)] + self._inject_stores(loop.body, state_var, 2 * index + 1)
+
+    def _inject_stores(self, stmts, state_var, slot):
+        result = []
+        for stmt in stmts:
+            result.append(stmt)
+            if self._is_state_store(stmt, state_var):
+                result.append(self._counter(slot))
+                continue
+            if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            for field in ('body', 'orelse', 'finalbody'):
+                if isinstance(getattr(stmt, field, None), list):
+                    setattr(stmt, field, self._inject_stores(getattr(stmt, field), state_var, slot))
+            for handler in getattr(stmt, 'handlers', []):
+                handler.body = self._inject_stores(handler.body, state_var, slot)
+        return result
+
+
+def instrument_dispatch(tree, state_vars, mode='auto', output='dispatch_counts.json', rename=None):
+    """
+    为平坦化后的函数插入运行时分发计数
+
+    Args:
+        state_vars: 平坦化器生成的状态变量名，只统计这些变量驱动的分发循环
+
+    Returns:
+        (处理后的AST, (实际插桩方式, [(函数名, 分发循环数)]))
+    """
+    instrumenter = DispatchInstrumenter(mode=mode, output=output)
+    tree = instrumenter.instrument(tree, state_vars, rename)
+    ast.fix_missing_locations(tree)
+    return tree, (instrumenter.mode, instrumenter.report)
+
+
+def format_instrument_report(report):
+    """
+    生成插桩报告
+
+    Returns:
+        报告文本行列表
+    """
+    mode, functions = report
+    lines = [f"  插桩方式: {mode}"]
+    for name, count in functions:
+        lines.append(f"  {name}: {count} 个分发循环")
+    if not functions:
+        lines.append("  没有平坦化的函数")
+    return lines
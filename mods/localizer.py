@@ -0,0 +1,242 @@
+import ast
+import builtins
+import symtable
+
+from .codegen import generate_source
+from .control_flow import LOOP_ITERATIONS
+
+
+# 出现这些名称时，全局名称或内置名称的绑定可能被动态修改，不做本地化
+DYNAMIC_NAMES = {'globals', 'locals', 'vars', 'exec', 'eval', '__builtins__', 'builtins'}
+
+# 拥有独立作用域的节点，其中的名称不会使用外层函数的局部变量
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef,
+               ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+# symtable中不对应函数定义的函数作用域
+IMPLICIT_SCOPES = {'lambda', 'listcomp', 'setcomp', 'dictcomp', 'genexpr'}
+
+# 可以作为模块级名称唯一绑定的顶层语句
+DEFINING_STMTS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Import, ast.ImportFrom,
+                  ast.Assign, ast.AnnAssign)
+
+
+class GlobalLocalizer:
+    """
+    将函数中频繁使用的全局名称和内置名称绑定为局部变量
+
+    在函数入口执行 `_lg_len, _lg_DELTA = len, DELTA`，函数体中的使用改为读取局部变量，
+    把每次使用时的全局字典和内置字典查找变为一次局部变量读取。
+
+    只有满足以下条件的名称才会被本地化:
+    1. 在函数中是隐式全局名称(symtable判定)，没有global/nonlocal声明
+    2. 内置名称在模块中从未被绑定；模块级名称只在函数所在顶层语句之前的
+       一条顶层定义语句中绑定过一次
+    3. 模块中没有使用globals()/exec/eval等可能动态修改绑定的名称
+    """
+
+    def __init__(self, min_uses=3, prefix='_lg_', skip_functions=None):
+        """
+        Args:
+            min_uses: 本地化所需的最少(按循环次数加权的)使用次数
+            prefix: 局部别名的前缀
+            skip_functions: 不做本地化的函数定义行号
+        """
+        self.min_uses = min_uses
+        self.prefix = prefix
+        self.skip_functions = skip_functions or set()
+        self.report = {}  # 函数名 -> 被本地化的名称列表
+
+    def localize(self, tree, filename='<string>'):
+        """对模块中的所有函数进行本地化，返回处理后的AST"""
+        self.report = {}
+        if any(isinstance(node, ast.Name) and node.id in DYNAMIC_NAMES for node in ast.walk(tree)):
+            return tree
+
+        table = symtable.symtable(generate_source(tree), filename, 'exec')
+        tables = list(self._function_tables(table))
+        functions = list(self._functions(tree))
+        if [t.get_name() for t in tables] != [func.name for func, _ in functions]:
+            # 无法可靠地对应AST与符号表时放弃本地化
+            return tree
+
+        self.taken = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+        bindings = module_bindings(tree)
+        for (func, top_index), func_table in zip(functions, tables):
+            if func.lineno not in self.skip_functions:
+                self._localize_function(func, func_table, top_index, bindings)
+        return tree
+
+    def _function_tables(self, table):
+        """按定义顺序遍历所有函数定义对应的符号表"""
+        for child in table.get_children():
+            if child.get_type() == 'function' and child.get_name() not in IMPLICIT_SCOPES:
+                yield child
+            yield from self._function_tables(child)
+
+    def _functions(self, tree):
+        """按定义顺序遍历所有函数定义，同时给出其所在顶层语句的下标"""
+        def preorder(node):
+            yield node
+            for child in ast.iter_child_nodes(node):
+                yield from preorder(child)
+
+        for index, stmt in enumerate(tree.body):
+            for node in preorder(stmt):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    yield node, index
+
+    def _is_stable(self, name, func, top_index, bindings):
+        """判断名称在函数执行期间是否始终绑定到同一个对象"""
+        if name.startswith('__') and name.endswith('__'):
+            return False
+        sites = bindings.get(name, [])
+        if not sites:
+            return hasattr(builtins, name)
+        if len(sites) != 1 or sites[0] is None:
+            return False
+        # 绑定语句在函数所在顶层语句之前执行，或者是函数自身(递归调用)
+        return sites[0] < top_index or (func.name == name and sites[0] == top_index)
+
+    def _own_uses(self, func):
+        """
+        收集函数自身作用域中的名称读取及其权重
+
+        Returns:
+            名称 -> [(Name节点, 权重)]
+        """
+        uses = {}
+
+        def visit(node, weight):
+            if isinstance(node, SCOPE_NODES):
+                return
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+                uses.setdefault(node.id, []).append((node, weight))
+                return
+            if isinstance(node, (ast.For, ast.AsyncFor)):
+                visit(node.target, weight)
+                visit(node.iter, weight)
+                for stmt in node.body:
+                    visit(stmt, weight * LOOP_ITERATIONS)
+                for stmt in node.orelse:
+                    visit(stmt, weight)
+                return
+            if isinstance(node, ast.While):
+                visit(node.test, weight * LOOP_ITERATIONS)
+                for stmt in node.body:
+                    visit(stmt, weight * LOOP_ITERATIONS)
+                for stmt in node.orelse:
+                    visit(stmt, weight)
+                return
+            for child in ast.iter_child_nodes(node):
+                visit(child, weight)
+
+        for stmt in func.body:
+            visit(stmt, 1)
+        return uses
+
+    def _new_alias(self, name):
+        alias = f"{self.prefix}{name}"
+        suffix = 0
+        while alias in self.taken:
+            suffix += 1
+            alias = f"{self.prefix}{name}_{suffix}"
+        return alias
+
+    def _localize_function(self, func, table, top_index, bindings):
+        names = []
+        for name, nodes in sorted(self._own_uses(func).items()):
+            if sum(weight for _, weight in nodes) < self.min_uses:
+                continue
+            try:
+                symbol = table.lookup(name)
+            except KeyError:
+                continue
+            if not symbol.is_global() or symbol.is_declared_global():
+                continue
+            if not self._is_stable(name, func, top_index, bindings):
+                continue
+
+            alias = self._new_alias(name)
+            for node, _ in nodes:
+                node.id = alias
+            names.append((name, alias))
+
+        if not names:
+            return
+
+        if len(names) == 1:
+            target = ast.Name(id=names[0][1], ctx=ast.Store())
+            value = ast.Name(id=names[0][0], ctx=ast.Load())
+        else:
+            target = ast.Tuple(elts=[ast.Name(id=alias, ctx=ast.Store()) for _, alias in names], ctx=ast.Store())
+            value = ast.Tuple(elts=[ast.Name(id=name, ctx=ast.Load()) for name, _ in names], ctx=ast.Load())
+        prologue = ast.Assign(targets=[target], value=value)
+
+        # 插入在文档字符串之后
+        position = 1 if (func.body and isinstance(func.body[0], ast.Expr)
+                         and isinstance(func.body[0].value, ast.Constant)
+                         and isinstance(func.body[0].value.value, str)) else 0
+        func.body.insert(position, prologue)
+        self.report[func.name] = [name for name, _ in names]
+
+
+def module_bindings(tree):
+    """
+    统计整个模块中每个名称的绑定位置
+
+    Returns:
+        名称 -> 绑定语句所在顶层语句下标的列表(不是顶层定义语句时为None)
+    """
+    bindings = {}
+
+    def add(name, index):
+        bindings.setdefault(name, []).append(index)
+
+    for index, stmt in enumerate(tree.body):
+        top_level = index if isinstance(stmt, DEFINING_STMTS) else None
+        for node in ast.walk(stmt):
+            # 只有顶层定义语句本身绑定的名称才算作顶层绑定
+            own = top_level if node is stmt or node in getattr(stmt, 'targets', ()) \
+                or node is getattr(stmt, 'target', None) or node in getattr(stmt, 'names', ()) else None
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                add(node.id, own)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                add(node.name, own)
+            elif isinstance(node, ast.alias):
+                add((node.asname or node.name).split('.')[0], own)
+            elif isinstance(node, ast.arg):
+                add(node.arg, None)
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                for name in node.names:
+                    add(name, None)
+            elif isinstance(node, ast.ExceptHandler) and node.name:
+                add(node.name, None)
+            elif hasattr(ast, 'MatchAs') and isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+                add(node.name, None)
+    return bindings
+
+
+def localize_globals(tree, filename='<string>', skip_functions=None, min_uses=3):
+    """
+    将函数中频繁使用的全局名称和内置名称绑定为局部变量
+
+    Returns:
+        (处理后的AST, 函数名 -> 被本地化的名称列表)
+    """
+    localizer = GlobalLocalizer(min_uses=min_uses, skip_functions=skip_functions)
+    tree = localizer.localize(tree, filename)
+    ast.fix_missing_locations(tree)
+    return tree, localizer.report
+
+
+def format_localization_report(report):
+    """
+    生成本地化报告
+
+    Returns:
+        报告文本行列表
+    """
+    if not report:
+        return ["  无"]
+    return [f"  {name}: {', '.join(names)}" for name, names in report.items()]
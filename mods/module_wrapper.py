@@ -0,0 +1,291 @@
+import ast
+
+from .constant_folder import COMPREHENSIONS, SCOPE_NODES, scope_bindings
+from .localizer import DYNAMIC_NAMES
+
+
+# 不能移入函数的顶层语句
+TOP_LEVEL_ONLY = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Import, ast.ImportFrom,
+                  ast.Global, ast.Nonlocal, ast.AnnAssign)
+
+# 只在函数外合法，或移入函数后含义会改变的节点
+FORBIDDEN_NODES = (ast.Return, ast.Yield, ast.YieldFrom, ast.Await, ast.Global, ast.Nonlocal, ast.AnnAssign)
+
+
+def own_scope_nodes(stmts):
+    """
+    遍历语句中属于当前作用域的节点
+
+    嵌套作用域节点本身会被返回，只进入其中在当前作用域求值的部分
+    (装饰器、默认值、注解、基类)。
+    """
+    stack = list(stmts)
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            stack.extend(getattr(node, 'decorator_list', []))
+            stack.extend(node.args.defaults)
+            stack.extend(default for default in node.args.kw_defaults if default is not None)
+            stack.extend(arg.annotation for arg in ast.walk(node.args)
+                         if isinstance(arg, ast.arg) and arg.annotation is not None)
+            if getattr(node, 'returns', None) is not None:
+                stack.append(node.returns)
+        elif isinstance(node, ast.ClassDef):
+            stack.extend(node.decorator_list + node.bases + [keyword.value for keyword in node.keywords])
+        elif not isinstance(node, SCOPE_NODES):
+            stack.extend(ast.iter_child_nodes(node))
+
+
+def nested_scopes(stmts):
+    """语句中直接包含的嵌套作用域(函数、lambda、类、推导式)"""
+    return [node for node in own_scope_nodes(stmts) if isinstance(node, SCOPE_NODES)]
+
+
+def global_references(scope, enclosing=frozenset()):
+    """
+    收集嵌套作用域(及其内部的作用域)中引用的模块级名称
+
+    Args:
+        scope: 函数、lambda、类或推导式节点
+        enclosing: 外层函数作用域中绑定的名称
+    """
+    if isinstance(scope, COMPREHENSIONS):
+        body = [scope.elt] if hasattr(scope, 'elt') else [scope.key, scope.value]
+        for generator in scope.generators:
+            body.extend([generator.target, generator.iter] + generator.ifs)
+    elif isinstance(scope, ast.Lambda):
+        body = [scope.body]
+    else:
+        body = scope.body
+
+    bound = set(scope_bindings(body))
+    if isinstance(scope, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+        bound |= {arg.arg for arg in ast.walk(scope.args) if isinstance(arg, ast.arg)}
+    declared = {name for node in own_scope_nodes(body) if isinstance(node, ast.Global) for name in node.names}
+
+    references = set()
+    for node in own_scope_nodes(body):
+        if isinstance(node, ast.Name) and (node.id in declared
+                                           or (node.id not in bound and node.id not in enclosing)):
+            references.add(node.id)
+
+    # 类作用域中绑定的名称对内部作用域不可见
+    inner_enclosing = enclosing if isinstance(scope, ast.ClassDef) else enclosing | (bound - declared)
+    for child in nested_scopes(body):
+        references |= global_references(child, inner_enclosing)
+    return references
+
+
+def module_level_names(stmts):
+    """收集语句在模块作用域中读写的名称，以及其中嵌套作用域引用的模块级名称"""
+    names = set(scope_bindings(stmts))
+    for node in own_scope_nodes(stmts):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+    for scope in nested_scopes(stmts):
+        names |= global_references(scope)
+    return names
+
+
+class ModuleCodeWrapper:
+    """
+    将模块级代码移入生成的初始化函数
+
+    模块级代码使用LOAD_NAME/STORE_NAME按字典读写变量，移入函数后改为快速局部变量，
+    同时使这部分代码也能被平坦化。连续的可移动顶层语句(不含函数/类定义和导入)中
+    包含循环或推导式时，会被替换为:
+
+        def _module_init_1():
+            global a, b
+            ...
+            return x, y
+        x, y = _module_init_1()
+
+    其中a、b是在其他顶层语句或函数中使用的名称，以及无法确定一定被赋值的导出名称；
+    x、y是只在这段代码中使用、一定被赋值的导出名称(有__all__时为其中的名称，
+    否则为不以下划线开头的名称)，执行结束后写回模块。
+    """
+
+    def __init__(self, prefix='_module_init_'):
+        self.prefix = prefix
+        self.report = []  # (起始行号, 语句数, 全局名称, 写回名称, 局部名称)
+
+    def wrap(self, tree):
+        """处理整个模块，返回处理后的AST"""
+        self.report = []
+        if any(isinstance(node, ast.Name) and node.id in DYNAMIC_NAMES for node in ast.walk(tree)):
+            return tree
+        if any(isinstance(node, ast.Name) and node.id == 'dir' for node in ast.walk(tree)):
+            return tree
+
+        self.taken = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} | \
+                     {node.name for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.ClassDef))}
+        self.exports = self._explicit_exports(tree)
+
+        runs = self._find_runs(tree.body)
+        if not runs:
+            return tree
+
+        body = []
+        position = 0
+        for start, end in runs:
+            body.extend(tree.body[position:start])
+            others = tree.body[:start] + tree.body[end:]
+            body.extend(self._wrap_run(tree.body[start:end], others))
+            position = end
+        body.extend(tree.body[position:])
+        tree.body = body
+        return tree
+
+    def _explicit_exports(self, tree):
+        """模块中以常量列表/元组定义的__all__，没有时返回None"""
+        for stmt in tree.body:
+            if (isinstance(stmt, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '__all__'
+                                                     for t in stmt.targets)
+                    and isinstance(stmt.value, (ast.List, ast.Tuple))
+                    and all(isinstance(e, ast.Constant) and isinstance(e.value, str)
+                            for e in stmt.value.elts)):
+                return {e.value for e in stmt.value.elts}
+        return None
+
+    def _is_exported(self, name):
+        if self.exports is not None:
+            return name in self.exports
+        return not name.startswith('_')
+
+    def _is_movable(self, index, stmt):
+        if isinstance(stmt, TOP_LEVEL_ONLY):
+            return False
+        if index == 0 and isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) \
+                and isinstance(stmt.value.value, str):
+            # 模块文档字符串
+            return False
+        for node in own_scope_nodes([stmt]):
+            if isinstance(node, FORBIDDEN_NODES):
+                return False
+            if isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names):
+                return False
+        return True
+
+    def _has_work(self, stmts):
+        """这段代码中是否有循环或推导式，值得移入函数"""
+        return any(isinstance(node, (ast.For, ast.While) + COMPREHENSIONS) for node in own_scope_nodes(stmts))
+
+    def _find_runs(self, body):
+        """找出连续的可移动顶层语句，返回 (起始下标, 结束下标) 列表"""
+        runs = []
+        start = None
+        for index, stmt in enumerate(body + [None]):
+            if stmt is not None and self._is_movable(index, stmt):
+                if start is None:
+                    start = index
+                continue
+            if start is not None and self._has_work(body[start:index]):
+                runs.append((start, index))
+            start = None
+        return runs
+
+    def _definitely_bound(self, stmts):
+        """直接位于这段代码顶层、执行完后一定已赋值的名称"""
+        names = set()
+        for stmt in stmts:
+            if isinstance(stmt, (ast.Assign, ast.AugAssign)):
+                targets = stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]
+                for target in targets:
+                    names |= {node.id for node in ast.walk(target)
+                              if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)}
+            elif isinstance(stmt, ast.With):
+                for item in stmt.items:
+                    if item.optional_vars is not None:
+                        names |= {node.id for node in ast.walk(item.optional_vars) if isinstance(node, ast.Name)}
+        deleted = {node.id for node in own_scope_nodes(stmts)
+                   if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Del)}
+        return names - deleted
+
+    def _new_name(self):
+        index = 1
+        while f"{self.prefix}{index}" in self.taken:
+            index += 1
+        name = f"{self.prefix}{index}"
+        self.taken.add(name)
+        return name
+
+    def _wrap_run(self, stmts, others):
+        """将一段顶层代码替换为初始化函数定义和调用"""
+        bound = set(scope_bindings(stmts))
+        # 其他顶层语句和函数中使用的名称，以及本段代码中函数、lambda、类引用的名称必须是全局变量
+        shared = module_level_names(others)
+        for scope in nested_scopes(stmts):
+            if not isinstance(scope, COMPREHENSIONS):
+                shared |= global_references(scope)
+
+        definite = self._definitely_bound(stmts)
+        global_names = {name for name in bound
+                        if name in shared or name.startswith('__')
+                        or (self._is_exported(name) and name not in definite)}
+        local_names = bound - global_names
+        write_back = sorted(name for name in local_names if self._is_exported(name))
+
+        func_name = self._new_name()
+        func_body = []
+        if global_names:
+            func_body.append(ast.Global(names=sorted(global_names)))
+        func_body.extend(stmts)
+
+        if write_back:
+            if len(write_back) == 1:
+                result = ast.Name(id=write_back[0], ctx=ast.Load())
+                target = ast.Name(id=write_back[0], ctx=ast.Store())
+            else:
+                result = ast.Tuple(elts=[ast.Name(id=n, ctx=ast.Load()) for n in write_back], ctx=ast.Load())
+                target = ast.Tuple(elts=[ast.Name(id=n, ctx=ast.Store()) for n in write_back], ctx=ast.Store())
+            func_body.append(ast.Return(value=result))
+
+        func = ast.FunctionDef(
+            name=func_name,
+            args=ast.arguments(posonlyargs=[], args=[], vararg=None, kwonlyargs=[], kw_defaults=[],
+                               kwarg=None, defaults=[]),
+            body=func_body,
+            decorator_list=[],
+            returns=None,
+            type_comment=None,
+            **({'type_params': []} if 'type_params' in ast.FunctionDef._fields else {})
+        )
+        call = ast.Call(func=ast.Name(id=func_name, ctx=ast.Load()), args=[], keywords=[])
+        invoke = ast.Assign(targets=[target], value=call) if write_back else ast.Expr(value=call)
+
+        ast.copy_location(func, stmts[0])
+        ast.copy_location(invoke, stmts[-1])
+        self.report.append((stmts[0].lineno, len(stmts), sorted(global_names), write_back,
+                            sorted(local_names - set(write_back))))
+        return [func, invoke]
+
+
+def wrap_module_code(tree):
+    """
+    将模块级代码移入生成的初始化函数
+
+    Returns:
+        (处理后的AST, 每段被移动代码的记录列表)
+    """
+    wrapper = ModuleCodeWrapper()
+    tree = wrapper.wrap(tree)
+    ast.fix_missing_locations(tree)
+    return tree, wrapper.report
+
+
+def format_wrap_report(report):
+    """
+    生成模块级代码移动报告
+
+    Returns:
+        报告文本行列表
+    """
+    if not report:
+        return ["  无"]
+    lines = []
+    for lineno, count, global_names, write_back, local_names in report:
+        lines.append(f"  第{lineno}行起 {count} 条语句: 全局 {', '.join(global_names) or '无'}; "
+                     f"写回 {', '.join(write_back) or '无'}; 局部 {', '.join(local_names) or '无'}")
+    return lines
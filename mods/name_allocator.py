@@ -0,0 +1,151 @@
+import ast
+import builtins
+import itertools
+import keyword
+import string
+
+
+NAMING_STRATEGIES = ('random', 'short')
+
+_FIRST_CHARS = string.ascii_letters
+_REST_CHARS = string.ascii_letters + string.digits + '_'
+
+# 节点类型 -> 保存单个标识符的字段
+_NAME_FIELDS = {
+    ast.Name: ('id',),
+    ast.FunctionDef: ('name',),
+    ast.AsyncFunctionDef: ('name',),
+    ast.ClassDef: ('name',),
+    ast.arg: ('arg',),
+    ast.keyword: ('arg',),
+    ast.Attribute: ('attr',),
+    ast.ExceptHandler: ('name',),
+    ast.MatchAs: ('name',),
+    ast.MatchStar: ('name',),
+    ast.MatchMapping: ('rest',),
+    ast.alias: ('name', 'asname'),
+}
+if hasattr(ast, 'TypeVar'):
+    for _node_type in (ast.TypeVar, ast.ParamSpec, ast.TypeVarTuple):
+        _NAME_FIELDS[_node_type] = ('name',)
+# 节点类型 -> 保存标识符列表的字段
+_LIST_FIELDS = {
+    ast.Global: 'names',
+    ast.Nonlocal: 'names',
+    ast.MatchClass: 'kwd_attrs',
+}
+
+
+def shortest_identifiers(reserved):
+    """
+    按长度递增、同长度按字母表顺序枚举标识符，跳过关键字、内置名称和reserved中的名称
+
+    只枚举一次，产生的名称互不相同，分配时不需要重试。
+    """
+    excluded = set(reserved) | set(dir(builtins))
+    for length in itertools.count(1):
+        for chars in itertools.product(_FIRST_CHARS, *[_REST_CHARS] * (length - 1)):
+            name = ''.join(chars)
+            if name not in excluded and not keyword.iskeyword(name):
+                yield name
+
+
+def count_identifiers(tree, counts=None):
+    """
+    统计AST中每个标识符的出现次数，点分的导入名按各部分分别统计
+
+    Args:
+        tree: 任意AST节点
+        counts: 在已有的统计结果上累加
+
+    Returns:
+        标识符 -> 出现次数
+    """
+    counts = {} if counts is None else counts
+    for node in ast.walk(tree):
+        fields = _NAME_FIELDS.get(type(node))
+        if fields is not None:
+            for field in fields:
+                value = getattr(node, field)
+                if value:
+                    for part in value.split('.'):
+                        counts[part] = counts.get(part, 0) + 1
+        elif type(node) in _LIST_FIELDS:
+            for value in getattr(node, _LIST_FIELDS[type(node)]):
+                counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+def allocate_names(counts, candidates, reserved):
+    """
+    为候选名称分配最短的新名称，引用次数最多的名称最先分配
+
+    Args:
+        counts: 标识符 -> 出现次数
+        candidates: 需要分配新名称的标识符，次数相同时按此顺序
+        reserved: 新名称不能使用的标识符
+
+    Returns:
+        原名称 -> 新名称
+    """
+    ranked = sorted(candidates, key=lambda name: -counts.get(name, 0))
+    return dict(zip(ranked, shortest_identifiers(reserved)))
+
+
+def rename_identifiers(tree, mapping):
+    """把AST中所有出现在mapping中的标识符替换为新名称，不产生新节点"""
+    for node in ast.walk(tree):
+        fields = _NAME_FIELDS.get(type(node))
+        if fields is not None:
+            for field in fields:
+                value = getattr(node, field)
+                if value in mapping:
+                    setattr(node, field, mapping[value])
+        elif type(node) in _LIST_FIELDS:
+            values = getattr(node, _LIST_FIELDS[type(node)])
+            values[:] = [mapping.get(value, value) for value in values]
+    return tree
+
+
+def shorten_names(tree, generated):
+    """
+    把混淆过程生成的随机名称替换为最短的未使用标识符
+
+    生成的名称在文件中唯一，每个名称的所有出现都是同一个符号，因此整体替换不改变语义。
+    新名称避开文件中其余的所有标识符(包括属性名和关键字参数名)、关键字和内置名称。
+
+    Args:
+        tree: 混淆后的模块AST
+        generated: 生成的随机名称
+
+    Returns:
+        (AST, 随机名称 -> 新名称, 统计信息)
+    """
+    counts = count_identifiers(tree)
+    candidates = [name for name in dict.fromkeys(generated) if name in counts]
+    reserved = set(counts).difference(candidates)
+    mapping = allocate_names(counts, candidates, reserved)
+    rename_identifiers(tree, mapping)
+
+    report = {
+        'names': len(mapping),
+        'references': sum(counts[name] for name in mapping),
+        'source_before': sum(len(name) * counts[name] for name in mapping),
+        'source_after': sum(len(new) * counts[name] for name, new in mapping.items()),
+        'unique_before': sum(len(name) for name in mapping),
+        'unique_after': sum(len(new) for new in mapping.values()),
+    }
+    return tree, mapping, report
+
+
+def format_naming_report(report):
+    """把shorten_names的统计信息格式化为文本行"""
+    if not report or not report['names']:
+        return ["  没有需要缩短的名称"]
+    return [
+        f"  {report['names']} 个名称, {report['references']} 处引用",
+        f"  源代码中的标识符: {report['source_before']} -> {report['source_after']} 字节, "
+        f"减少 {report['source_before'] - report['source_after']} 字节",
+        f"  不同名称的总长度(co_names/co_varnames和驻留字符串): "
+        f"{report['unique_before']} -> {report['unique_after']} 字节",
+    ]
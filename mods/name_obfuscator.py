@@ -3,39 +3,103 @@ import random
 import string
 import keyword
 
+from .scope_index import ScopeIndex, scoped_children
+
+
+def renamable_function(name, is_method):
+    """
+    函数名混淆是否改名该函数定义
+
+    方法通过属性访问调用，无法可靠地找到所有调用处；双下划线名称(如模块级__getattr__)
+    由解释器按名称查找。两者都保留原名。
+    """
+    return not is_method and not (name.startswith('__') and name.endswith('__'))
+
+
+def renamable_functions(tree):
+    """
+    按前序遍历顺序列出函数名混淆会改名的函数名(去重)
+
+    在改名之前一次收集全部定义，使定义之前出现的引用(如调用后面定义的函数)也能改名。
+    """
+    names = {}
+
+    def visit(node, in_class):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.FunctionDef) and renamable_function(child.name, in_class):
+                names.setdefault(child.name)
+            if isinstance(child, ast.ClassDef):
+                visit(child, True)
+            else:
+                visit(child, in_class and not isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)))
+
+    visit(tree, False)
+    return list(names)
+
 
 class FunctionNameObfuscator(ast.NodeTransformer):
     """用于替换函数名的AST转换器类"""
     
-    def __init__(self, prefix='func_', length=8):
+    def __init__(self, prefix='func_', length=8, name_mapping=None, rng=None):
+        """
+        Args:
+            prefix: 新函数名的前缀
+            length: 新函数名随机部分的长度
+            name_mapping: 预先确定的函数名映射(如ProgramIndex给出的整包映射)，
+                          提供时只改名其中的函数，不生成新名称
+            rng: 随机数生成器(random.Random实例)，None表示使用random模块的全局生成器
+        """
         self.prefix = prefix
         self.length = length
-        self.name_mapping = {}
+        self.rng = rng or random
+        self.fixed = name_mapping is not None
+        self.name_mapping = dict(name_mapping) if self.fixed else {}
         self.used_names = set(keyword.kwlist)  # 避免使用Python关键字
+        self.used_names.update(self.name_mapping.values())
+        self._class_body = [False]
         
     def _generate_random_name(self):
         """生成一个随机的函数名"""
         while True:
-            random_str = ''.join(random.choice(string.ascii_lowercase) for _ in range(self.length))
+            random_str = ''.join(self.rng.choice(string.ascii_lowercase) for _ in range(self.length))
             new_name = f"{self.prefix}{random_str}"
 
             if new_name not in self.used_names:
                 self.used_names.add(new_name)
                 return new_name
     
+    def visit_Module(self, node):
+        """先为模块中的所有函数分配新名称，再改名定义和引用"""
+        if not self.fixed:
+            for name in renamable_functions(node):
+                self.name_mapping[name] = self._generate_random_name()
+        self.generic_visit(node)
+        return node
+    
+    def visit_ClassDef(self, node):
+        """类体中直接定义的函数是方法"""
+        self._class_body.append(True)
+        self.generic_visit(node)
+        self._class_body.pop()
+        return node
+    
     def visit_FunctionDef(self, node):
         """访问函数定义节点，替换函数名"""
         original_name = node.name
 
-        if original_name in self.name_mapping:
-            new_name = self.name_mapping[original_name]
-        else:
-            new_name = self._generate_random_name()
-            self.name_mapping[original_name] = new_name
-
-        node.name = new_name
+        if renamable_function(original_name, self._class_body[-1]):
+            if original_name in self.name_mapping:
+                node.name = self.name_mapping[original_name]
+            elif not self.fixed:
+                node.name = self.name_mapping[original_name] = self._generate_random_name()
 
+        return self.visit_AsyncFunctionDef(node)
+    
+    def visit_AsyncFunctionDef(self, node):
+        """async函数保留原名，其中定义的函数不是方法"""
+        self._class_body.append(False)
         self.generic_visit(node)
+        self._class_body.pop()
         return node
     
     def visit_Name(self, node):
@@ -55,100 +119,133 @@ class FunctionNameObfuscator(ast.NodeTransformer):
 
 
 class VariableNameObfuscator(ast.NodeTransformer):
-    """用于替换变量名的AST转换器类"""
+    """
+    用于替换变量名的AST转换器类
+
+    哪些名称可以改名由ScopeIndex(基于symtable)按作用域给出，每个Name节点只查找一次
+    当前作用域的集合。同名变量在所有作用域中使用同一个新名称。
+    """
     
-    def __init__(self, prefix='var_', length=8):
+    def __init__(self, prefix='var_', length=8, skip_functions=None, index=None, rng=None):
+        """
+        Args:
+            prefix: 新变量名前缀
+            length: 新变量名随机部分的长度
+            skip_functions: 不做变量名混淆的函数定义行号
+            index: 预先构建的ScopeIndex，None表示访问模块时由AST构建
+            rng: 随机数生成器(random.Random实例)，None表示使用random模块的全局生成器
+        """
         self.prefix = prefix
         self.length = length
+        self.rng = rng or random
+        self.skip_functions = skip_functions or set()  # 不做变量名混淆的函数定义行号
         self.name_mapping = {}
         self.used_names = set(keyword.kwlist)  # 避免使用Python关键字
         self.builtin_names = set(__builtins__)  # 避免使用内置函数名
-        self.function_names = set()  # 存储函数名，避免混淆
-        self.current_function_args = set()  # 当前函数的参数名集合
-        self.module_level_names = set()  # 模块级别的变量名集合
+        self.index = None
+        self._names = frozenset()  # 当前作用域中可以改名的变量名
+        if index is not None:
+            self.use_index(index)
+    
+    def use_index(self, index):
+        """使用作用域索引，新名称避开文件中已有的所有标识符"""
+        self.index = index
+        self.used_names |= index.identifiers
         
     def _generate_random_name(self):
         """生成一个随机的变量名"""
         while True:
-            random_str = ''.join(random.choice(string.ascii_lowercase) for _ in range(self.length))
+            random_str = ''.join(self.rng.choice(string.ascii_lowercase) for _ in range(self.length))
             new_name = f"{self.prefix}{random_str}"
 
-            if new_name not in self.used_names and new_name not in self.builtin_names and new_name not in self.function_names:
+            if new_name not in self.used_names and new_name not in self.builtin_names:
                 self.used_names.add(new_name)
                 return new_name
     
-    def visit_Import(self, node):
-        """处理import语句"""
-        for name in node.names:
-            self.module_level_names.add(name.name)
-            if name.asname:
-                self.module_level_names.add(name.asname)
+    def _rename(self, name):
+        """返回变量的新名称，第一次遇到时生成"""
+        new_name = self.name_mapping.get(name)
+        if new_name is None:
+            new_name = self.name_mapping[name] = self._generate_random_name()
+        return new_name
+    
+    def visit_Module(self, node):
+        """构建作用域索引后处理模块，模块级名称不改名"""
+        if self.index is None:
+            self.use_index(ScopeIndex(node, skip_functions=self.skip_functions))
+        self.generic_visit(node)
         return node
     
-    def visit_ImportFrom(self, node):
-        """处理from ... import语句"""
-        for name in node.names:
-            self.module_level_names.add(name.name)
-            if name.asname:
-                self.module_level_names.add(name.asname)
+    def _visit_scope(self, node):
+        """按作用域切换可以改名的名称集合，参数默认值、装饰器等仍在外层作用域中处理"""
+        outer = self._names
+        for child, names in scoped_children(node, self.index.names(node, outer), outer):
+            self._names = names
+            self.visit(child)
+        self._names = outer
+        return node
+    
+    def visit_FunctionDef(self, node):
+        """处理函数定义，跳过的函数整体保持原变量名"""
+        if node.lineno in self.skip_functions:
+            return node
+        return self._visit_scope(node)
+    
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_Lambda = visit_ClassDef = _visit_scope
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _visit_scope
+    
+    def visit_Name(self, node):
+        """访问名称节点，只替换当前作用域中可以改名的变量"""
+        if node.id in self._names:
+            node.id = self._rename(node.id)
         return node
     
-    def visit_Assign(self, node):
-        """处理赋值语句，记录模块级别的变量名"""
-        if not self.current_function_args:  # 在模块级别
-            for target in node.targets:
-                if isinstance(target, ast.Name):
-                    self.module_level_names.add(target.id)
+    def visit_ExceptHandler(self, node):
+        """except ... as 绑定的名称"""
+        if node.name in self._names:
+            node.name = self._rename(node.name)
         self.generic_visit(node)
         return node
     
-    def visit_FunctionDef(self, node):
-        """处理函数定义，记录函数名和参数名"""
-        self.function_names.add(node.name)
-        
-        # 保存当前函数的参数名
-        old_args = self.current_function_args
-        self.current_function_args = {arg.arg for arg in node.args.args}
-        
-        # 处理函数体
+    def visit_Nonlocal(self, node):
+        """nonlocal声明的外层局部变量"""
+        node.names = [self._rename(name) if name in self._names else name for name in node.names]
+        return node
+    
+    def visit_MatchAs(self, node):
+        """match语句中捕获的名称"""
+        if node.name in self._names:
+            node.name = self._rename(node.name)
         self.generic_visit(node)
-        
-        # 恢复之前的参数名集合
-        self.current_function_args = old_args
         return node
     
-    def visit_Name(self, node):
-        """访问名称节点，只替换变量名"""
-        # 只处理变量赋值和使用的场景
-        if isinstance(node.ctx, (ast.Store, ast.Load)):
-            # 跳过内置函数、关键字、函数名、函数参数和模块级别的变量
-            if (node.id in keyword.kwlist or 
-                node.id in self.builtin_names or 
-                node.id in self.function_names or
-                node.id in self.current_function_args or
-                node.id in self.module_level_names):
-                return node
-                
-            if node.id in self.name_mapping:
-                node.id = self.name_mapping[node.id]
-            else:
-                new_name = self._generate_random_name()
-                self.name_mapping[node.id] = new_name
-                node.id = new_name
+    visit_MatchStar = visit_MatchAs
+    
+    def visit_MatchMapping(self, node):
+        """match映射模式中捕获剩余键值的名称"""
+        if node.rest in self._names:
+            node.rest = self._rename(node.rest)
+        self.generic_visit(node)
         return node
 
 
-def obfuscate_function_names(tree):
-    """对AST进行函数名混淆处理"""
-    obfuscator = FunctionNameObfuscator()
+def obfuscate_function_names(tree, name_mapping=None, rng=None):
+    """对AST进行函数名混淆处理，name_mapping为预先确定的函数名映射，rng为随机数生成器"""
+    obfuscator = FunctionNameObfuscator(name_mapping=name_mapping, rng=rng)
     transformed_tree = obfuscator.visit(tree)
     ast.fix_missing_locations(transformed_tree)
     return transformed_tree, obfuscator.name_mapping
 
 
-def obfuscate_variable_names(tree):
-    """对AST进行变量名混淆处理"""
-    obfuscator = VariableNameObfuscator()
+def obfuscate_variable_names(tree, skip_functions=None, index=None, rng=None):
+    """
+    对AST进行变量名混淆处理，skip_functions中的函数(定义行号)保持原变量名
+
+    index为None时由当前AST构建作用域索引；函数名混淆只改动函数名，可以在它之前
+    用原始源代码构建索引，省去重新生成源代码。rng为随机数生成器。
+    """
+    obfuscator = VariableNameObfuscator(skip_functions=skip_functions, index=index, rng=rng)
+    # 只修改名称，不产生新节点，无需补全位置信息
     transformed_tree = obfuscator.visit(tree)
-    ast.fix_missing_locations(transformed_tree)
     return transformed_tree, obfuscator.name_mapping 
\ No newline at end of file
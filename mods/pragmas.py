@@ -0,0 +1,211 @@
+import ast
+import io
+import re
+import tokenize
+
+
+# 混淆级别: full完整混淆, light只重命名且减少NOP, none跳过平坦化、变量名混淆和NOP插入
+LEVELS = ('full', 'light', 'none')
+
+PRAGMA_PATTERN = re.compile(r'#\s*obf:\s*level\s*=\s*(\w+)')
+MARKER_NAME = 'obfuscation'
+MARKER_MODULE = 'mods.pragmas'
+
+
+def obfuscation(level='light'):
+    """
+    在源代码中标记函数的混淆级别，运行时不做任何事情
+
+    混淆流水线会识别并删除该装饰器及其导入语句:
+
+        from mods.pragmas import obfuscation
+
+        @obfuscation(level='none')
+        def hot_path(data):
+            ...
+    """
+    if level not in LEVELS:
+        raise ValueError(f"未知的混淆级别: {level}")
+
+    def decorator(func):
+        return func
+    return decorator
+
+
+def collect_comment_pragmas(source_code):
+    """
+    收集源代码中的 # obf: level=... 注释
+
+    Returns:
+        行号 -> 混淆级别
+    """
+    pragmas = {}
+    try:
+        tokens = tokenize.generate_tokens(io.StringIO(source_code).readline)
+        for token in tokens:
+            if token.type == tokenize.COMMENT:
+                match = PRAGMA_PATTERN.match(token.string)
+                if match:
+                    pragmas[token.start[0]] = _check_level(match.group(1))
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return pragmas
+
+
+def _check_level(level):
+    if level not in LEVELS:
+        raise ValueError(f"未知的混淆级别: {level}")
+    return level
+
+
+def _dotted_name(node):
+    """a.b.c形式的名称或属性访问链对应的点分名称，其他表达式返回None"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = _dotted_name(node.value)
+        return None if base is None else f"{base}.{node.attr}"
+    return None
+
+
+def _marker_bindings(alias, module):
+    """
+    导入别名绑定的局部名称和通过它引用标记时的点分写法
+
+    Returns:
+        (局部名称, 装饰器中标记的点分名称)，导入与标记无关时返回None
+    """
+    if module is None:
+        # import mods.pragmas [as p]
+        if alias.name != MARKER_MODULE:
+            return None
+        if alias.asname:
+            return alias.asname, f"{alias.asname}.{MARKER_NAME}"
+        return alias.name.split('.')[0], f"{MARKER_MODULE}.{MARKER_NAME}"
+    if module == MARKER_MODULE and alias.name == MARKER_NAME:
+        # from mods.pragmas import obfuscation [as obf]
+        local = alias.asname or alias.name
+        return local, local
+    if f"{module}.{alias.name}" == MARKER_MODULE:
+        # from mods import pragmas [as p]
+        local = alias.asname or alias.name
+        return local, f"{local}.{MARKER_NAME}"
+    return None
+
+
+class PragmaStripper(ast.NodeTransformer):
+    """识别并删除混淆级别装饰器，记录每个函数的混淆级别"""
+
+    def __init__(self, comment_pragmas=None):
+        self.comment_pragmas = comment_pragmas or {}
+        self.levels = {}  # 函数定义行号 -> 混淆级别
+        self.markers = {}  # 装饰器中标记的点分名称 -> 绑定它的局部名称
+        self.removable = set()  # 只被标记装饰器引用、可以连同导入一起删除的局部名称
+
+    def visit_Module(self, node):
+        # 先收集导入绑定的标记名称，再统计每个局部名称在标记装饰器之外是否还被引用
+        for stmt in ast.walk(node):
+            if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+                module = stmt.module if isinstance(stmt, ast.ImportFrom) and not stmt.level else None
+                if isinstance(stmt, ast.ImportFrom) and module is None:
+                    continue
+                for alias in stmt.names:
+                    binding = _marker_bindings(alias, module)
+                    if binding:
+                        self.markers[binding[1]] = binding[0]
+
+        uses = {}
+        marker_uses = {}
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                uses[child.id] = uses.get(child.id, 0) + 1
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                for decorator in child.decorator_list:
+                    if isinstance(decorator, ast.Call) and _dotted_name(decorator.func) in self.markers:
+                        local = self.markers[_dotted_name(decorator.func)]
+                        marker_uses[local] = marker_uses.get(local, 0) + 1
+        self.removable = {local for local in self.markers.values() if uses.get(local, 0) == marker_uses.get(local, 0)}
+        return self.generic_visit(node)
+
+    def generic_visit(self, node):
+        # 删除导入后变为空的语句块补上pass
+        filled = [field for field in ('body', 'orelse', 'finalbody')
+                   if isinstance(getattr(node, field, None), list) and getattr(node, field)]
+        first = {field: getattr(node, field)[0] for field in filled}
+        node = super().generic_visit(node)
+        for field in filled:
+            if not getattr(node, field):
+                setattr(node, field, [ast.copy_location(ast.Pass(), first[field])])
+        return node
+
+    def _marker_level(self, decorator):
+        """装饰器是混淆级别标记时返回级别，否则返回None"""
+        if not isinstance(decorator, ast.Call) or _dotted_name(decorator.func) not in self.markers:
+            return None
+
+        level = 'light'
+        if decorator.args:
+            level = decorator.args[0].value if isinstance(decorator.args[0], ast.Constant) else None
+        for keyword in decorator.keywords:
+            if keyword.arg == 'level':
+                level = keyword.value.value if isinstance(keyword.value, ast.Constant) else None
+        if level is None:
+            raise ValueError("混淆级别标记只支持常量参数")
+        return _check_level(level)
+
+    def _visit_function(self, node):
+        # 注释写在def行末尾，或写在def/第一个装饰器的上一行
+        first_line = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        for line in (node.lineno, first_line - 1):
+            if line in self.comment_pragmas:
+                self.levels[node.lineno] = self.comment_pragmas[line]
+                break
+
+        decorators = []
+        for decorator in node.decorator_list:
+            level = self._marker_level(decorator)
+            if level is None:
+                decorators.append(decorator)
+            else:
+                self.levels[node.lineno] = level
+        node.decorator_list = decorators
+
+        return self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = _visit_function
+
+    def _strip_aliases(self, node, module):
+        """删除只用于标记的导入别名，全部删除时删除整条语句"""
+        names = []
+        for alias in node.names:
+            binding = _marker_bindings(alias, module)
+            if binding is None or binding[0] not in self.removable:
+                names.append(alias)
+        node.names = names
+        return node if node.names else None
+
+    def visit_ImportFrom(self, node):
+        """删除 from mods.pragmas import obfuscation [as obf] 和 from mods import pragmas"""
+        if node.level or node.module is None:
+            return node
+        return self._strip_aliases(node, node.module)
+
+    def visit_Import(self, node):
+        """删除 import mods.pragmas [as p]"""
+        return self._strip_aliases(node, None)
+
+
+def extract_function_levels(tree, source_code=''):
+    """
+    提取源代码中标记的函数混淆级别，并从AST中删除标记
+
+    Args:
+        tree: 模块AST
+        source_code: 原始源代码，用于识别注释形式的标记
+
+    Returns:
+        (处理后的AST, 函数定义行号 -> 混淆级别)
+    """
+    stripper = PragmaStripper(collect_comment_pragmas(source_code))
+    tree = stripper.visit(tree)
+    return tree, stripper.levels
@@ -0,0 +1,134 @@
+import ast
+import os
+import pstats
+
+from .control_flow import function_flatten_overhead
+
+
+class ProfileGuidedPolicy:
+    """
+    基于cProfile/pstats剖析数据的逐函数混淆策略
+
+    累计耗时占比达到阈值的热点函数只做重命名(light)，其余函数执行完整的
+    平坦化和重命名(full)。
+    """
+
+    def __init__(self, profile_file, hot_threshold=0.1):
+        """
+        Args:
+            profile_file: cProfile输出的.prof/pstats文件
+            hot_threshold: 热点函数的累计耗时占总耗时比例的阈值
+        """
+        self.profile_file = profile_file
+        self.hot_threshold = hot_threshold
+
+        stats = pstats.Stats(profile_file)
+        self.total_time = stats.total_tt or 0.0
+        # (文件名, 行号, 函数名) -> (自身耗时, 累计耗时)
+        self.entries = {
+            key: (tottime, cumtime)
+            for key, (_, _, tottime, cumtime, _) in stats.stats.items()
+        }
+        self.decisions = []
+
+    def _same_file(self, profiled_file, filename):
+        """判断剖析数据中的文件是否就是当前混淆的文件"""
+        if filename is None or filename.startswith('<'):
+            # '<string>'等不是真实路径的文件名只匹配剖析数据中完全相同的文件名
+            return profiled_file == filename
+        if os.path.exists(profiled_file) and os.path.exists(filename):
+            return os.path.realpath(profiled_file) == os.path.realpath(filename)
+        return os.path.basename(profiled_file) == os.path.basename(filename)
+
+    def _function_times(self, filename):
+        """当前文件中每个函数的耗时: (首行号, 函数名) -> (自身耗时, 累计耗时)"""
+        times = {}
+        for (profiled_file, lineno, name), value in self.entries.items():
+            if self._same_file(profiled_file, filename):
+                times[(lineno, name)] = value
+        return times
+
+    def _functions(self, node, owner=None):
+        """
+        遍历模块中的所有函数
+
+        Yields:
+            (函数定义节点, 所属作用域节点)，模块级函数的所属作用域为None
+        """
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                yield child, owner
+                yield from self._functions(child, child)
+            elif isinstance(child, ast.ClassDef):
+                yield from self._functions(child, child)
+            else:
+                yield from self._functions(child, owner)
+
+    def function_levels(self, tree, filename=None, flattener=None):
+        """
+        为模块中的每个函数确定混淆级别
+
+        Args:
+            tree: 尚未重命名的模块AST
+            filename: 被混淆的源文件
+            flattener: 实际使用的CodeFlattener，用于判断函数在其平坦化范围内是否会被处理；
+                       None表示不做平坦化
+
+        Returns:
+            函数定义行号 -> 'full' 或 'light'
+        """
+        times = self._function_times(filename)
+        levels = {}
+        self.decisions = []
+        top_level = {id(stmt) for stmt in tree.body}
+
+        for node, owner in self._functions(tree):
+            # 代码对象的首行号是第一个装饰器所在行
+            first_line = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            tottime, cumtime = times.get((first_line, node.name), (0.0, 0.0))
+            share = cumtime / self.total_time if self.total_time else 0.0
+            level = 'light' if share >= self.hot_threshold else 'full'
+            levels[node.lineno] = level
+            self.decisions.append({
+                'name': node.name,
+                'lineno': node.lineno,
+                'level': level,
+                'tottime': tottime,
+                'cumtime': cumtime,
+                'share': share,
+                'overhead': function_flatten_overhead(node),
+                'flattened': flattener is not None and flattener.would_flatten(node, owner, id(node) in top_level),
+            })
+        return levels
+
+    def summary(self):
+        """
+        生成与统一混淆相比预计节省的开销摘要
+
+        每个函数的平坦化开销按其自身耗时乘以静态估算的开销比例计算，只统计
+        在当前平坦化范围内会被处理的函数。
+
+        Returns:
+            摘要文本行列表
+        """
+        flattened = [d for d in self.decisions if d['flattened']]
+        uniform = sum(d['tottime'] * d['overhead'] for d in flattened)
+        guided = sum(d['tottime'] * d['overhead'] for d in flattened if d['level'] == 'full')
+
+        lines = [f"剖析文件: {self.profile_file} (总耗时 {self.total_time * 1000:.1f} ms, "
+                 f"热点阈值 {self.hot_threshold:.0%})"]
+        for d in sorted(self.decisions, key=lambda d: d['cumtime'], reverse=True):
+            if not d['flattened']:
+                policy = '不在平坦化范围内'
+            else:
+                policy = '仅重命名' if d['level'] == 'light' else '平坦化+重命名'
+            lines.append(f"  {d['name']} (第{d['lineno']}行): 累计 {d['cumtime'] * 1000:.1f} ms "
+                         f"({d['share']:.1%}), 自身 {d['tottime'] * 1000:.1f} ms, "
+                         f"平坦化开销约 {d['overhead']:.0%} -> {policy}")
+
+        base = self.total_time or 1.0
+        lines.append(f"统一混淆预计额外耗时: {uniform * 1000:.2f} ms ({uniform / base:.1%})")
+        lines.append(f"按剖析结果混淆预计额外耗时: {guided * 1000:.2f} ms ({guided / base:.1%})")
+        lines.append(f"预计节省: {(uniform - guided) * 1000:.2f} ms ({(uniform - guided) / base:.1%})")
+        return lines
+
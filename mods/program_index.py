@@ -0,0 +1,227 @@
+import ast
+import os
+
+from .name_allocator import allocate_names, count_identifiers
+from .name_obfuscator import FunctionNameObfuscator, renamable_function
+
+
+def find_python_files(root):
+    """按文件名排序递归列出目录下的所有Python文件，跳过隐藏目录和__pycache__"""
+    files = []
+    for directory, dirs, names in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+        files.extend(os.path.join(directory, name) for name in sorted(names) if name.endswith('.py'))
+    return files
+
+
+def _dotted(node):
+    """a.b.c形式的属性访问链对应的点分名称，其他表达式返回None"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = _dotted(node.value)
+        return None if base is None else f"{base}.{node.attr}"
+    return None
+
+
+class _DefinitionCollector(ast.NodeVisitor):
+    """收集一个模块中可以改名的函数定义、导入和__all__中列出的名称"""
+
+    def __init__(self):
+        self.functions = []     # 可以改名的函数名(不含方法)，按出现顺序
+        self.exported = set()   # 模块顶层定义、可以被其他模块导入的函数名
+        self.public = set()     # __all__中列出的名称
+        self.imports = []       # ast.Import和ast.ImportFrom节点
+        self._class_body = [False]
+        self._depth = 0
+
+    def visit_ClassDef(self, node):
+        self._class_body.append(True)
+        self._depth += 1
+        self.generic_visit(node)
+        self._depth -= 1
+        self._class_body.pop()
+
+    def visit_FunctionDef(self, node):
+        if renamable_function(node.name, self._class_body[-1]):
+            if node.name not in self.functions:
+                self.functions.append(node.name)
+            if self._depth == 0:
+                self.exported.add(node.name)
+        self.visit_AsyncFunctionDef(node)
+
+    def visit_AsyncFunctionDef(self, node):
+        self._class_body.append(False)
+        self._depth += 1
+        self.generic_visit(node)
+        self._depth -= 1
+        self._class_body.pop()
+
+    def visit_Import(self, node):
+        self.imports.append(node)
+
+    visit_ImportFrom = visit_Import
+
+    def visit_Assign(self, node):
+        if self._depth == 0 and any(isinstance(t, ast.Name) and t.id == '__all__' for t in node.targets):
+            if isinstance(node.value, (ast.List, ast.Tuple)):
+                self.public.update(elt.value for elt in node.value.elts
+                                   if isinstance(elt, ast.Constant) and isinstance(elt.value, str))
+        self.generic_visit(node)
+
+
+class ProgramIndex:
+    """
+    整个源代码树的函数符号索引
+
+    分析阶段解析目录下的每个文件一次，为所有可以改名的函数(模块级函数和嵌套函数，
+    不含方法、双下划线名称和任何模块__all__中列出的名称)分配一个全局一致的新名称，
+    并记录每个模块从树内其他模块导入的函数和模块别名。逐文件混淆时只读取索引:
+    文件中定义或从树内导入的函数使用同一个新名称，from-import的导入名和
+    模块别名.函数名形式的属性访问一起改写，因此整个包可以并行混淆而不破坏导入。
+
+    索引只包含字典和集合，可以序列化后传给工作进程。
+    """
+
+    def __init__(self, root, prefix='func_', length=8, naming='random', rng=None):
+        """
+        Args:
+            root: 源代码树的根目录；根目录本身有__init__.py时模块名以目录名开头
+            prefix: 新函数名的前缀
+            length: 新函数名随机部分的长度
+            naming: 'random'使用前缀加随机字母；'short'按整个树中的引用次数分配最短的标识符，
+                    新名称避开树中出现的所有标识符
+            rng: 生成随机名称使用的随机数生成器，None表示使用random模块的全局生成器
+        """
+        self.root = os.path.abspath(root)
+        self.modules = {}        # 绝对路径 -> 模块名
+        self.packages = set()    # 由__init__.py定义的包名
+        self.exported = {}       # 模块名 -> 可以被导入并改名的顶层函数名
+        self.name_mapping = {}   # 原函数名 -> 新函数名，整个树共用
+        self.file_mappings = {}  # 模块名 -> 该模块中需要改名的名称 -> 新函数名
+        self.aliases = {}        # 模块名 -> 局部名称 -> 树内模块名
+        self.errors = []         # (文件, 错误信息)
+
+        prefix_parts = [os.path.basename(self.root)] if os.path.exists(os.path.join(self.root, '__init__.py')) else []
+        collected = {}
+        counts = {}  # 整个树中每个标识符的出现次数，只在naming='short'时统计
+        for path in find_python_files(self.root):
+            parts = prefix_parts + os.path.relpath(path, self.root)[:-3].split(os.sep)
+            if parts[-1] == '__init__':
+                parts.pop()
+                self.packages.add('.'.join(parts))
+            module = '.'.join(parts)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    tree = ast.parse(f.read(), path)
+            except (SyntaxError, ValueError, UnicodeDecodeError) as e:
+                self.errors.append((path, str(e)))
+                continue
+            self.modules[path] = module
+            collected[module] = _DefinitionCollector()
+            collected[module].visit(tree)
+            if naming == 'short':
+                count_identifiers(tree, counts)
+
+        public = set().union(*(c.public for c in collected.values()))
+        candidates = [name for collector in collected.values() for name in collector.functions if name not in public]
+        if naming == 'short':
+            # 原函数名也可能在别处作为变量名保留，同样不能作为新名称
+            self.name_mapping = allocate_names(counts, dict.fromkeys(candidates), set(counts))
+        else:
+            generator = FunctionNameObfuscator(prefix, length, rng=rng)
+            for name in candidates:
+                if name not in self.name_mapping:
+                    self.name_mapping[name] = generator._generate_random_name()
+        for module, collector in collected.items():
+            self.exported[module] = frozenset(name for name in collector.exported if name in self.name_mapping)
+
+        for module, collector in collected.items():
+            names = [name for name in collector.functions if name in self.name_mapping]
+            self.aliases[module] = {}
+            for node in collector.imports:
+                names.extend(self._scan_import(module, node))
+            self.file_mappings[module] = {name: self.name_mapping[name] for name in dict.fromkeys(names)}
+
+    def module_for(self, filename):
+        """文件对应的模块名，不在索引中时返回None"""
+        return self.modules.get(os.path.abspath(filename))
+
+    def resolve_import(self, module, node):
+        """ImportFrom节点导入的模块的绝对名称"""
+        if node.level == 0:
+            return node.module
+        base = module.split('.') if module in self.packages else module.split('.')[:-1]
+        base = base[:len(base) - (node.level - 1)] if node.level > 1 else base
+        return '.'.join(base + ([node.module] if node.module else []))
+
+    def _scan_import(self, module, node):
+        """记录模块别名，返回导入语句绑定的、需要改名的函数名"""
+        aliases = self.aliases[module]
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    if alias.name in self.exported:
+                        aliases[alias.asname] = alias.name
+                else:
+                    head = alias.name.split('.')[0]
+                    if head in self.exported:
+                        aliases[head] = head
+            return []
+
+        source = self.resolve_import(module, node)
+        exported = self.exported.get(source, frozenset())
+        bound = []
+        for alias in node.names:
+            if alias.name == '*':
+                bound.extend(name for name in exported if not name.startswith('_'))
+            elif f"{source}.{alias.name}" in self.exported:
+                aliases[alias.asname or alias.name] = f"{source}.{alias.name}"
+            elif alias.name in exported and not alias.asname:
+                bound.append(alias.name)
+        return bound
+
+    def rewrite_imports(self, tree, module):
+        """
+        改写模块中引用树内函数的导入语句和属性访问
+
+        Args:
+            tree: 模块AST，在函数名混淆之前调用
+            module: 模块名
+
+        Returns:
+            改写的节点数
+        """
+        rewriter = _ImportRewriter(self, module)
+        rewriter.visit(tree)
+        return rewriter.count
+
+
+class _ImportRewriter(ast.NodeVisitor):
+    """把from-import的函数名和模块别名上的函数属性改为索引中的新名称"""
+
+    def __init__(self, index, module):
+        self.index = index
+        self.module = module
+        self.aliases = index.aliases.get(module, {})
+        self.count = 0
+
+    def visit_ImportFrom(self, node):
+        exported = self.index.exported.get(self.index.resolve_import(self.module, node), frozenset())
+        for alias in node.names:
+            if alias.name in exported:
+                alias.name = self.index.name_mapping[alias.name]
+                self.count += 1
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        base = _dotted(node.value)
+        if base is None:
+            return
+        head, _, rest = base.partition('.')
+        if head not in self.aliases:
+            return
+        source = self.aliases[head] + ('.' + rest if rest else '')
+        if node.attr in self.index.exported.get(source, ()):
+            node.attr = self.index.name_mapping[node.attr]
+            self.count += 1
@@ -0,0 +1,291 @@
+import ast
+import symtable
+
+from .codegen import generate_source
+
+
+# 作用域内出现这些名称时，局部变量可能按字符串被访问，不能改名
+INTROSPECTION_NAMES = {'locals', 'vars', 'eval', 'exec'}
+
+# 推导式节点 -> symtable中的作用域名称
+COMPREHENSION_TABLES = {
+    ast.ListComp: 'listcomp',
+    ast.SetComp: 'setcomp',
+    ast.DictComp: 'dictcomp',
+    ast.GeneratorExp: 'genexpr',
+}
+# Python 3.12+ 将这些推导式内联到外层作用域，不再有单独的符号表
+INLINED_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp)
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef) + tuple(COMPREHENSION_TABLES)
+
+
+def scope_key(node):
+    """作用域节点对应的符号表类型和名称，匿名作用域使用去掉尖括号的symtable名称"""
+    if isinstance(node, ast.ClassDef):
+        return 'class', node.name
+    if isinstance(node, ast.Lambda):
+        return 'function', 'lambda'
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return 'function', node.name
+    return 'function', COMPREHENSION_TABLES[type(node)]
+
+
+def _line_key(node):
+    """
+    按行号对应符号表时作用域节点的键: (作用域种类, 行号)
+
+    不使用函数名，使函数名混淆之后仍能找到对应的符号表。同一行上不可能有两个
+    def或class语句，只有lambda和推导式可能重复。
+    """
+    if isinstance(node, ast.ClassDef):
+        return 'class', node.lineno
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return 'def', node.lineno
+    return scope_key(node)[1], node.lineno
+
+
+def _table_line_key(table):
+    """符号表的(作用域种类, 行号)，推导式的符号表以隐式参数.0区分于同名函数"""
+    kind = table.get_type()
+    if kind == 'function':
+        name = table.get_name().strip('<>')
+        if name == 'lambda' or (name in COMPREHENSION_TABLES.values() and '.0' in table.get_identifiers()):
+            kind = name
+        else:
+            kind = 'def'
+    return kind, table.get_lineno()
+
+
+def _annotations(args):
+    """按symtable的访问顺序列出参数注解"""
+    for arg in args.posonlyargs + args.args + [args.vararg] + args.kwonlyargs + [args.kwarg]:
+        if arg is not None and arg.annotation is not None:
+            yield arg.annotation
+
+
+def _symtable_order(node):
+    """
+    按symtable的访问顺序拆分作用域节点的子节点
+
+    Returns:
+        (在外层作用域中求值的子节点, 属于该节点自身作用域的子节点)
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        args = node.args
+        outer = args.defaults + [d for d in args.kw_defaults if d is not None] + list(_annotations(args))
+        if node.returns is not None:
+            outer.append(node.returns)
+        return outer + node.decorator_list, node.body
+    if isinstance(node, ast.ClassDef):
+        return node.bases + [keyword.value for keyword in node.keywords] + node.decorator_list, node.body
+    if isinstance(node, ast.Lambda):
+        return node.args.defaults + [d for d in node.args.kw_defaults if d is not None], [node.body]
+    first, rest = node.generators[0], node.generators[1:]
+    inner = [first.target] + first.ifs
+    for generator in rest:
+        inner += [generator.target, generator.iter] + generator.ifs
+    inner += [node.value, node.key] if isinstance(node, ast.DictComp) else [node.elt]
+    return [first.iter], inner
+
+
+def scoped_children(node, inner, outer):
+    """
+    按ast.iter_child_nodes的顺序遍历作用域节点的子节点，同时给出子节点所在作用域的名称集合
+
+    函数、lambda和类只有body属于自身作用域，参数默认值、注解、装饰器和基类在外层作用域中求值；
+    推导式只有第一个for的可迭代对象在外层作用域中求值。
+
+    Args:
+        node: 作用域节点
+        inner: 节点自身作用域的名称集合
+        outer: 外层作用域的名称集合
+    """
+    if isinstance(node, tuple(COMPREHENSION_TABLES)):
+        first = node.generators[0]
+        for child in ast.iter_child_nodes(node):
+            if child is first:
+                yield first.target, inner
+                yield first.iter, outer
+                for condition in first.ifs:
+                    yield condition, inner
+            else:
+                yield child, inner
+        return
+    for field, value in ast.iter_fields(node):
+        names = inner if field == 'body' else outer
+        for child in value if isinstance(value, list) else [value]:
+            if isinstance(child, ast.AST):
+                yield child, names
+
+
+class ScopeIndex:
+    """
+    基于标准库symtable的作用域索引，每个文件构建一次
+
+    为每个作用域节点(函数、lambda、类、推导式)给出其中可以安全改名的变量名集合，
+    变量名混淆时每个Name节点只需查找一次当前作用域的集合。可以改名的只有函数作用域
+    中的普通局部变量(不含参数、import绑定、函数和类定义名、global声明的名称)，以及
+    内层作用域中引用这些变量的自由变量；模块级名称和类属性总是保留。
+
+    使用locals()/vars()/eval/exec的作用域和跳过变量名混淆的函数不改名，它们引用的
+    外层局部变量在外层作用域中也保留原名。
+
+    给出与AST完全对应的原始源代码时，作用域节点按(作用域种类, 行号)直接对应到符号表，
+    不需要遍历AST；同一行上有多个同种作用域(如两个lambda)时这些作用域不改名。否则由
+    AST重新生成源代码，并按symtable的访问顺序遍历AST逐个对应。
+    """
+
+    def __init__(self, tree, source=None, filename='<string>', skip_functions=None):
+        """
+        Args:
+            tree: 模块AST
+            source: 与tree完全对应(由它解析得到)的源代码，None表示由tree重新生成
+            filename: 文件名，用于symtable报告错误
+            skip_functions: 不做变量名混淆的函数定义行号
+        """
+        self.skip_functions = skip_functions or set()
+        self.identifiers = set()  # 文件中出现的所有标识符，新名称不与它们重复
+        self.aligned = True       # AST与符号表是否一一对应，否则不改名任何变量
+        self.scopes = {}          # id(作用域节点)或(作用域种类, 行号) -> 可以改名的变量名集合
+        self._by_line = source is not None
+        self._parents = {}        # id(符号表) -> 外层符号表
+        self._opaque = set()      # 不改名的作用域的id(符号表)
+
+        table = symtable.symtable(source if source is not None else generate_source(tree), filename, 'exec')
+        if self._by_line:
+            tables = list(self._walk_tables(table))
+            counts = {}
+            for child in tables:
+                counts[_table_line_key(child)] = counts.get(_table_line_key(child), 0) + 1
+            for child in tables:
+                if counts[_table_line_key(child)] > 1:
+                    self._opaque.add(id(child))
+                else:
+                    self._check_opaque(child, child.get_lineno() in self.skip_functions)
+            names = self._resolve(tables)
+            self.scopes = {_table_line_key(child): names[id(child)] for child in tables}
+        else:
+            self._tables_by_node = {}  # id(作用域节点) -> 符号表
+            self._align_scope(tree.body, table)
+            if self.aligned:
+                names = self._resolve(list(self._tables_by_node.values()))
+                self.scopes = {key: names[id(child)] for key, child in self._tables_by_node.items()}
+
+    def names(self, node, outer=frozenset()):
+        """
+        作用域节点中可以改名的变量名
+
+        Args:
+            node: 作用域节点
+            outer: 外层作用域的名称集合，内联的推导式(没有单独的符号表)沿用
+        """
+        if self._by_line:
+            names = self.scopes.get(_line_key(node))
+        else:
+            names = self.scopes.get(id(node))
+        if names is None:
+            return outer if isinstance(node, INLINED_COMPREHENSIONS) else frozenset()
+        return names
+
+    def _walk_tables(self, table):
+        """前序遍历所有子符号表，记录外层符号表和标识符"""
+        self.identifiers.update(table.get_identifiers())
+        for child in table.get_children():
+            self._parents[id(child)] = table
+            yield child
+            yield from self._walk_tables(child)
+
+    def _check_opaque(self, table, skipped):
+        """跳过的函数和使用locals()等内省的函数作用域不改名"""
+        if table.get_type() != 'function':
+            return
+        anonymous = table.get_name().strip('<>') in ('lambda',) + tuple(COMPREHENSION_TABLES.values())
+        if (skipped and not anonymous) or INTROSPECTION_NAMES.intersection(table.get_identifiers()):
+            self._opaque.add(id(table))
+
+    def _align_scope(self, nodes, table):
+        """对应一个作用域中的节点与该符号表的子符号表，子符号表必须恰好用完"""
+        self.identifiers.update(table.get_identifiers())
+        children = list(table.get_children())
+        self._align(nodes, table, children)
+        if children:
+            self.aligned = False
+
+    def _align(self, nodes, table, children):
+        """按symtable的访问顺序把作用域节点依次对应到尚未使用的同名子符号表"""
+        for node in nodes:
+            if not self.aligned:
+                return
+            if not isinstance(node, SCOPE_NODES):
+                self._align(list(ast.iter_child_nodes(node)), table, children)
+                continue
+
+            outer, inner = _symtable_order(node)
+            self._align(outer, table, children)
+            kind, name = scope_key(node)
+            match = next((child for child in children
+                          if child.get_type() == kind and child.get_name().strip('<>') == name), None)
+            if match is None:
+                if isinstance(node, INLINED_COMPREHENSIONS):
+                    self._align(inner, table, children)
+                    continue
+                self.aligned = False
+                return
+
+            children.remove(match)
+            self._tables_by_node[id(node)] = match
+            self._parents[id(match)] = table
+            self._check_opaque(match, isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                               and node.lineno in self.skip_functions)
+            self._align_scope(inner, match)
+
+    def _defining_table(self, table, name):
+        """自由变量所引用的外层函数符号表，引用模块级名称时返回None"""
+        parent = self._parents.get(id(table))
+        while parent is not None and parent.get_type() != 'module':
+            if parent.get_type() == 'function' and name in parent.get_identifiers():
+                symbol = parent.lookup(name)
+                if symbol.is_local():
+                    return parent
+                if not symbol.is_free():
+                    return None
+            parent = self._parents.get(id(parent))
+        return None
+
+    def _resolve(self, tables):
+        """
+        计算每个作用域中可以改名的变量名
+
+        Returns:
+            id(符号表) -> 可以改名的变量名集合
+        """
+        renamable = {}  # id(函数符号表) -> 可以改名的局部变量
+        for table in tables:
+            if table.get_type() == 'function' and id(table) not in self._opaque:
+                renamable[id(table)] = {
+                    symbol.get_name() for symbol in table.get_symbols()
+                    if symbol.is_local() and not (symbol.is_global() or symbol.is_parameter()
+                                                  or symbol.is_imported() or symbol.is_namespace())
+                }
+
+        # 不改名的作用域引用的外层局部变量也必须保留原名
+        for table in tables:
+            if id(table) in self._opaque:
+                for symbol in table.get_symbols():
+                    defining = self._defining_table(table, symbol.get_name()) if symbol.is_free() else None
+                    if defining is not None:
+                        renamable.get(id(defining), set()).discard(symbol.get_name())
+
+        result = {}
+        for table in tables:
+            if id(table) in self._opaque:
+                result[id(table)] = frozenset()
+                continue
+            names = set(renamable.get(id(table), ()))
+            for symbol in table.get_symbols():
+                if symbol.is_free():
+                    defining = self._defining_table(table, symbol.get_name())
+                    if defining is not None and symbol.get_name() in renamable.get(id(defining), ()):
+                        names.add(symbol.get_name())
+            result[id(table)] = frozenset(names)
+        return result
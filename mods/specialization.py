@@ -0,0 +1,302 @@
+import contextlib
+import dis
+import io
+import marshal
+import opcode
+import os
+import sys
+import types
+
+from .complete_obfuscator import CompletePythonObfuscator
+from .bytecode_obfuscator import BytecodeObfuscator
+from .autotune import rename_expression
+
+
+def _specializations():
+    """基础指令名 -> 特化指令名列表"""
+    if hasattr(opcode, '_specializations'):
+        return opcode._specializations
+    try:
+        from _opcode_metadata import _specializations
+    except ImportError:
+        return {}
+    return _specializations
+
+
+SPECIALIZATIONS = _specializations()
+# 特化指令名 -> 基础指令名
+SPECIALIZED_BASE = {name: base for base, names in SPECIALIZATIONS.items() for name in names}
+CACHE_OPCODE = opcode.opmap.get('CACHE')
+
+
+def _cache_entries(op):
+    """指令之后的内联缓存项数"""
+    entries = getattr(opcode, '_inline_cache_entries', None)
+    if entries is None:
+        return 0
+    if isinstance(entries, dict):
+        return entries.get(opcode.opname[op], 0)
+    return entries[op]
+
+
+def iter_code_objects(code):
+    """递归遍历代码对象及其常量中的所有代码对象"""
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from iter_code_objects(const)
+
+
+def check_cache_layout(code):
+    """
+    检查带内联缓存的指令之后是否紧跟对应数量的CACHE项
+
+    在指令与缓存项之间插入NOP会使解释器把NOP当作缓存读写，特化失效；多出的缓存项
+    又会被当作指令执行。co_code中缓存位置的内容会被清零，因此同时检查缓存区之后
+    是否还残留CACHE项。
+
+    Returns:
+        (限定名, 字节偏移, 指令名) 列表
+    """
+    if CACHE_OPCODE is None:
+        return []
+    problems = []
+    for code_obj in iter_code_objects(code):
+        qualname = getattr(code_obj, 'co_qualname', code_obj.co_name)
+        raw = code_obj.co_code
+        i = 0
+        previous = None
+        while i < len(raw):
+            op = raw[i]
+            if op == CACHE_OPCODE:
+                # 指令位置上出现了多余的缓存项
+                problems.append((qualname, previous, opcode.opname[raw[previous]] if previous is not None else 'CACHE'))
+                i += 2
+                continue
+            entries = _cache_entries(op)
+            for k in range(1, entries + 1):
+                if i + 2 * k >= len(raw) or raw[i + 2 * k] != CACHE_OPCODE:
+                    problems.append((qualname, i, opcode.opname[op]))
+                    break
+            previous = i
+            i += 2 * (1 + entries)
+    return problems
+
+
+def quickened_summary(code, executed=None):
+    """
+    统计单个代码对象在自适应解释器中的特化情况
+
+    Args:
+        code: 已执行过的代码对象
+        executed: 执行过的指令字节偏移集合，提供时只统计这些指令；
+                  从未执行的指令(如分发循环末尾的条件判断)不会被特化，不应计入
+
+    Returns:
+        {'warm': 是否已被加速, 'specializable': 带内联缓存的指令数,
+         'specialized': 已特化的指令数, 'missed': 基础指令名 -> 未特化次数}
+    """
+    base = list(dis.get_instructions(code))
+    quickened = list(dis.get_instructions(code, adaptive=True))
+    summary = {'warm': False, 'specializable': 0, 'specialized': 0, 'missed': {}}
+    for plain, quick in zip(base, quickened):
+        if quick.opname != plain.opname:
+            summary['warm'] = True
+        if not _cache_entries(plain.opcode) or plain.opname not in SPECIALIZATIONS:
+            continue
+        if executed is not None and plain.offset not in executed:
+            continue
+        summary['specializable'] += 1
+        if quick.opname in SPECIALIZED_BASE and not quick.opname.endswith('_ADAPTIVE'):
+            summary['specialized'] += 1
+        else:
+            summary['missed'][plain.opname] = summary['missed'].get(plain.opname, 0) + 1
+    return summary
+
+
+def _ratio(summary):
+    if not summary['specializable']:
+        return 1.0
+    return summary['specialized'] / summary['specializable']
+
+
+class SpecializationChecker:
+    """
+    检查混淆后的代码是否妨碍CPython 3.11+自适应解释器的指令特化
+
+    在当前进程中分别执行原始代码、平坦化后的源代码和BytecodeObfuscator生成的代码对象，
+    对基准入口反复求值使函数被加速，然后用 `dis.get_instructions(adaptive=True)`
+    比较每个函数中已特化的指令比例。混淆后比例下降超过容差的函数被标记为丢失特化；
+    同时静态检查字节码中内联缓存的布局是否被NOP打断。
+    """
+
+    def __init__(self, input_file, entry, options=None, calls=100, tolerance=0.05):
+        """
+        Args:
+            input_file: 被混淆的Python文件
+            entry: 样例入口表达式，在模块命名空间中求值，如 "main()"
+            options: 传给CompletePythonObfuscator的混淆选项
+            calls: 入口表达式的求值次数，需足以越过解释器的预热阈值
+            tolerance: 允许的特化比例下降
+        """
+        if sys.version_info < (3, 11):
+            raise RuntimeError("特化检查需要Python 3.11及以上版本")
+        self.input_file = os.path.abspath(input_file)
+        self.entry = entry
+        self.options = dict(options or {})
+        self.calls = calls
+        self.tolerance = tolerance
+        self.source_dir = os.path.dirname(self.input_file)
+        with open(self.input_file, 'r', encoding='utf-8') as f:
+            self.source_code = f.read()
+
+    def _exercise(self, code, entry):
+        """执行模块代码并反复求值入口表达式"""
+        namespace = {'__name__': '__specialize__', '__file__': self.input_file, '__builtins__': __builtins__}
+        entry_code = compile(entry, '<entry>', 'eval')
+        sys.path.insert(0, self.source_dir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                exec(code, namespace)
+                for _ in range(self.calls):
+                    eval(entry_code, namespace)
+        finally:
+            sys.path.remove(self.source_dir)
+
+    def _coverage(self, code, entry):
+        """
+        在代码对象的副本上逐指令跟踪一次执行，收集执行过的指令
+
+        跟踪会影响自适应解释器，因此与统计特化情况的执行分开进行。
+
+        Returns:
+            与iter_code_objects(code)顺序对应的执行过的字节偏移集合列表
+        """
+        copy = marshal.loads(marshal.dumps(code))
+        executed = {}
+
+        def tracer(frame, event, arg):
+            frame.f_trace_opcodes = True
+            if event == 'opcode':
+                executed.setdefault(frame.f_code, set()).add(frame.f_lasti)
+            return tracer
+
+        calls, self.calls = self.calls, 1
+        sys.settrace(tracer)
+        try:
+            self._exercise(copy, entry)
+        finally:
+            sys.settrace(None)
+            self.calls = calls
+        return [executed.get(code_obj, set()) for code_obj in iter_code_objects(copy)]
+
+    def _profile(self, code, entry, rename=None):
+        """
+        执行代码并收集每个函数的特化情况
+
+        Returns:
+            原始限定名 -> quickened_summary结果
+        """
+        coverage = self._coverage(code, entry)
+        self._exercise(code, entry)
+        functions = {}
+        for code_obj, executed in zip(iter_code_objects(code), coverage):
+            if code_obj is code:
+                continue
+            qualname = getattr(code_obj, 'co_qualname', code_obj.co_name)
+            if rename:
+                qualname = '.'.join(rename.get(part, part) for part in qualname.split('.'))
+            functions.setdefault(qualname, quickened_summary(code_obj, executed))
+        return functions
+
+    def _compare(self, original, obfuscated):
+        """比较原始代码和混淆代码中同名函数的特化情况"""
+        results = []
+        for qualname, before in original.items():
+            after = obfuscated.get(qualname)
+            if after is None or not before['warm']:
+                continue
+            missed = {op: count - before['missed'].get(op, 0)
+                      for op, count in after['missed'].items() if count > before['missed'].get(op, 0)}
+            lost = (not after['warm']) or _ratio(after) < _ratio(before) - self.tolerance
+            results.append({
+                'name': qualname,
+                'before': before,
+                'after': after,
+                'missed': missed,
+                'lost': lost,
+            })
+        return results
+
+    def check(self):
+        """
+        对平坦化源代码和字节码混淆结果分别进行检查
+
+        Returns:
+            检查结果列表，每项为 {'target', 'error', 'layout', 'functions'}
+        """
+        confuser = CompletePythonObfuscator(**self.options)
+        obfuscated_source = confuser.obfuscate(self.source_code, self.input_file)
+        if obfuscated_source.startswith("混淆失败"):
+            raise RuntimeError(obfuscated_source)
+
+        entry = rename_expression(self.entry, confuser.get_name_mapping(), confuser.get_var_mapping())
+        rename = {new: old for old, new in confuser.get_var_mapping().items()}
+        rename.update({new: old for old, new in confuser.get_name_mapping().items()})
+
+        original = self._profile(compile(self.source_code, self.input_file, 'exec'), self.entry)
+
+        bytecode_obfuscator = BytecodeObfuscator(nop_ratio=self.options.get('nop_ratio', 0.2),
+                                                 function_levels=confuser.bytecode_levels)
+        with contextlib.redirect_stdout(io.StringIO()):
+            nop_code = bytecode_obfuscator.obfuscate_bytecode(obfuscated_source, self.input_file)
+        targets = [
+            ('平坦化源代码', compile(obfuscated_source, self.input_file, 'exec')),
+            ('字节码混淆', nop_code),
+        ]
+
+        results = []
+        for target, code in targets:
+            result = {'target': target, 'error': None, 'layout': check_cache_layout(code), 'functions': []}
+            if result['layout']:
+                result['error'] = "内联缓存布局被破坏，未执行"
+            else:
+                try:
+                    result['functions'] = self._compare(original, self._profile(code, entry, rename))
+                except Exception as e:
+                    result['error'] = f"执行失败: {type(e).__name__}: {e}"
+            results.append(result)
+        return results
+
+
+def format_specialization_report(results):
+    """
+    生成特化检查报告
+
+    Returns:
+        报告文本行列表
+    """
+    lines = []
+    for result in results:
+        lines.append(f"  [{result['target']}]")
+        for qualname, offset, name in result['layout']:
+            lines.append(f"    {qualname} 偏移 {offset}: {name} 之后缺少CACHE项")
+        if result['error']:
+            lines.append(f"    {result['error']}")
+            continue
+        lost = [f for f in result['functions'] if f['lost']]
+        for func in result['functions']:
+            before, after = func['before'], func['after']
+            line = (f"    {func['name']}: 特化 {before['specialized']}/{before['specializable']} -> "
+                    f"{after['specialized']}/{after['specializable']}")
+            if not after['warm']:
+                line += " (混淆后未被加速)"
+            if func['missed']:
+                line += ", 新增未特化: " + ', '.join(f"{op} x{count}" for op, count in sorted(func['missed'].items()))
+            if func['lost']:
+                line += " <- 丢失特化"
+            lines.append(line)
+        if not result['functions']:
+            lines.append("    没有被样例入口执行到的函数")
+        lines.append(f"    丢失特化的函数: {len(lost)}")
+    return lines
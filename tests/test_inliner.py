@@ -0,0 +1,43 @@
+import ast
+
+from mods.inliner import inline_functions
+
+
+SOURCE = '''
+def reveal(obj):
+    return obj.__secret
+
+def double(value):
+    return value * 2
+
+class User:
+    def get(self):
+        return reveal(self)
+
+    def twice(self, value):
+        return double(value)
+
+def read(obj):
+    return reveal(obj)
+
+user = User()
+setattr(user, '__secret', 42)
+'''
+
+
+def run(tree):
+    namespace = {}
+    exec(compile(tree, '<test>', 'exec'), namespace)
+    return namespace
+
+
+def test_private_names_not_inlined_into_methods():
+    """__x形式的名称在类体内会被改编，含有它们的函数不能内联到方法中"""
+    tree, report = inline_functions(ast.parse(SOURCE))
+    assert report == {'twice': ['double'], 'read': ['reveal']}
+
+    namespace = run(tree)
+    user = namespace['user']
+    assert user.get() == 42
+    assert user.twice(3) == 6
+    assert namespace['read'](user) == 42
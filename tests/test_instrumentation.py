@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from mods.complete_obfuscator import obfuscate_file
+
+
+SOURCE = '''
+def collatz(n):
+    steps = 0
+    while n != 1:
+        if n % 2:
+            n = 3 * n + 1
+        else:
+            n //= 2
+        steps += 1
+    return steps
+
+def scan(items):
+    total = 0
+    for item in items:
+        if item < 0:
+            continue
+        if item > 50:
+            break
+        total += item
+    return total
+
+for x in range(1, 6):
+    collatz(x)
+    scan([x, -1, 3, 99, 4])
+'''
+
+
+def dispatch_counts(tmp_path, name, **options):
+    """混淆SOURCE并运行结果，返回写入的分发计数"""
+    source = tmp_path / 'sample.py'
+    source.write_text(SOURCE, encoding='utf-8')
+    output = tmp_path / (name + ('.pyc' if options.get('compile_to_pyc') else '.py'))
+    counts = tmp_path / f'{name}.json'
+    message = obfuscate_file(str(source), str(output), instrument_output=str(counts), seed=0, **options)
+    assert not message.startswith('混淆失败'), message
+    subprocess.run([sys.executable, str(output)], check=True, capture_output=True,
+                   env=dict(os.environ, OBF_DISPATCH_COUNTS=str(counts)))
+    return json.loads(counts.read_text(encoding='utf-8'))
+
+
+@pytest.mark.skipif(not hasattr(sys, 'monitoring'), reason='需要sys.monitoring (Python 3.12+)')
+@pytest.mark.parametrize('options', [
+    {},
+    {'nested_flatten': True, 'keep_innermost_loops': False, 'max_overhead': 100},
+    {'nested_flatten': True, 'keep_innermost_loops': False, 'max_overhead': 100, 'peephole': False},
+])
+def test_monitoring_matches_counters(tmp_path, options):
+    """同一函数在counters和monitoring方式下的循环轮数和状态转移次数相同，直接编译的pyc也一样"""
+    counters = dispatch_counts(tmp_path, 'counters', instrument='counters', **options)
+    assert counters['collatz'][0] > 0 and counters['collatz'][1] > 0
+
+    assert dispatch_counts(tmp_path, 'monitoring', instrument='monitoring', **options) == counters
+    assert dispatch_counts(tmp_path, 'pyc', instrument='monitoring', compile_to_pyc=True, nop_ratio=0,
+                           **options) == counters
@@ -0,0 +1,50 @@
+import ast
+import contextlib
+import io
+
+from mods.constant_folder import fold_constants
+from mods.module_wrapper import wrap_module_code
+
+
+WALRUS_SOURCE = '''
+data = [1, 2, 3]
+total = [(last := x * 2) for x in data]
+
+def show():
+    return last
+
+print(show())
+'''
+
+
+def run(tree):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        exec(compile(tree, '<test>', 'exec'), {})
+    return output.getvalue()
+
+
+def test_walrus_in_comprehension_stays_global():
+    """推导式中海象运算符的目标绑定在模块作用域，包装后仍然是全局变量"""
+    tree, report = wrap_module_code(ast.parse(WALRUS_SOURCE))
+    assert report
+    assert run(tree) == run(ast.parse(WALRUS_SOURCE)) == '6\n'
+
+
+def test_folding_keeps_walrus_in_comprehension_binding():
+    """推导式中的海象运算符是函数中名称的唯一绑定时，不会因删除分支把局部变量变成全局变量"""
+    source = '''
+last = 'global'
+
+def show():
+    if False:
+        [(last := x) for x in range(3)]
+    return last
+
+try:
+    show()
+except NameError:
+    print('local')
+'''
+    tree, report = fold_constants(ast.parse(source))
+    assert run(tree) == run(ast.parse(source)) == 'local\n'
@@ -0,0 +1,124 @@
+import ast
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mods.complete_obfuscator import obfuscate_source
+
+
+OPTIONS = [
+    {},
+    {'naming': 'short'},
+    {'engine': 'passes'},
+    {'nested_flatten': True, 'granularity': 'block'},
+    {'fold': True, 'inline': True},
+    {'flatten_scope': 'all'},
+    {'localize': True},
+]
+
+# 所有调用使用同一个构建种子，输出只取决于各自的输入和选项
+SEED = 1
+
+
+def module_source(i):
+    """第i个输入模块，函数名和类名带编号，便于发现来自其他调用的映射表和报告"""
+    return f'''
+def scale_{i}(value):
+    return value * {i + 1}
+
+def total_{i}(values):
+    result = 0
+    for value in values:
+        if value % 2:
+            result += scale_{i}(value)
+        else:
+            result -= 1
+    return result
+
+class Counter{i}:
+    def count(self, values):
+        seen = 0
+        for value in values:
+            if value > {i}:
+                seen += 1
+        return seen
+
+RESULT = (total_{i}(range(20)), Counter{i}().count(range(10)))
+'''
+
+
+def run_module(tree):
+    namespace = {}
+    exec(compile(tree, '<test>', 'exec'), namespace)
+    return namespace['RESULT']
+
+
+def defined_names(tree):
+    """结果AST中定义的所有函数名和类名"""
+    return {node.name for node in ast.walk(tree)
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))}
+
+
+def snapshot(result):
+    """结果中随调用变化的全部内容"""
+    return (result.source, result.name_mapping, result.var_mapping, result.flatten_stats,
+            result.flatten_skipped, result.peephole_report, result.naming_report)
+
+
+def assert_own_state(result, i):
+    """映射表和报告只涉及本次调用的输入"""
+    assert set(result.name_mapping) == {f'scale_{i}', f'total_{i}'}
+    names = defined_names(result.tree)
+    assert set(result.name_mapping.values()) <= names
+    for report in (result.flatten_stats, result.flatten_skipped, result.peephole_report):
+        for qualname in report:
+            assert set(qualname.split('.')) <= names, qualname
+
+
+@pytest.fixture
+def frequent_switches():
+    """缩短线程切换间隔，使并发调用在有GIL的解释器上也充分交错"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_seeded_calls_match_sequential(frequent_switches):
+    """指定种子时，线程池中并发调用的结果与顺序调用逐字节相同"""
+    jobs = [(i, OPTIONS[i % len(OPTIONS)]) for i in range(3 * len(OPTIONS))]
+    expected = {i: snapshot(obfuscate_source(module_source(i), '<test>', seed=SEED, **options))
+                for i, options in jobs}
+
+    order = jobs * 2
+    random.Random(0).shuffle(order)
+    with ThreadPoolExecutor(8) as executor:
+        futures = [(i, executor.submit(obfuscate_source, module_source(i), '<test>', seed=SEED, **options))
+                   for i, options in order]
+        for i, future in futures:
+            result = future.result()
+            assert snapshot(result) == expected[i]
+            assert_own_state(result, i)
+
+
+def test_unseeded_calls_behave_like_input(frequent_switches):
+    """不指定种子时，并发调用的结果可以编译，行为与输入相同，且不包含其他调用的名称"""
+    jobs = [(i, OPTIONS[i % len(OPTIONS)]) for i in range(3 * len(OPTIONS))]
+    with ThreadPoolExecutor(8) as executor:
+        futures = [(i, executor.submit(obfuscate_source, module_source(i), '<test>', **options))
+                   for i, options in jobs]
+        results = [(i, future.result()) for i, future in futures]
+
+    for i, result in results:
+        assert run_module(result.tree) == run_module(ast.parse(module_source(i)))
+        assert run_module(ast.parse(result.source)) == run_module(ast.parse(module_source(i)))
+        assert_own_state(result, i)
+
+
+def test_rejects_unsupported_options():
+    with pytest.raises(ValueError):
+        obfuscate_source(module_source(0), compile_to_pyc=True)
+    with pytest.raises(TypeError):
+        obfuscate_source(module_source(0), rng=random.Random(0))
@@ -0,0 +1,61 @@
+import cProfile
+
+from mods.complete_obfuscator import CompletePythonObfuscator
+from mods.profile_guided import ProfileGuidedPolicy
+
+
+SOURCE = '''
+def work(values):
+    total = 0
+    for value in values:
+        total += value % 7
+    return total
+
+class Worker:
+    def run(self, values):
+        total = 0
+        for value in values:
+            if value % 3:
+                total += value
+        return total
+
+RESULT = (work(range(20000)), Worker().run(range(20000)))
+'''
+
+
+def write_profile(tmp_path, filename):
+    """以给定的文件名执行SOURCE并保存剖析数据"""
+    profiler = cProfile.Profile()
+    profiler.runctx(compile(SOURCE, filename, 'exec'), {}, {})
+    path = tmp_path / 'run.prof'
+    profiler.dump_stats(str(path))
+    return str(path)
+
+
+def decisions(obfuscator):
+    return {d['name']: d for d in obfuscator.profile_policy.decisions}
+
+
+def test_summary_counts_only_flattened_functions(tmp_path):
+    """默认'top'范围不平坦化方法，方法的开销不计入统一混淆的基准"""
+    profile = write_profile(tmp_path, '<string>')
+    for scope, method_flattened in (('top', False), ('all', True)):
+        obfuscator = CompletePythonObfuscator(profile_file=profile, hot_threshold=1.0, flatten_scope=scope)
+        obfuscator.obfuscate(SOURCE)
+        found = decisions(obfuscator)
+        assert found['work']['flattened'] and found['work']['tottime'] > 0
+        assert found['run']['flattened'] is method_flattened and found['run']['tottime'] > 0
+
+        uniform = sum(d['tottime'] * d['overhead'] for d in found.values() if d['flattened'])
+        assert f"统一混淆预计额外耗时: {uniform * 1000:.2f} ms" in '\n'.join(obfuscator.profile_summary)
+
+
+def test_in_memory_source_matches_only_same_name(tmp_path):
+    """'<string>'等非路径文件名只匹配剖析数据中相同的文件名，不匹配其他文件中同名同行的函数"""
+    policy = ProfileGuidedPolicy(write_profile(tmp_path, 'other_module.py'), hot_threshold=0.0)
+    assert policy._function_times('<string>') == {}
+    assert policy._function_times('other_module.py')
+
+    policy = ProfileGuidedPolicy(write_profile(tmp_path, '<string>'), hot_threshold=0.0)
+    assert policy._function_times('<string>')
+    assert policy._function_times('<other>') == {}